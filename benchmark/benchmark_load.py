@@ -0,0 +1,574 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Load benchmark of the station/server protocol without the interface. Simulated stations register random rectangles
+of the sky, stream the local maps of the objects within them and request the global map, while an observer
+subscribed to the global map deltas times the fused rows. The throughput, the end-to-end and global map latencies,
+the anomaly detection delay and the server CPU and memory are printed and may be saved to compare a later run with.
+
+Run from the repository root, the headless server is started on the given port unless --external is given:
+    PYTHONPATH=src python -m benchmark.benchmark_load --stations 50 --objects 2000 --duration 30 --save base.json
+    PYTHONPATH=src python -m benchmark.benchmark_load --stations 50 --objects 2000 --duration 30 --compare base.json
+"""
+
+# BUILT-IN PACKAGES
+import argparse
+import asyncio
+import json
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+import numpy as np
+import pandas as pd
+from collections import deque
+from socket import socket, AF_INET, SOCK_STREAM
+from typing import Optional, List, Dict, Deque, Tuple
+
+# PROJECT MODULES
+from src.config import HOST, PORT, SPACE_RANGE, MIN_NOISE_VAL, MAX_NOISE_VAL, REFRESH_TIME, FUSION_SETTLE_SECONDS
+from communication import Data, MessageType, Connection, supported_codecs
+
+# GLOBAL CONSTANTS
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DETECTION = re.compile(r"Detect anomaly: (\d+)")
+
+# Metrics getting worse when they grow, the others getting worse when they drop
+LOWER_IS_BETTER = ('latency_p50_ms', 'latency_p99_ms', 'global_map_p50_ms', 'global_map_p99_ms',
+                   'anomaly_delay_p50_s', 'anomaly_delay_p99_s', 'false_anomalies', 'server_cpu_percent',
+                   'server_peak_rss_mb', 'generator_lag_s')
+
+
+# CLASSES
+class MovingObjects:
+    """Objects moving along straight lines, some of them turning once at a known date."""
+
+    def __init__(self, rng: np.random.Generator, n_objects: int, n_turning: int, duration: float) -> None:
+        """Place the objects and schedule the turns within the middle of the run.
+
+        :param rng: Random generator.
+        :param n_objects: Number of objects.
+        :param n_turning: Number of objects turning once.
+        :param duration: Number of seconds the objects are streamed for.
+        """
+        x1, y1, x2, y2 = SPACE_RANGE
+        self.object_id = np.arange(n_objects, dtype=np.int32)
+        self.x = rng.uniform(x1, x2, n_objects)
+        self.y = rng.uniform(y1, y2, n_objects)
+        self.speed = rng.uniform(5, 15, n_objects)
+        self.heading = rng.uniform(-np.pi, np.pi, n_objects)
+        self.turn = rng.uniform(np.pi / 4, np.pi / 2, n_objects) * rng.choice([-1, 1], n_objects)
+
+        self.turn_time = np.full(n_objects, np.inf)
+        self.turn_time[rng.choice(n_objects, min(n_turning, n_objects), replace=False)] = \
+            rng.uniform(0.3, 0.7, min(n_turning, n_objects)) * duration
+
+    def positions(self, t: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Locate the objects, the directions measured from the y axis as in the generated sky.
+
+        :param t: Seconds since the start of the run.
+        :return: x and y coordinates and directions of the objects.
+        """
+        before = np.minimum(t, self.turn_time)
+        after = np.maximum(0.0, t - self.turn_time)
+        turned = self.heading + self.turn
+        x = self.x + self.speed * (np.sin(self.heading) * before + np.sin(turned) * after)
+        y = self.y + self.speed * (np.cos(self.heading) * before + np.cos(turned) * after)
+        return x, y, np.where(t >= self.turn_time, turned, self.heading)
+
+
+class LoadStation:
+    """Station registering its rectangle, streaming its local maps and timing its global map requests."""
+
+    def __init__(self, location: List[int], rng: int) -> None:
+        """Set the station up without connecting it.
+
+        :param location: Station location.
+        :param rng: Station range.
+        """
+        self.location = location
+        self.range = rng
+        self.connection: Optional[Connection] = None
+        self.requests: Deque[float] = deque()
+        self.global_latencies: List[float] = []
+
+    async def join(self, loop: asyncio.AbstractEventLoop, host: str, port: int) -> bool:
+        """Connect, negotiate the codec and register the rectangle.
+
+        :param loop: Event loop.
+        :param host: Server host.
+        :param port: Server port.
+        :return: Whether the server accepted the station.
+        """
+        sock = socket(AF_INET, SOCK_STREAM)
+        sock.setblocking(False)
+        await loop.sock_connect(sock, (host, port))
+        self.connection = Connection(sock)
+        self.messages = self.connection.async_messages(loop)
+
+        await self.connection.async_send(loop, Data(MessageType.HELLO, supported_codecs()))
+        await self.connection.async_send(loop, Data(MessageType.LOCATION, (self.location, self.range)))
+
+        while True:
+            alert, content = await self.messages.__anext__()
+
+            if alert == MessageType.HELLO:
+                self.connection.codec = content[0]
+
+            elif alert in (MessageType.CONNECTED, MessageType.NOT_CONNECTED, MessageType.REDIRECT):
+                return alert == MessageType.CONNECTED
+
+    async def listen(self) -> None:
+        """Time the global maps until the connection is closed."""
+        try:
+            async for alert, content in self.messages:
+                if alert == MessageType.GLOBAL_MAP and self.requests:
+                    self.global_latencies.append(time.perf_counter() - self.requests.popleft())
+
+        except (ConnectionError, OSError):
+            pass
+
+    async def request_global_maps(self, loop: asyncio.AbstractEventLoop, interval: float, end: float) -> None:
+        """Request the global map at a fixed interval, the first request at a random offset.
+
+        :param loop: Event loop.
+        :param interval: Seconds between the requests.
+        :param end: Monotonic time the requests stop at.
+        """
+        await asyncio.sleep(np.random.uniform(0, interval))
+
+        while time.monotonic() < end:
+            self.requests.append(time.perf_counter())
+            await self.connection.async_send(loop, Data(MessageType.GLOBAL_MAP, ""))
+            await asyncio.sleep(interval)
+
+    def close(self) -> None:
+        """Close the station connection."""
+        if self.connection is not None:
+            self.connection.sock.close()
+
+
+class Observer:
+    """Subscriber of the global map deltas, timing every fused row from its sample date to its arrival."""
+
+    def __init__(self, start_date: np.datetime64) -> None:
+        """Set the observer up without connecting it.
+
+        :param start_date: Sample date of the run start, the older rows are left out.
+        """
+        self.start_date = start_date
+        self.latencies: List[np.ndarray] = []
+        self.rows = 0
+        self.connection: Optional[Connection] = None
+
+    async def run(self, loop: asyncio.AbstractEventLoop, host: str, port: int) -> None:
+        """Subscribe to the global map and acknowledge every delta until the connection is closed.
+
+        :param loop: Event loop.
+        :param host: Server host.
+        :param port: Server port.
+        """
+        sock = socket(AF_INET, SOCK_STREAM)
+        sock.setblocking(False)
+        await loop.sock_connect(sock, (host, port))
+        self.connection = Connection(sock)
+        await self.connection.async_send(loop, Data(MessageType.HELLO, supported_codecs()))
+        await self.connection.async_send(loop, Data(MessageType.GLOBAL_SUBSCRIBE, 0))
+
+        try:
+            async for alert, content in self.connection.async_messages(loop):
+                if alert == MessageType.HELLO:
+                    self.connection.codec = content[0]
+
+                elif alert == MessageType.GLOBAL_DELTA:
+                    now = np.datetime64(pd.Timestamp.now(), 'ns')
+                    watermark, _, rows, _ = content
+                    dates = rows['receive_date'].to_numpy(dtype='datetime64[ns]')
+                    dates = dates[dates >= self.start_date]
+                    self.latencies.append((now - dates) / np.timedelta64(1, 's'))
+                    self.rows += len(dates)
+                    await self.connection.async_send(loop, Data(MessageType.GLOBAL_ACK, watermark))
+
+        except (ConnectionError, OSError):
+            pass
+
+    def close(self) -> None:
+        """Close the observer connection."""
+        if self.connection is not None:
+            self.connection.sock.close()
+
+
+class ServerProcess:
+    """Headless server run as a separate process, its detected anomalies timed from its output."""
+
+    def __init__(self, port: int, backend: str) -> None:
+        """Start the server and wait until it accepts the stations.
+
+        :param port: Server port.
+        :param backend: Storage backend.
+        """
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(filter(None, [os.path.join(ROOT, 'src'), ROOT, env.get('PYTHONPATH')]))
+        self.process = subprocess.Popen([sys.executable, '-u', os.path.join(ROOT, 'src', 'server_headless.py'),
+                                         '--backend', backend, '--port', str(port)],
+                                        stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, env=env, cwd=ROOT)
+        self.started = threading.Event()
+        self.detections: Dict[int, float] = {}
+        threading.Thread(target=self.read_output, daemon=True).start()
+
+        if not self.started.wait(60):
+            self.close()
+            raise RuntimeError("Server did not start")
+
+    @property
+    def pid(self) -> int:
+        """Process ID of the server."""
+        return self.process.pid
+
+    def read_output(self) -> None:
+        """Record the wall clock time every object is first reported anomalous at."""
+        for line in self.process.stdout:
+            if line.startswith("[SERVER STARTED]"):
+                self.started.set()
+
+            match = DETECTION.search(line)
+
+            if match is not None:
+                self.detections.setdefault(int(match.group(1)), time.time())
+
+    def close(self) -> None:
+        """Stop the server."""
+        self.process.terminate()
+        self.process.wait()
+
+
+class ProcessMonitor:
+    """Sampling of the CPU time and resident memory of a process from /proc, on Linux only."""
+
+    def __init__(self, pid: int, interval: float = 0.5) -> None:
+        """Start sampling the process in a background thread.
+
+        :param pid: Process ID.
+        :param interval: Seconds between the samples.
+        """
+        self.pid = pid
+        self.interval = interval
+        self.samples: List[Tuple[float, float, int]] = []
+        self.stopped = threading.Event()
+        self.ticks = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def sample(self) -> Optional[Tuple[float, float, int]]:
+        """Read the CPU time and resident memory of the process.
+
+        :return: Monotonic time, CPU seconds and resident bytes, None when the process cannot be read.
+        """
+        try:
+            with open(f"/proc/{self.pid}/stat") as file:
+                # The fields after the command name, which may contain spaces, from the process state on
+                fields = file.read().rsplit(')', 1)[1].split()
+
+            with open(f"/proc/{self.pid}/statm") as file:
+                resident = int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+        except (OSError, IndexError, ValueError):
+            return None
+
+        return time.monotonic(), (int(fields[11]) + int(fields[12])) / self.ticks, resident
+
+    def run(self) -> None:
+        """Sample the process until stopped."""
+        while not self.stopped.wait(self.interval):
+            sample = self.sample()
+
+            if sample is not None:
+                self.samples.append(sample)
+
+    def stop(self) -> Dict[str, Optional[float]]:
+        """Stop sampling.
+
+        :return: Mean CPU usage in percent of a core and peak resident memory in megabytes.
+        """
+        self.stopped.set()
+
+        if len(self.samples) < 2:
+            return {'server_cpu_percent': None, 'server_peak_rss_mb': None}
+
+        (start, cpu_start, _), (end, cpu_end, _) = self.samples[0], self.samples[-1]
+        return {'server_cpu_percent': 100 * (cpu_end - cpu_start) / (end - start),
+                'server_peak_rss_mb': max(resident for _, _, resident in self.samples) / 2 ** 20}
+
+
+# FUNCTIONS
+def random_stations(rng: np.random.Generator, n_stations: int, min_range: int, max_range: int) -> List[LoadStation]:
+    """Place the stations at random locations of the space with random ranges.
+
+    :param rng: Random generator.
+    :param n_stations: Number of stations.
+    :param min_range: Smallest station range.
+    :param max_range: Largest station range.
+    :return: Stations.
+    """
+    x1, y1, x2, y2 = SPACE_RANGE
+    return [LoadStation([int(rng.integers(x1, x2 + 1)), int(rng.integers(y1, y2 + 1))],
+                        int(rng.integers(min_range, max_range + 1))) for _ in range(n_stations)]
+
+
+def percentile(values: List[float], q: float, scale: float = 1.0) -> Optional[float]:
+    """Compute the percentile of the values.
+
+    :param values: Values.
+    :param q: Percentile from 0 to 100.
+    :param scale: Factor the percentile is multiplied by.
+    :return: Percentile or None without values.
+    """
+    return float(np.percentile(values, q)) * scale if len(values) > 0 else None
+
+
+async def stream(stations: List[LoadStation], objects: MovingObjects, rng: np.random.Generator, rate: float,
+                 duration: float, start: float, start_date: np.datetime64) -> Dict[str, object]:
+    """Send every station the noisy readings of the objects within its rectangle at the given rate.
+
+    :param stations: Joined stations.
+    :param objects: Moving objects.
+    :param rng: Random generator of the noise.
+    :param rate: Local maps sent by every station per second.
+    :param duration: Seconds of streaming.
+    :param start: Monotonic time of the run start.
+    :param start_date: Sample date of the run start.
+    :return: Streaming counters and the time every turning object was first observed after its turn.
+    """
+    loop = asyncio.get_running_loop()
+    x1 = np.array([station.location[0] - station.range for station in stations])[:, None]
+    x2 = np.array([station.location[0] + station.range for station in stations])[:, None]
+    y1 = np.array([station.location[1] - station.range for station in stations])[:, None]
+    y2 = np.array([station.location[1] + station.range for station in stations])[:, None]
+
+    seen = np.zeros(len(objects.object_id), dtype=bool)
+    turn_observed = np.full(len(objects.object_id), np.nan)
+    readings, local_maps, lag = 0, 0, 0.0
+    next_tick = start
+
+    while next_tick - start < duration:
+        await asyncio.sleep(max(0.0, next_tick - time.monotonic()))
+        lag = max(lag, time.monotonic() - next_tick)
+        t = next_tick - start
+        receive_date = start_date + np.timedelta64(int(t * 1e9), 'ns')
+        x, y, direction = objects.positions(t)
+        within = (x >= x1) & (x <= x2) & (y >= y1) & (y <= y2)
+
+        # A turn is only detectable when the object was observed before it and is observed after it
+        visible = within.any(axis=0)
+        first = visible & seen & (t >= objects.turn_time) & np.isnan(turn_observed)
+        turn_observed[first] = time.time()
+        seen |= visible
+
+        sends = []
+
+        for station, rows in zip(stations, within):
+            rows = np.flatnonzero(rows)
+
+            if len(rows) == 0:
+                continue
+
+            noise = rng.integers(MIN_NOISE_VAL, MAX_NOISE_VAL + 1, (2, len(rows)))
+            local_map = pd.DataFrame({'object_id': objects.object_id[rows],
+                                      'speed': objects.speed[rows],
+                                      'direction': direction[rows],
+                                      'x_localization': np.round(x[rows]).astype(np.int32) + noise[0],
+                                      'y_localization': np.round(y[rows]).astype(np.int32) + noise[1],
+                                      'receive_date': receive_date})
+            sends.append(station.connection.async_send(loop, Data(MessageType.LOCAL_MAP, local_map)))
+            readings += len(rows)
+
+        await asyncio.gather(*sends)
+        local_maps += len(sends)
+        next_tick += 1 / rate
+
+    return {'readings': readings, 'local_maps': local_maps, 'lag': lag, 'turn_observed': turn_observed}
+
+
+async def run_load(host: str, port: int, n_stations: int, n_objects: int, n_turning: int, rate: float,
+                   global_interval: float, duration: float, drain: float, min_range: int, max_range: int, seed: int,
+                   server: Optional[ServerProcess]) -> Dict[str, Optional[float]]:
+    """Join the stations and the observer, stream the local maps and collect the metrics.
+
+    :param host: Server host.
+    :param port: Server port.
+    :param n_stations: Number of stations.
+    :param n_objects: Number of objects.
+    :param n_turning: Number of objects turning once.
+    :param rate: Local maps sent by every station per second.
+    :param global_interval: Seconds between the global map requests of every station, 0 for none.
+    :param duration: Seconds of streaming.
+    :param drain: Seconds to wait for the last fused rows after the streaming.
+    :param min_range: Smallest station range.
+    :param max_range: Largest station range.
+    :param seed: Random seed.
+    :param server: Server started by the benchmark, None for an external server.
+    :return: Metrics.
+    """
+    loop = asyncio.get_running_loop()
+    rng = np.random.default_rng(seed)
+    objects = MovingObjects(rng, n_objects, n_turning, duration)
+    stations = random_stations(rng, n_stations, min_range, max_range)
+
+    joined = await asyncio.gather(*[station.join(loop, host, port) for station in stations])
+    accepted = [station for station, ok in zip(stations, joined) if ok]
+
+    start_date = np.datetime64(pd.Timestamp.now(), 'ns')
+    observer = Observer(start_date)
+    tasks = [loop.create_task(observer.run(loop, host, port))]
+    tasks += [loop.create_task(station.listen()) for station in accepted]
+
+    start = time.monotonic()
+
+    if global_interval > 0:
+        tasks += [loop.create_task(station.request_global_maps(loop, global_interval, start + duration))
+                  for station in accepted]
+
+    print(f"[LOAD STARTED] {len(accepted)} of {n_stations} stations joined, {n_objects} objects, {rate} maps/s each")
+    streamed = await stream(accepted, objects, rng, rate, duration, start, start_date)
+    await asyncio.sleep(drain)
+    elapsed = time.monotonic() - start
+
+    # A pending read is not woken by closing its socket, so the readers are cancelled first
+    for task in tasks:
+        task.cancel()
+
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    for station in stations:
+        station.close()
+
+    observer.close()
+
+    latencies = np.concatenate(observer.latencies) if observer.latencies else np.array([])
+    global_latencies = [latency for station in accepted for latency in station.global_latencies]
+    metrics = {'stations_joined': len(accepted),
+               'readings_per_second': streamed['readings'] / duration,
+               'local_maps_per_second': streamed['local_maps'] / duration,
+               'fused_rows_per_second': observer.rows / elapsed,
+               'latency_p50_ms': percentile(latencies, 50, 1000),
+               'latency_p99_ms': percentile(latencies, 99, 1000),
+               'global_maps_per_second': len(global_latencies) / elapsed,
+               'global_map_p50_ms': percentile(global_latencies, 50, 1000),
+               'global_map_p99_ms': percentile(global_latencies, 99, 1000),
+               'generator_lag_s': streamed['lag']}
+
+    if server is not None:
+        turn_observed = streamed['turn_observed']
+        expected = np.flatnonzero(~np.isnan(turn_observed))
+        delays = [server.detections[i] - turn_observed[i] for i in expected if i in server.detections]
+        metrics.update({'anomalies_expected': len(expected),
+                        'anomalies_detected': len(delays),
+                        'false_anomalies': sum(np.isinf(objects.turn_time[i]) for i in server.detections),
+                        'anomaly_delay_p50_s': percentile(delays, 50),
+                        'anomaly_delay_p99_s': percentile(delays, 99)})
+
+    return metrics
+
+
+def compare(metrics: Dict[str, Optional[float]], baseline: Dict[str, Optional[float]], tolerance: float) -> bool:
+    """Print every metric next to its baseline and flag the changes for the worse beyond the tolerance.
+
+    :param metrics: Metrics of this run.
+    :param baseline: Metrics of the baseline run.
+    :param tolerance: Relative change tolerated, 0.1 for 10%.
+    :return: Whether no metric regressed.
+    """
+    passed = True
+
+    for name, value in metrics.items():
+        reference = baseline.get(name)
+
+        if value is None or reference is None:
+            continue
+
+        change = (value - reference) / abs(reference) if reference != 0 else 0.0
+        worse = change > tolerance if name in LOWER_IS_BETTER else change < -tolerance
+        passed &= not worse
+        print('{0:<24} {1:>12.2f} {2:>12.2f} {3:>+8.1%}{4}'.format(name, reference, value, change,
+                                                                  '  REGRESSION' if worse else ''))
+
+    return passed
+
+
+def run(args: argparse.Namespace) -> bool:
+    """Run the benchmark against a started or an external server, print the metrics and save or compare them.
+
+    :param args: Command line arguments.
+    :return: Whether no metric regressed against the baseline.
+    """
+    server = None if args.external else ServerProcess(args.port, args.backend)
+    pid = args.pid if args.external else server.pid
+    monitor = ProcessMonitor(pid) if pid is not None else None
+
+    try:
+        metrics = asyncio.run(run_load(args.host, args.port, args.stations, args.objects, args.turning, args.rate,
+                                       args.global_interval, args.duration, args.drain, args.min_range, args.max_range,
+                                       args.seed, server))
+
+    finally:
+        if monitor is not None:
+            usage = monitor.stop()
+
+        if server is not None:
+            server.close()
+
+    if monitor is not None:
+        metrics.update(usage)
+
+    for name, value in metrics.items():
+        print('{0:<24} {1}'.format(name, 'n/a' if value is None else round(float(value), 3)))
+
+    # The load parameters only, the address of the server may differ between the compared runs
+    parameters = {name: value for name, value in vars(args).items()
+                  if name not in ('host', 'port', 'pid', 'save', 'compare', 'tolerance')}
+
+    if args.save is not None:
+        with open(args.save, 'w') as file:
+            json.dump({'parameters': parameters, 'metrics': {name: None if value is None else float(value)
+                                                             for name, value in metrics.items()}}, file, indent=2)
+
+    if args.compare is None:
+        return True
+
+    with open(args.compare) as file:
+        baseline = json.load(file)
+
+    if baseline['parameters'] != parameters:
+        print('[BENCHMARK WARNING] parameters differ from the baseline: {0}'.format(baseline['parameters']))
+
+    print('{0:<24} {1:>12} {2:>12} {3:>8}'.format('metric', 'baseline', 'current', 'change'))
+    return compare(metrics, baseline['metrics'], args.tolerance)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--stations', type=int, default=20, help='number of simulated stations')
+    parser.add_argument('--objects', type=int, default=500, help='number of moving objects')
+    parser.add_argument('--turning', type=int, default=20, help='number of objects turning once, the anomalies')
+    parser.add_argument('--rate', type=float, default=1 / REFRESH_TIME, help='local maps sent by a station per second')
+    parser.add_argument('--global-interval', type=float, default=5.0,
+                        help='seconds between the global map requests of a station, 0 for none')
+    parser.add_argument('--duration', type=float, default=30.0, help='seconds of streaming')
+    parser.add_argument('--drain', type=float, default=2 * FUSION_SETTLE_SECONDS + 1,
+                        help='seconds to wait for the last fused rows')
+    parser.add_argument('--min-range', type=int, default=100, help='smallest station range')
+    parser.add_argument('--max-range', type=int, default=400, help='largest station range')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    parser.add_argument('--host', default=HOST, help='server host')
+    parser.add_argument('--port', type=int, default=PORT, help='server port')
+    parser.add_argument('--backend', default='memory', help='storage backend of the started server')
+    parser.add_argument('--external', action='store_true', help='benchmark the server already running at the port')
+    parser.add_argument('--pid', type=int, help='process ID of the external server, to sample its CPU and memory')
+    parser.add_argument('--save', help='JSON file the parameters and metrics are saved to')
+    parser.add_argument('--compare', help='JSON file of a baseline run the metrics are compared with')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='relative change for the worse flagged')
+    args = parser.parse_args()
+
+    sys.exit(0 if run(args) else 1)
@@ -1,9 +1,15 @@
-from sqlalchemy import Column, Integer, DateTime, Float
+from datetime import datetime, timedelta
+from sqlalchemy import Column, Integer, DateTime, Float, String, Index, Table, MetaData, inspect, text
 from sqlalchemy.orm import declarative_base
-from sqlalchemy.engine import Engine
+from sqlalchemy.engine import Connection, Engine
+from typing import Optional
+from src.config import DB_MIGRATE, DB_PARTITIONING, DB_PARTITION_HOURS, DB_PARTITIONS_AHEAD, DB_RETENTION_HOURS
 
 Base = declarative_base()
 
+# Tables partitioned by time on PostgreSQL and their partition key
+PARTITIONED_TABLES = {'data_collector': 'receive_date', 'filtered_results': 'receive_date'}
+
 
 class SpaceDataGenerator(Base):
     """
@@ -11,6 +17,10 @@ class SpaceDataGenerator(Base):
     """
 
     __tablename__ = 'space_data_generator'
+    __table_args__ = (
+        Index('ix_space_data_generator_sample_date_object_id', 'sample_date', 'object_id'),
+        Index('ix_space_data_generator_localization', 'x_localization', 'y_localization'),
+    )
 
     index = Column(Integer, primary_key=True)
     object_id = Column(Integer)
@@ -41,6 +51,10 @@ class DataCollector(Base):
     """
 
     __tablename__ = 'data_collector'
+    __table_args__ = (
+        Index('ix_data_collector_receive_date_object_id', 'receive_date', 'object_id'),
+        Index('ix_data_collector_localization', 'x_localization', 'y_localization'),
+    )
 
     index = Column(Integer, primary_key=True)
     object_id = Column(Integer)
@@ -71,6 +85,10 @@ class FilteredResults(Base):
     """
 
     __tablename__ = 'filtered_results'
+    __table_args__ = (
+        Index('ix_filtered_results_receive_date_object_id', 'receive_date', 'object_id'),
+        Index('ix_filtered_results_localization', 'x_localization', 'y_localization'),
+    )
 
     index = Column(Integer, primary_key=True)
     object_id = Column(Integer)
@@ -93,6 +111,191 @@ class FilteredResults(Base):
         )
 
 
-def create_architecture(engine: Engine):
-    Base.metadata.drop_all(engine)
-    Base.metadata.create_all(engine)
+class TrajectorySummaries(Base):
+    """
+    Class representing the downsampled history of the filtered results, kept after they leave the filtered_results table.
+    """
+
+    __tablename__ = 'trajectory_summaries'
+    __table_args__ = (
+        Index('ix_trajectory_summaries_object_id_receive_date', 'object_id', 'receive_date'),
+    )
+
+    index = Column(Integer, primary_key=True)
+    object_id = Column(Integer)
+    x_localization = Column(Integer)
+    y_localization = Column(Integer)
+    direction = Column(Float)
+    receive_date = Column(DateTime)
+    point_type = Column(String(8))
+
+    def __repr__(self):
+        """
+        Return a string representation of the TrajectorySummaries object.
+        """
+        return "<TrajectorySummaries(index={0}, object_id={1}, x_localization={2}, y_localization={3}, direction={4}, receive_date={5}, point_type={6})>".format(
+            self.index,
+            self.object_id,
+            self.x_localization,
+            self.y_localization,
+            self.direction,
+            self.receive_date,
+            self.point_type
+        )
+
+
+def create_architecture(engine: Engine, migrate: bool = DB_MIGRATE, partitioning: bool = DB_PARTITIONING) -> None:
+    """Create the tables and their indexes.
+
+    :param engine: SQLAlchemy Engine object representing the database connection.
+    :param migrate: Keep the existing tables with their data and only create the missing tables and indexes,
+        otherwise all tables are dropped first.
+    :param partitioning: Partition the data_collector and filtered_results tables by time, PostgreSQL only. An
+        existing table created without partitions is kept as it is and left unpartitioned.
+    :return: None
+    """
+    if not migrate:
+        Base.metadata.drop_all(engine)
+
+    partitioning = partitioning and engine.dialect.name == 'postgresql'
+    metadata = MetaData()
+
+    for table in Base.metadata.sorted_tables:
+        if inspect(engine).has_table(table.name):
+            for index in table.indexes:
+                index.create(engine, checkfirst=True)
+
+        elif partitioning and table.name in PARTITIONED_TABLES:
+            partitioned_table(table, PARTITIONED_TABLES[table.name], metadata).create(engine)
+
+        else:
+            table.create(engine)
+
+    if partitioning:
+        with engine.connect() as connection:
+            for table_name in PARTITIONED_TABLES:
+                if not is_partitioned(connection, table_name):
+                    print("[PARTITIONING] {0} already exists without partitions and is left unpartitioned, "
+                          "recreate it with DB_MIGRATE = False to partition it".format(table_name))
+        maintain_partitions(engine)
+
+
+def is_partitioned(connection: Connection, table_name: str) -> bool:
+    """Check whether the table is partitioned, PostgreSQL only.
+
+    :param connection: Database connection.
+    :param table_name: Name of the table.
+    :return: True if the table is partitioned.
+    """
+    return connection.execute(text("SELECT relkind FROM pg_class WHERE relname = :table_name AND relkind = 'p'"),
+                              {'table_name': table_name}).first() is not None
+
+
+def partitioned_table(table: Table, partition_key: str, metadata: MetaData) -> Table:
+    """Copy the table definition as a table partitioned by range of the partition key.
+
+    PostgreSQL requires the primary key of a partitioned table to contain the partition key.
+
+    :param table: Table definition.
+    :param partition_key: Name of the date column the rows are partitioned by.
+    :param metadata: MetaData object the copy is added to.
+    :return: Partitioned table definition.
+    """
+    columns = [Column(column.name, column.type, primary_key=column.primary_key or column.name == partition_key,
+                      autoincrement=column.primary_key)
+               for column in table.columns]
+    indexes = [Index(index.name, *[column.name for column in index.columns]) for index in table.indexes]
+    return Table(table.name, metadata, *columns, *indexes, postgresql_partition_by='RANGE ({0})'.format(partition_key))
+
+
+def partition_name(table_name: str, start: datetime) -> str:
+    """Name of the partition holding the rows from the given start date.
+
+    :param table_name: Name of the partitioned table.
+    :param start: Start date of the partition.
+    :return: Partition name.
+    """
+    return '{0}_p{1:%Y%m%d%H}'.format(table_name, start)
+
+
+def maintain_partitions(engine: Engine, now: Optional[datetime] = None, interval_hours: int = DB_PARTITION_HOURS,
+                        partitions_ahead: int = DB_PARTITIONS_AHEAD, retention_hours: int = DB_RETENTION_HOURS) -> None:
+    """Create the partitions of the coming hours and drop the ones older than the retention, PostgreSQL only.
+
+    Each partitioned table also gets a default partition, so a row outside all the partitions is never rejected.
+    PostgreSQL refuses a new partition while the default one holds rows of its range, so these rows are moved
+    into the new partition when it is created, and the rows of the default partition older than the retention
+    are deleted. Tables created without partitions are skipped.
+
+    :param engine: SQLAlchemy Engine object representing the database connection.
+    :param now: Current time, defaults to the wall clock.
+    :param interval_hours: Number of hours covered by a single partition.
+    :param partitions_ahead: Number of partitions created after the current one.
+    :param retention_hours: Number of hours after which a partition is dropped.
+    :return: None
+    """
+    if engine.dialect.name != 'postgresql':
+        return
+
+    now = datetime.now() if now is None else now
+    interval = timedelta(hours=interval_hours)
+    current = now.replace(minute=0, second=0, microsecond=0) - timedelta(hours=now.hour % interval_hours)
+    expired = now - timedelta(hours=retention_hours)
+
+    with engine.begin() as connection:
+        for table_name in PARTITIONED_TABLES:
+            if not is_partitioned(connection, table_name):
+                continue
+
+            partition_key = PARTITIONED_TABLES[table_name]
+            default = '{0}_default'.format(table_name)
+            connection.execute(text('CREATE TABLE IF NOT EXISTS {0} PARTITION OF {1} DEFAULT'.format(
+                default, table_name)))
+            connection.execute(text('DELETE FROM {0} WHERE {1} < :expired'.format(default, partition_key)),
+                               {'expired': expired})
+
+            for i in range(partitions_ahead + 1):
+                start = current + i * interval
+                create_partition(connection, table_name, partition_key, start, start + interval)
+
+            partitions = connection.execute(text(
+                "SELECT child.relname FROM pg_inherits "
+                "JOIN pg_class parent ON pg_inherits.inhparent = parent.oid "
+                "JOIN pg_class child ON pg_inherits.inhrelid = child.oid "
+                "WHERE parent.relname = :table_name"), {'table_name': table_name}).scalars().all()
+
+            for partition in partitions:
+                try:
+                    start = datetime.strptime(partition[len(table_name) + 2:], '%Y%m%d%H')
+                except ValueError:
+                    continue
+
+                if start + interval <= expired:
+                    connection.execute(text('DROP TABLE IF EXISTS {0}'.format(partition)))
+
+
+def create_partition(connection: Connection, table_name: str, partition_key: str, start: datetime,
+                     end: datetime) -> None:
+    """Create the partition of the range unless it exists, moving the rows of the range out of the default partition.
+
+    :param connection: Database connection, inside a transaction.
+    :param table_name: Name of the partitioned table.
+    :param partition_key: Name of the date column the rows are partitioned by.
+    :param start: Start date of the partition, inclusive.
+    :param end: End date of the partition, exclusive.
+    :return: None
+    """
+    name = partition_name(table_name, start)
+    if connection.execute(text('SELECT to_regclass(:name)'), {'name': name}).scalar() is not None:
+        return
+
+    default = '{0}_default'.format(table_name)
+    in_range = '{0} >= :start AND {0} < :end'.format(partition_key)
+    bounds = {'start': start, 'end': end}
+    connection.execute(text('CREATE TEMPORARY TABLE moved_rows ON COMMIT DROP AS SELECT * FROM {0} WHERE {1}'.format(
+        default, in_range)), bounds)
+    connection.execute(text('DELETE FROM {0} WHERE {1}'.format(default, in_range)), bounds)
+    connection.execute(text("CREATE TABLE {0} PARTITION OF {1} FOR VALUES FROM ('{2}') TO ('{3}')".format(
+        name, table_name, start, end)))
+    connection.execute(text('INSERT INTO {0} SELECT * FROM moved_rows'.format(table_name)))
+    connection.execute(text('DROP TABLE moved_rows'))
@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+from src.config import FUSION_GATE
+
+# Columns of the fused rows, those of the filtered_results table
+FUSED_COLUMNS = ['object_id', 'x_localization', 'y_localization', 'direction', 'receive_date']
+
+
+def fuse_samples(object_id: np.ndarray, speed: np.ndarray, direction: np.ndarray, x: np.ndarray, y: np.ndarray,
+                 receive_date: np.ndarray, gate: float = FUSION_GATE) -> pd.DataFrame:
+    """Fuse the readings of every sample into a single position.
+
+    Shared by the in-memory storage and the fusion engine of the server, so both fuse the readings the same way.
+
+    :param object_id: Object IDs of the readings.
+    :param speed: Object speeds of the readings.
+    :param direction: Object directions of the readings.
+    :param x: x coordinates of the readings.
+    :param y: y coordinates of the readings.
+    :param receive_date: Sample dates of the readings.
+    :param gate: Multiple of the object speed within which a reading must lie from the sample median to be fused.
+    :return: Fused rows with the columns of the filtered_results table.
+    """
+    if len(object_id) == 0:
+        return pd.DataFrame(columns=FUSED_COLUMNS)
+
+    # A sample is the set of readings of the same object, direction and date, one per observing station
+    order = np.lexsort((direction, receive_date, object_id))
+    object_id, speed, direction = object_id[order], speed[order], direction[order]
+    x, y, receive_date = x[order], y[order], receive_date[order]
+
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = (object_id[1:] != object_id[:-1]) | (receive_date[1:] != receive_date[:-1]) \
+        | (direction[1:] != direction[:-1])
+    sample = np.cumsum(first) - 1
+    n_samples = sample[-1] + 1
+
+    starts = np.flatnonzero(first)
+    count = np.bincount(sample, minlength=n_samples)
+    median_x = group_median(sample, x, starts, count)
+    median_y = group_median(sample, y, starts, count)
+
+    # Readings further than the gate from the sample median are outliers, unless all of them are
+    kept = np.hypot(x - median_x[sample], y - median_y[sample]) <= gate * speed
+    kept |= np.bincount(sample, weights=kept, minlength=n_samples)[sample] == 0
+
+    n_kept = np.bincount(sample, weights=kept, minlength=n_samples)
+    # Rounded once here, as the coordinates are stored as integers by every backend
+    fused_x = np.rint(np.bincount(sample, weights=x * kept, minlength=n_samples) / n_kept).astype(np.int64)
+    fused_y = np.rint(np.bincount(sample, weights=y * kept, minlength=n_samples) / n_kept).astype(np.int64)
+
+    return pd.DataFrame({'object_id': object_id[first],
+                         'x_localization': fused_x,
+                         'y_localization': fused_y,
+                         'direction': direction[first],
+                         'receive_date': receive_date[first]})
+
+
+def group_median(group: np.ndarray, values: np.ndarray, starts: np.ndarray, count: np.ndarray) -> np.ndarray:
+    """Compute the median of the values of every group.
+
+    :param group: Sorted group numbers of the values.
+    :param values: Values.
+    :param starts: Index of the first value of every group.
+    :param count: Number of values in every group.
+    :return: Medians of the groups.
+    """
+    ordered = values[np.lexsort((values, group))]
+
+    return (ordered[starts + (count - 1) // 2] + ordered[starts + count // 2]) / 2
@@ -0,0 +1,178 @@
+import numpy as np
+import pandas as pd
+from datetime import datetime, timedelta
+from pandas import DataFrame
+from sqlalchemy import Table, MetaData, select, delete, insert, and_, or_, func, distinct, bindparam
+from sqlalchemy.engine import Engine
+from typing import Dict, Optional, Iterable
+from src.config import READINGS_RETENTION_SECONDS, RESULTS_RETENTION_SECONDS, SUMMARY_INTERVAL_SECONDS
+
+SUMMARY_COLUMNS = ['object_id', 'x_localization', 'y_localization', 'direction', 'receive_date', 'point_type']
+
+
+class DatabaseMaintenance:
+    def __init__(self, engine: Engine, readings_retention: float = READINGS_RETENTION_SECONDS,
+                 results_retention: float = RESULTS_RETENTION_SECONDS,
+                 summary_interval: float = SUMMARY_INTERVAL_SECONDS):
+        """
+        A class for keeping the tables written by the server small.
+
+        The readings are deleted once too old to be fused, while the filtered results leaving the time the server
+        queries are downsampled into the trajectory_summaries table before being deleted.
+
+        :param engine: SQLAlchemy Engine object representing the database connection.
+        :param readings_retention: Number of seconds a reading is kept.
+        :param results_retention: Number of seconds a filtered result is kept.
+        :param summary_interval: Number of seconds between the kept points of a trajectory.
+        """
+        self.engine = engine
+        self.readings_retention = timedelta(seconds=readings_retention)
+        self.results_retention = timedelta(seconds=results_retention)
+        self.summary_interval = summary_interval
+
+        self.data_collector = Table('data_collector', MetaData(), autoload_with=engine)
+        self.filtered_results = Table('filtered_results', MetaData(), autoload_with=engine)
+        self.trajectory_summaries = Table('trajectory_summaries', MetaData(), autoload_with=engine)
+
+        collector, results, summaries = self.data_collector.c, self.filtered_results.c, self.trajectory_summaries.c
+
+        self.expire_readings_stmt = delete(self.data_collector).where(collector.receive_date < bindparam('cutoff'))
+        self.expired_results_stmt = (
+            select([
+                results.index,
+                results.object_id,
+                results.x_localization,
+                results.y_localization,
+                results.direction,
+                results.receive_date
+            ])
+            .where(results.receive_date < bindparam('cutoff'))
+        )
+
+        # The trajectories continue from the last summary point of every object, written by the previous runs
+        latest = (
+            select([summaries.object_id, func.max(summaries.receive_date).label('receive_date')])
+            .where(summaries.object_id.in_(bindparam('objects', expanding=True)))
+            .group_by(summaries.object_id)
+            .subquery()
+        )
+        self.last_points_stmt = (
+            select([summaries.object_id, summaries.direction, summaries.receive_date, summaries.point_type])
+            .select_from(self.trajectory_summaries.join(latest, and_(
+                summaries.object_id == latest.c.object_id,
+                summaries.receive_date == latest.c.receive_date
+            )))
+        )
+
+        # Results written while compacting are left for the next run, so none is deleted without its summary
+        self.expire_results_stmt = (
+            delete(self.filtered_results)
+            .where(
+                and_(
+                    results.receive_date < bindparam('cutoff'),
+                    results.index <= bindparam('last_index')
+                )
+            )
+        )
+
+        # The objects whose trajectory goes on in the results left after the deletion
+        self.remaining_objects_stmt = (
+            select([distinct(results.object_id)])
+            .where(or_(results.receive_date >= bindparam('cutoff'), results.index > bindparam('last_index')))
+        )
+
+    def run(self, now: Optional[datetime] = None) -> Dict[str, int]:
+        """Expire the readings and compact the filtered results in a single transaction.
+
+        :param now: Current time, defaults to the wall clock.
+        :return: Numbers of the deleted readings and results and of the added summary points.
+        """
+        now = datetime.now() if now is None else now
+        with self.engine.begin() as connection:
+            readings = connection.execute(self.expire_readings_stmt, {'cutoff': now - self.readings_retention}).rowcount
+
+            cutoff = now - self.results_retention
+            expired = pd.DataFrame(connection.execute(self.expired_results_stmt, {'cutoff': cutoff}).fetchall(),
+                                   columns=['index', 'object_id', 'x_localization', 'y_localization', 'direction',
+                                            'receive_date'])
+
+            results, summaries = 0, pd.DataFrame(columns=SUMMARY_COLUMNS)
+            if not expired.empty:
+                objects = [int(object_id) for object_id in expired['object_id'].unique()]
+                last_index = int(expired['index'].max())
+                previous = pd.DataFrame(connection.execute(self.last_points_stmt, {'objects': objects}).fetchall(),
+                                        columns=['object_id', 'direction', 'receive_date', 'point_type'])
+                remaining = [row[0] for row in connection.execute(self.remaining_objects_stmt, {
+                    'cutoff': cutoff, 'last_index': last_index
+                }).fetchall()]
+                summaries = summarize_trajectories(expired, self.summary_interval, previous, remaining)
+
+                connection.execute(insert(self.trajectory_summaries), summaries.to_dict(orient='records'))
+                results = connection.execute(self.expire_results_stmt, {
+                    'cutoff': cutoff, 'last_index': last_index
+                }).rowcount
+
+        return report_maintenance(readings, results, len(summaries))
+
+
+def summarize_trajectories(results: DataFrame, interval_seconds: float = SUMMARY_INTERVAL_SECONDS,
+                           previous: Optional[DataFrame] = None, remaining: Optional[Iterable[int]] = None) -> DataFrame:
+    """Downsample the filtered results into the points describing the trajectory of every object.
+
+    A trajectory keeps its start and end, every point where the direction changes, and the first point of every
+    interval in between. The results are compacted slice by slice, so a trajectory continues from the last summary
+    point of the object, unless that point ends it, and only ends when no newer results of the object are left.
+
+    :param results: DataFrame with the object_id, x_localization, y_localization, direction and receive_date columns.
+    :param interval_seconds: Number of seconds between the kept points.
+    :param previous: DataFrame with the object_id, direction, receive_date and point_type of the summary points
+        written before, the newest one of every object continued by the results.
+    :param remaining: IDs of the objects with newer results, whose trajectory does not end in these results.
+    :return: DataFrame with the kept points and their point_type: start, end, turn or sample.
+    """
+    if results.empty:
+        return pd.DataFrame(columns=SUMMARY_COLUMNS)
+
+    results = results.sort_values(['object_id', 'receive_date'], kind='stable')
+    object_id = results['object_id'].to_numpy()
+    direction = results['direction'].to_numpy(dtype=np.float64)
+    receive_date = results['receive_date'].to_numpy(dtype='datetime64[ns]')
+    interval = int(interval_seconds * 1e9)
+    bucket = receive_date.astype(np.int64) // interval
+
+    first = np.ones(len(results), dtype=bool)
+    first[1:] = object_id[1:] != object_id[:-1]
+    last = np.roll(first, -1)
+    previous_direction, previous_bucket = np.roll(direction, 1), np.roll(bucket, 1)
+    continued = np.zeros(len(results), dtype=bool)
+
+    if previous is not None and not previous.empty:
+        previous = previous.sort_values('receive_date', kind='stable').drop_duplicates('object_id', keep='last')
+        previous = previous[previous['point_type'] != 'end'].set_index('object_id')
+        continued = first & np.isin(object_id, previous.index.to_numpy())
+        points = previous.loc[object_id[continued]]
+        previous_direction[continued] = points['direction'].to_numpy(dtype=np.float64)
+        previous_bucket[continued] = points['receive_date'].to_numpy(dtype='datetime64[ns]').astype(np.int64) // \
+            interval
+
+    start = first & ~continued
+    end = last & ~np.isin(object_id, np.fromiter(remaining, dtype=np.int64)) if remaining is not None else last
+    turn = ~start & (direction != previous_direction)
+    sample = start | (bucket != previous_bucket)
+
+    point_type = np.select([start, end, turn, sample], ['start', 'end', 'turn', 'sample'], default='')
+    summaries = results[point_type != ''].drop(columns='index', errors='ignore')
+    return summaries.assign(point_type=point_type[point_type != ''])[SUMMARY_COLUMNS].reset_index(drop=True)
+
+
+def report_maintenance(readings: int, results: int, summaries: int) -> Dict[str, int]:
+    """Print the numbers of the rows reclaimed by the maintenance.
+
+    :param readings: Number of the deleted readings.
+    :param results: Number of the deleted filtered results.
+    :param summaries: Number of the summary points the results were compacted into.
+    :return: The numbers by the name of the table.
+    """
+    print("[MAINTENANCE] {0} readings expired, {1} results compacted into {2} summary points".format(
+        readings, results, summaries))
+    return {'data_collector': readings, 'filtered_results': results, 'trajectory_summaries': summaries}
@@ -1,9 +1,11 @@
+import threading
 import pandas as pd
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 from pandas import DateOffset, DataFrame
-from sqlalchemy.engine import Engine
-from sqlalchemy import Table, MetaData, select, and_, DateTime, cast, insert, func, distinct, exists
-from typing import List, Dict
+from sqlalchemy.engine import Engine, Connection
+from sqlalchemy import Table, MetaData, select, and_, or_, insert, func, distinct, exists, bindparam, cast, Integer
+from typing import List, Dict, Tuple, Iterator
 from random import randint
 from src.config import MIN_NOISE_VAL, MAX_NOISE_VAL, PLOT_EXPIRATION_MINUTES, ANOMALY_DETECTION_WINDOW_SECONDS
 
@@ -13,172 +15,274 @@ class DatabaseQueries:
         """
         A class for performing database queries.
 
+        Every statement is built once with bound parameters for the time window bounds, ranges and locations,
+        so the calls only bind new values and hit the compiled cache of the engine. Time filters compare the bare
+        columns with the bounds, which lets the database use the indexes on the date columns.
+
         :param engine: The SQLAlchemy engine to use for connecting to the database.
         """
         self.engine = engine
+        self.local = threading.local()
 
         self.space_data_generator = Table('space_data_generator', MetaData(), autoload_with=engine)
         self.data_collector = Table('data_collector', MetaData(), autoload_with=engine)
         self.filtered_results = Table('filtered_results', MetaData(), autoload_with=engine)
 
-    def get_space_data_in_client_range(self, client_range: int, client_location: List[int],
-                                       time_window: DateOffset) -> DataFrame:
-        """Retrieve selected data for a client within the given range, location, and time window.
+        generator, collector, results = self.space_data_generator.c, self.data_collector.c, self.filtered_results.c
 
-        :param client_range: Integer representing the range around the client's location.
-        :param client_location: List of two integers representing the x and y coordinates of the client's location.
-        :param time_window: DateOffset object representing the time window for retrieving data.
-        :return: DataFrame containing selected data for the client with a noise in localization coordinates.
-        """
-        stmt = (
+        self.space_data_in_client_range_stmt = (
             select([
-                self.space_data_generator.c.object_id,
-                self.space_data_generator.c.speed,
-                self.space_data_generator.c.direction,
-                (self.space_data_generator.c.x_localization + randint(MIN_NOISE_VAL, MAX_NOISE_VAL)).label(
-                    'x_localization'),
-                (self.space_data_generator.c.y_localization + randint(MIN_NOISE_VAL, MAX_NOISE_VAL)).label(
-                    'y_localization'),
-                self.space_data_generator.c.sample_date.label('receive_date')
+                generator.object_id,
+                generator.speed,
+                generator.direction,
+                (generator.x_localization + bindparam('x_noise', type_=Integer)).label('x_localization'),
+                (generator.y_localization + bindparam('y_noise', type_=Integer)).label('y_localization'),
+                generator.sample_date.label('receive_date')
             ])
             .where(
                 and_(
-                    self.space_data_generator.columns.x_localization.between(
-                        client_location[0] - client_range,
-                        client_location[0] + client_range
-                    ),
-                    self.space_data_generator.columns.y_localization.between(
-                        client_location[1] - client_range,
-                        client_location[1] + client_range
-                    ),
-                    cast(self.space_data_generator.columns.sample_date, DateTime).between(
-                        datetime.now() - time_window,
-                        datetime.now()
-                    )
+                    generator.x_localization.between(bindparam('x1'), bindparam('x2')),
+                    generator.y_localization.between(bindparam('y1'), bindparam('y2')),
+                    generator.sample_date.between(bindparam('start'), bindparam('end'))
                 )
             )
         )
-        data_in_client_range = pd.DataFrame(self.engine.execute(stmt).fetchall())
-        if len(data_in_client_range) > 0:
-            data_in_client_range.columns = ['object_id', 'speed', 'direction', 'x_localization', 'y_localization',
-                                            'receive_date']
-        return data_in_client_range
-
-    def add_server_read_positions_info(self, client_receive_data_to_upload: List[Dict]) -> None:
-        """Add information about server read positions to the database.
-        The data_collector connect all result for different source - clients
 
-        :param client_receive_data_to_upload: A list of dictionaries containing position data.
-        :return: None
-        """
-        stmt = (
-            insert(self.data_collector)
-            .values(client_receive_data_to_upload)
+        self.space_data_in_area_stmt = (
+            select([
+                generator.object_id,
+                generator.speed,
+                generator.direction,
+                generator.x_localization,
+                generator.y_localization,
+                generator.sample_date.label('receive_date')
+            ])
+            .where(
+                and_(
+                    generator.x_localization.between(bindparam('x1'), bindparam('x2')),
+                    generator.y_localization.between(bindparam('y1'), bindparam('y2')),
+                    generator.sample_date.between(bindparam('start'), bindparam('end'))
+                )
+            )
         )
-        self.engine.execute(stmt)
-
-    def grouped_information_of_objects_localization(self, time_window: DateOffset) -> None:
-        """grouped information of objects localization within a specified time window and send to filtered_results.
 
-        :param time_window: The time window to connect all the values in temporary table data_collector.
-        :return: None
-        """
-        grouped_stmt = (
+        # A reading is kept when another reading of the same object sample lies close to it, or when it is alone
+        other = self.data_collector.alias('other')
+        same_sample = and_(other.c.object_id == collector.object_id,
+                           other.c.receive_date == collector.receive_date,
+                           other.c.index != collector.index)
+        close = func.sqrt(
+            func.power(collector.x_localization - other.c.x_localization, 2) +
+            func.power(collector.y_localization - other.c.y_localization, 2)
+        ) <= 1.5 * collector.speed
+        self.grouped_stmt = (
             select([
-                self.data_collector.columns.object_id,
-                func.avg(self.data_collector.c.x_localization).label('x_localization'),
-                func.avg(self.data_collector.c.y_localization).label('y_localization'),
-                self.data_collector.columns.direction,
-                self.data_collector.columns.receive_date,
+                collector.object_id,
+                cast(func.round(func.avg(collector.x_localization)), Integer).label('x_localization'),
+                cast(func.round(func.avg(collector.y_localization)), Integer).label('y_localization'),
+                collector.direction,
+                collector.receive_date,
             ])
             .where(
                 and_(
-                    cast(self.data_collector.columns.receive_date, DateTime) >= datetime.now() - time_window,
-                    cast(self.data_collector.columns.receive_date, DateTime) <= datetime.now(),
-                    func.sqrt(
-                        func.power(
-                            self.data_collector.c.x_localization - self.data_collector.alias().c.x_localization, 2) +
-                        func.power(
-                            self.data_collector.c.y_localization - self.data_collector.alias().c.y_localization, 2)
-                    ) <= 1.5 * self.data_collector.columns.speed
+                    collector.receive_date.between(bindparam('start'), bindparam('end')),
+                    or_(
+                        exists().where(and_(same_sample, close)),
+                        ~exists().where(same_sample)
+                    )
                 )
             )
             .group_by(
-                self.data_collector.c.object_id,
-                self.data_collector.c.direction,
-                self.data_collector.c.receive_date
+                collector.object_id,
+                collector.direction,
+                collector.receive_date
             )
         )
-        data_to_upload = pd.DataFrame(self.engine.execute(grouped_stmt).fetchall())
-
-        if not data_to_upload.empty:
-            data_to_upload.columns = ['object_id', 'x_localization', 'y_localization', 'direction', 'receive_date']
-            upload_stmt = (
-                insert(self.filtered_results)
-                .values(data_to_upload.to_dict(orient='records'))
-            )
-            self.engine.execute(upload_stmt)
-
-    def get_result(self) -> DataFrame:
-        """Get the result from the filtered_results table.
 
-        :return: DataFrame: A DataFrame containing the object IDs, x localization, and y localization.
-        """
-        stmt = (
+        self.result_stmt = (
             select([
-                self.filtered_results.columns.object_id,
-                self.filtered_results.columns.x_localization,
-                self.filtered_results.columns.y_localization
+                results.object_id,
+                results.x_localization,
+                results.y_localization
             ])
-            # .where(
-            #     cast(self.data_collector.columns.receive_date, DateTime) >= datetime.now() - pd.DateOffset(
-            #         minutes=PLOT_EXPIRATION_MINUTES)
-            # )
+            .where(results.receive_date >= bindparam('start'))
         )
-        return pd.DataFrame(self.engine.execute(stmt).fetchall())
 
-    def detecting_anomaly(self) -> List[int]:
-        subquery = (
+        self.result_since_stmt = (
             select([
-                self.filtered_results.columns.object_id,
-                self.filtered_results.columns.direction
+                results.index,
+                results.object_id,
+                results.x_localization,
+                results.y_localization,
+                results.receive_date
             ])
-
             .where(
                 and_(
-                    cast(self.filtered_results.columns.receive_date, DateTime) >= datetime.now() - pd.DateOffset(ANOMALY_DETECTION_WINDOW_SECONDS),
-                    cast(self.filtered_results.columns.receive_date, DateTime) <= datetime.now()
+                    results.index > bindparam('watermark'),
+                    results.receive_date >= bindparam('start')
                 )
             )
-            .group_by(
-                self.filtered_results.columns.object_id,
-                self.filtered_results.columns.direction
-            )
-        ).alias("subquery")
-
-        stmt = (
-            select(distinct(self.filtered_results.columns.object_id))
-            .select_from(
-                self.filtered_results.join(subquery, self.filtered_results.columns.object_id == subquery.c.object_id))
-            .where(self.filtered_results.c.direction != subquery.c.direction)
+            .order_by(results.index)
         )
 
-        checking_anomaly = pd.DataFrame(self.engine.execute(stmt).fetchall(), columns=['object_id'])
-        return checking_anomaly['object_id'].tolist()
+        # An object seen within the window is anomalous when its rows have more than one direction, which finds
+        # the same objects as joining every row with the directions seen within the window in a single pass
+        seen = select([results.object_id]).where(results.receive_date.between(bindparam('start'), bindparam('end')))
+        self.anomaly_stmt = (
+            select([results.object_id])
+            .where(results.object_id.in_(seen))
+            .group_by(results.object_id)
+            .having(func.count(distinct(results.direction)) > 1)
+        )
 
-    def get_anomaly_detection_point(self, object_id: int, time_of_detection_anomaly: pd.DateOffset) -> pd.DataFrame:
-        stmt = (
+        self.anomaly_detection_point_stmt = (
             select([
-                self.filtered_results.columns.object_id,
-                self.filtered_results.columns.x_localization,
-                self.filtered_results.columns.y_localization
+                results.object_id,
+                results.x_localization,
+                results.y_localization
             ])
             .where(
                 and_(
-                    self.filtered_results.columns.object_id == object_id,
-                    cast(self.filtered_results.columns.receive_date, DateTime) <= time_of_detection_anomaly
+                    results.object_id == bindparam('object_id'),
+                    results.receive_date <= bindparam('end')
                 )
             )
             .limit(1)
         )
-        return pd.DataFrame(self.engine.execute(stmt).fetchall())
+
+    @contextmanager
+    def connect(self) -> Iterator[Connection]:
+        """Check out the connection of the calling thread and run the block in a single transaction.
+
+        The connection is kept open between the calls, while the transaction ends with the block, so no lock
+        outlives the call.
+
+        :return: Connection of the calling thread.
+        """
+        connection = getattr(self.local, 'connection', None)
+        if connection is None or connection.closed:
+            connection = self.local.connection = self.engine.connect()
+        with connection.begin():
+            yield connection
+
+    def get_space_data_in_client_range(self, client_range: int, client_location: List[int],
+                                       time_window: DateOffset) -> DataFrame:
+        """Retrieve selected data for a client within the given range, location, and time window.
+
+        :param client_range: Integer representing the range around the client's location.
+        :param client_location: List of two integers representing the x and y coordinates of the client's location.
+        :param time_window: DateOffset object representing the time window for retrieving data.
+        :return: DataFrame containing selected data for the client with a noise in localization coordinates.
+        """
+        now = datetime.now()
+        with self.connect() as connection:
+            rows = connection.execute(self.space_data_in_client_range_stmt, {
+                'x_noise': randint(MIN_NOISE_VAL, MAX_NOISE_VAL),
+                'y_noise': randint(MIN_NOISE_VAL, MAX_NOISE_VAL),
+                'x1': client_location[0] - client_range,
+                'x2': client_location[0] + client_range,
+                'y1': client_location[1] - client_range,
+                'y2': client_location[1] + client_range,
+                'start': now - time_window,
+                'end': now
+            }).fetchall()
+        return pd.DataFrame(rows, columns=['object_id', 'speed', 'direction', 'x_localization', 'y_localization',
+                                           'receive_date'])
+
+    def get_space_data_in_area(self, area: Tuple[int, int, int, int], time_window: DateOffset) -> DataFrame:
+        """Retrieve the data within the given rectangle and time window, without any noise.
+
+        A single call serves all the stations whose ranges lie inside the rectangle.
+
+        :param area: Tuple of x1, y1, x2, y2 coordinates of the rectangle.
+        :param time_window: DateOffset object representing the time window for retrieving data.
+        :return: DataFrame containing the data within the rectangle.
+        """
+        x1, y1, x2, y2 = area
+        now = datetime.now()
+        with self.connect() as connection:
+            rows = connection.execute(self.space_data_in_area_stmt, {
+                'x1': x1, 'x2': x2, 'y1': y1, 'y2': y2, 'start': now - time_window, 'end': now
+            }).fetchall()
+        return pd.DataFrame(rows, columns=['object_id', 'speed', 'direction', 'x_localization', 'y_localization',
+                                           'receive_date'])
+
+    def add_server_read_positions_info(self, client_receive_data_to_upload: List[Dict]) -> None:
+        """Add information about server read positions to the database.
+        The data_collector connect all result for different source - clients
+
+        All rows are written with a single executemany in one transaction, so a whole ingestion batch
+        costs one commit.
+
+        :param client_receive_data_to_upload: A list of dictionaries containing position data.
+        :return: None
+        """
+        with self.connect() as connection:
+            connection.execute(insert(self.data_collector), client_receive_data_to_upload)
+
+    def grouped_information_of_objects_localization(self, time_window: DateOffset) -> DataFrame:
+        """grouped information of objects localization within a specified time window and send to filtered_results.
+
+        :param time_window: The time window to connect all the values in temporary table data_collector.
+        :return: DataFrame containing the rows sent to filtered_results.
+        """
+        now = datetime.now()
+        columns = ['object_id', 'x_localization', 'y_localization', 'direction', 'receive_date']
+        with self.connect() as connection:
+            rows = connection.execute(self.grouped_stmt, {'start': now - time_window, 'end': now}).fetchall()
+            data_to_upload = pd.DataFrame(rows, columns=columns)
+
+            if not data_to_upload.empty:
+                connection.execute(insert(self.filtered_results), data_to_upload.to_dict(orient='records'))
+        return data_to_upload
+
+    def add_filtered_results(self, fused_data_to_upload: List[Dict]) -> None:
+        """Add the rows fused outside the database to the filtered_results table.
+
+        :param fused_data_to_upload: A list of dictionaries with the object_id, x_localization, y_localization,
+            direction and receive_date keys.
+        :return: None
+        """
+        with self.connect() as connection:
+            connection.execute(insert(self.filtered_results), fused_data_to_upload)
+
+    def get_result(self) -> DataFrame:
+        """Get the result from the filtered_results table.
+
+        :return: DataFrame: A DataFrame containing the object IDs, x localization, and y localization.
+        """
+        start = datetime.now() - timedelta(minutes=PLOT_EXPIRATION_MINUTES)
+        with self.connect() as connection:
+            rows = connection.execute(self.result_stmt, {'start': start}).fetchall()
+        return pd.DataFrame(rows, columns=['object_id', 'x_localization', 'y_localization'])
+
+    def get_result_since(self, watermark: int) -> DataFrame:
+        """Get the rows added to the filtered_results table after the watermark.
+
+        The index of filtered_results only grows, as the server writes the fused rows one transaction at a time,
+        so a subscriber that knows the highest index it received never misses nor repeats a row.
+
+        :param watermark: Highest index already received by the subscriber, 0 for a full snapshot.
+        :return: DataFrame containing the index, object IDs, x localization, y localization and receive date,
+            ordered by index.
+        """
+        start = datetime.now() - timedelta(minutes=PLOT_EXPIRATION_MINUTES)
+        with self.connect() as connection:
+            rows = connection.execute(self.result_since_stmt, {'watermark': watermark, 'start': start}).fetchall()
+        return pd.DataFrame(rows, columns=['index', 'object_id', 'x_localization', 'y_localization', 'receive_date'])
+
+    def detecting_anomaly(self) -> List[int]:
+        now = datetime.now()
+        with self.connect() as connection:
+            rows = connection.execute(self.anomaly_stmt, {
+                'start': now - timedelta(seconds=ANOMALY_DETECTION_WINDOW_SECONDS),
+                'end': now
+            }).fetchall()
+        return [row.object_id for row in rows]
+
+    def get_anomaly_detection_point(self, object_id: int, time_of_detection_anomaly: pd.DateOffset) -> pd.DataFrame:
+        with self.connect() as connection:
+            rows = connection.execute(self.anomaly_detection_point_stmt, {
+                'object_id': object_id, 'end': time_of_detection_anomaly
+            }).fetchall()
+        return pd.DataFrame(rows, columns=['object_id', 'x_localization', 'y_localization'])
@@ -0,0 +1,155 @@
+import queue
+import numpy as np
+import pandas as pd
+from datetime import datetime, timedelta
+from pandas import DataFrame
+from threading import Thread
+from typing import Callable, Dict, List, Optional
+
+
+class RingBuffer:
+    def __init__(self, columns: Dict[str, str], time_column: str, retention_seconds: float, capacity: int = 4096):
+        """
+        Table of the recent rows held as one circular NumPy array per column.
+
+        The rows are appended at the tail and evicted from the head once older than the retention, so the memory
+        follows the rate of the rows rather than the uptime. The arrays only grow when the unexpired rows fill
+        them, never dropping a row a query may still read.
+
+        :param columns: Names and dtypes of the columns.
+        :param time_column: Name of the column the eviction is based on.
+        :param retention_seconds: Number of seconds a row is kept.
+        :param capacity: Initial number of rows.
+        """
+        self.arrays = {name: np.empty(capacity, dtype=dtype) for name, dtype in columns.items()}
+        self.time_column = time_column
+        self.retention = np.timedelta64(int(retention_seconds * 1e9), 'ns')
+        self.head = 0
+        self.size = 0
+
+    @property
+    def capacity(self) -> int:
+        return len(self.arrays[self.time_column])
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        """Rows of the column from the oldest to the newest, a view unless they wrap around the array end."""
+        array = self.arrays[name]
+        end = self.head + self.size
+        if end <= len(array):
+            return array[self.head:end]
+        return np.concatenate([array[self.head:], array[:end - len(array)]])
+
+    def append(self, rows: DataFrame, now: Optional[datetime] = None) -> None:
+        """Evict the expired rows and append the new ones, rounding the floats stored in integer columns.
+
+        :param rows: DataFrame containing all the columns.
+        :param now: Current time, defaults to the wall clock.
+        """
+        self.evict(now)
+        n_rows = len(rows)
+        if self.size + n_rows > self.capacity:
+            self.grow(max(2 * self.capacity, self.size + n_rows))
+
+        # The new rows are written in at most two parts, before and after the array end
+        start = (self.head + self.size) % self.capacity
+        first = min(n_rows, self.capacity - start)
+        for name, array in self.arrays.items():
+            values = rows[name].to_numpy()
+            if array.dtype.kind == 'i' and values.dtype.kind == 'f':
+                values = np.round(values)
+            array[start:start + first] = values[:first]
+            array[:n_rows - first] = values[first:]
+        self.size += n_rows
+
+    def grow(self, capacity: int) -> None:
+        """Move the rows to larger arrays, the oldest row first."""
+        for name, array in self.arrays.items():
+            grown = np.empty(capacity, dtype=array.dtype)
+            grown[:self.size] = self[name]
+            self.arrays[name] = grown
+        self.head = 0
+
+    def evict(self, now: Optional[datetime] = None) -> int:
+        """Drop the rows older than the retention from the head.
+
+        The rows arrive nearly in time order, so the eviction stops at the first unexpired row and a late row
+        behind it waits for the next call; the queries filter by time anyway.
+
+        :param now: Current time, defaults to the wall clock.
+        :return: Number of evicted rows.
+        """
+        cutoff = np.datetime64(datetime.now() if now is None else now, 'ns') - self.retention
+        unexpired = self[self.time_column] >= cutoff
+        n_expired = int(np.argmax(unexpired)) if unexpired.any() else self.size
+
+        self.head = (self.head + n_expired) % self.capacity
+        self.size -= n_expired
+        return n_expired
+
+    def take(self, rows, columns: List[str]) -> DataFrame:
+        """Select the rows, numbered from the oldest.
+
+        :param rows: Boolean mask, indices or slice of the rows.
+        :param columns: Names of the selected columns.
+        :return: DataFrame containing the selected rows.
+        """
+        return pd.DataFrame({name: self[name][rows] for name in columns}, columns=columns)
+
+    def window(self, time_window: timedelta, now: Optional[datetime] = None) -> np.ndarray:
+        """Mask of the rows within the time window ending now.
+
+        :param time_window: Length of the window.
+        :param now: Current time, defaults to the wall clock.
+        :return: Boolean mask of the rows, numbered from the oldest.
+        """
+        now = datetime.now() if now is None else now
+        time = self[self.time_column]
+        return (time >= np.datetime64(now - time_window, 'ns')) & (time <= np.datetime64(now, 'ns'))
+
+
+class Spiller:
+    def __init__(self, max_pending: int = 1024):
+        """
+        Background writer of the rows to the durable storage, keeping its latency off the hot path.
+
+        The writes run in order in a single daemon thread. When the durable storage falls behind by more than
+        max_pending writes, the new ones are dropped and counted rather than blocking the server.
+
+        :param max_pending: Maximal number of writes waiting in the queue.
+        """
+        self.pending = queue.Queue(maxsize=max_pending)
+        self.dropped = 0
+        self.thread = Thread(target=self.run, name="spill", daemon=True)
+        self.thread.start()
+
+    def spill(self, write: Callable[[List[Dict]], None], rows: List[Dict]) -> None:
+        """Queue the write of the rows.
+
+        :param write: Method of the durable storage writing the rows.
+        :param rows: A list of dictionaries containing the rows.
+        """
+        try:
+            self.pending.put_nowait((write, rows))
+        except queue.Full:
+            self.dropped += len(rows)
+
+    def run(self) -> None:
+        """Write the queued rows until closed."""
+        while True:
+            task = self.pending.get()
+            if task is None:
+                return
+
+            write, rows = task
+            try:
+                write(rows)
+            except Exception as e:
+                print(f"[SPILL ERROR] {e}")
+
+    def close(self) -> None:
+        """Write the queued rows and stop the thread."""
+        self.pending.put(None)
+        self.thread.join()
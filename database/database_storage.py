@@ -0,0 +1,433 @@
+import threading
+import numpy as np
+import pandas as pd
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta
+from pandas import DateOffset, DataFrame
+from random import randint
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+from threading import Thread
+from typing import List, Dict, Tuple, Optional
+from src.config import STORAGE_BACKEND, DB_STRING, SQLITE_PATH, DB_MIGRATE, DB_PARTITIONING, MIN_NOISE_VAL, \
+    MAX_NOISE_VAL, PLOT_EXPIRATION_MINUTES, ANOMALY_DETECTION_WINDOW_SECONDS, FUSION_GATE, RING_BUFFER, \
+    RING_BUFFER_CAPACITY, RING_BUFFER_READINGS_SECONDS, RING_BUFFER_RESULTS_SECONDS, RING_BUFFER_SPILL, \
+    SPILL_QUEUE_SIZE, READINGS_RETENTION_SECONDS, RESULTS_RETENTION_SECONDS, GENERATOR_SEED
+from database.database_architecture import create_architecture, maintain_partitions
+from database.database_fusion import fuse_samples
+from database.database_maintenance import DatabaseMaintenance, SUMMARY_COLUMNS, summarize_trajectories, \
+    report_maintenance
+from database.database_queries import DatabaseQueries
+from database.database_ring_buffer import RingBuffer, Spiller
+from database.database_upload import DatabaseUpload, stream_sky
+
+SPACE_DATA_COLUMNS = {'object_id': 'int64', 'speed': 'float64', 'direction': 'float64', 'x_localization': 'int64',
+                      'y_localization': 'int64', 'sample_date': 'datetime64[ns]'}
+READINGS_COLUMNS = {'object_id': 'int64', 'speed': 'float64', 'direction': 'float64', 'x_localization': 'int64',
+                    'y_localization': 'int64', 'receive_date': 'datetime64[ns]'}
+RESULTS_COLUMNS = {'index': 'int64', 'object_id': 'int64', 'x_localization': 'int64', 'y_localization': 'int64',
+                   'direction': 'float64', 'receive_date': 'datetime64[ns]'}
+SUMMARIES_COLUMNS = {'object_id': 'int64', 'x_localization': 'int64', 'y_localization': 'int64',
+                     'direction': 'float64', 'receive_date': 'datetime64[ns]', 'point_type': 'object'}
+
+
+class StorageBackend(ABC):
+    """
+    Operations of the server storage, implemented over a SQL database or held in memory.
+
+    The method names follow DatabaseQueries, so the SQL backend is the query layer itself.
+    """
+
+    @abstractmethod
+    def add_space_data(self, chunk: DataFrame) -> None:
+        """Add the generated trajectory points to the sky.
+
+        :param chunk: DataFrame with the columns of the space_data_generator table.
+        """
+
+    @abstractmethod
+    def get_space_data_in_client_range(self, client_range: int, client_location: List[int],
+                                       time_window: DateOffset) -> DataFrame:
+        """Retrieve the data within the client range and time window, with a noise in localization coordinates."""
+
+    @abstractmethod
+    def get_space_data_in_area(self, area: Tuple[int, int, int, int], time_window: DateOffset) -> DataFrame:
+        """Retrieve the data within the given rectangle and time window, without any noise."""
+
+    @abstractmethod
+    def add_server_read_positions_info(self, client_receive_data_to_upload: List[Dict]) -> None:
+        """Add the readings of the stations."""
+
+    @abstractmethod
+    def grouped_information_of_objects_localization(self, time_window: DateOffset) -> DataFrame:
+        """Fuse the readings within the time window and add them to the results."""
+
+    @abstractmethod
+    def add_filtered_results(self, fused_data_to_upload: List[Dict]) -> None:
+        """Add the rows fused outside the storage to the results."""
+
+    @abstractmethod
+    def get_result(self) -> DataFrame:
+        """Get the unexpired results."""
+
+    @abstractmethod
+    def get_result_since(self, watermark: int) -> DataFrame:
+        """Get the unexpired results added after the watermark, ordered by index."""
+
+    @abstractmethod
+    def detecting_anomaly(self) -> List[int]:
+        """Get the objects seen within the anomaly detection window whose direction changed."""
+
+    @abstractmethod
+    def get_anomaly_detection_point(self, object_id: int, time_of_detection_anomaly: pd.DateOffset) -> DataFrame:
+        """Get a result of the object from before the detection."""
+
+    def maintain(self) -> None:
+        """Run the periodic housekeeping of the storage."""
+
+    def upload_data(self, background: bool = False, seed: Optional[int] = GENERATOR_SEED) -> Optional[Thread]:
+        """Generate the sky and add it to the storage.
+
+        :param background: Load in a daemon thread and return at once, so the server accepts stations meanwhile.
+        :param seed: Seed of the generator, the servers of a cluster sharing the same sky with the same seed.
+        :return: Loading thread if loading in the background, None otherwise.
+        """
+        if background:
+            thread = Thread(target=stream_sky, args=(self.add_space_data,), kwargs={'seed': seed}, name="upload",
+                            daemon=True)
+            thread.start()
+            return thread
+
+        stream_sky(self.add_space_data, seed=seed)
+
+
+class SQLStorage(DatabaseQueries, StorageBackend):
+    def __init__(self, engine: Engine):
+        """
+        Storage backend over a SQL database, PostgreSQL or SQLite.
+
+        :param engine: SQLAlchemy Engine object representing the database connection, its tables already created.
+        """
+        DatabaseQueries.__init__(self, engine)
+        self.uploader = DatabaseUpload(engine)
+        self.maintenance = DatabaseMaintenance(engine)
+
+    def add_space_data(self, chunk: DataFrame) -> None:
+        """Add the generated trajectory points to the space_data_generator table.
+
+        :param chunk: DataFrame with the columns of the space_data_generator table.
+        """
+        self.uploader.load_chunk(chunk)
+
+    def maintain(self) -> None:
+        """Create the upcoming partitions and drop the expired ones, then expire the readings and compact the results."""
+        if DB_PARTITIONING:
+            maintain_partitions(self.engine)
+        self.maintenance.run()
+
+
+class ColumnarTable:
+    def __init__(self, columns: Dict[str, str], capacity: int = 1024):
+        """
+        Append-only table held as one NumPy array per column, the arrays growing geometrically.
+
+        :param columns: Names and dtypes of the columns.
+        :param capacity: Initial number of rows.
+        """
+        self.arrays = {name: np.empty(capacity, dtype=dtype) for name, dtype in columns.items()}
+        self.size = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        """View of the filled part of the column."""
+        return self.arrays[name][:self.size]
+
+    def append(self, rows: DataFrame) -> None:
+        """Append the rows, growing the arrays when full.
+
+        :param rows: DataFrame containing all the columns.
+        """
+        n_rows = len(rows)
+        capacity = len(next(iter(self.arrays.values())))
+
+        if self.size + n_rows > capacity:
+            capacity = max(2 * capacity, self.size + n_rows)
+            for name, array in self.arrays.items():
+                grown = np.empty(capacity, dtype=array.dtype)
+                grown[:self.size] = array[:self.size]
+                self.arrays[name] = grown
+
+        for name, array in self.arrays.items():
+            values = rows[name].to_numpy()
+            array[self.size:self.size + n_rows] = np.round(values) if array.dtype.kind == 'i' and \
+                values.dtype.kind == 'f' else values
+        self.size += n_rows
+
+    def take(self, rows, columns: List[str]) -> DataFrame:
+        """Select the rows.
+
+        :param rows: Boolean mask, indices or slice of the rows.
+        :param columns: Names of the selected columns.
+        :return: DataFrame containing the selected rows.
+        """
+        return pd.DataFrame({name: self[name][rows] for name in columns}, columns=columns)
+
+    def sort(self, name: str) -> None:
+        """Sort the rows by the column."""
+        order = np.argsort(self[name], kind='stable')
+        for column, array in self.arrays.items():
+            array[:self.size] = array[:self.size][order]
+
+    def keep(self, rows: np.ndarray) -> None:
+        """Keep only the selected rows, in their order.
+
+        :param rows: Boolean mask of the kept rows.
+        """
+        n_kept = int(rows.sum())
+        for array in self.arrays.values():
+            array[:n_kept] = array[:self.size][rows]
+        self.size = n_kept
+
+
+class MemoryStorage(StorageBackend):
+    def __init__(self):
+        """
+        Storage backend held in memory as columnar tables, for single-node deployments and tests.
+
+        The sky is kept sorted by sample date, so a time window is found by binary search. Every operation holds
+        the lock of the storage, as the database executor calls it from several threads.
+        """
+        self.lock = threading.Lock()
+        self.space_data_generator = ColumnarTable(SPACE_DATA_COLUMNS)
+        self.data_collector = ColumnarTable(READINGS_COLUMNS)
+        self.filtered_results = ColumnarTable(RESULTS_COLUMNS)
+        self.trajectory_summaries = ColumnarTable(SUMMARIES_COLUMNS)
+        self.sorted = True
+        self.last_index = 0
+
+    def add_space_data(self, chunk: DataFrame) -> None:
+        with self.lock:
+            self.space_data_generator.append(chunk)
+            self.sorted = False
+
+    def space_data_in_area(self, x1: int, y1: int, x2: int, y2: int, time_window: DateOffset) -> DataFrame:
+        """Select the sky within the rectangle and time window, the lock held by the caller."""
+        sky = self.space_data_generator
+        if not self.sorted:
+            sky.sort('sample_date')
+            self.sorted = True
+
+        now = datetime.now()
+        start = np.searchsorted(sky['sample_date'], np.datetime64(now - time_window, 'ns'), side='left')
+        end = np.searchsorted(sky['sample_date'], np.datetime64(now, 'ns'), side='right')
+        x, y = sky['x_localization'][start:end], sky['y_localization'][start:end]
+        rows = start + np.flatnonzero((x >= x1) & (x <= x2) & (y >= y1) & (y <= y2))
+
+        data = sky.take(rows, list(SPACE_DATA_COLUMNS))
+        return data.rename(columns={'sample_date': 'receive_date'})
+
+    def get_space_data_in_client_range(self, client_range: int, client_location: List[int],
+                                       time_window: DateOffset) -> DataFrame:
+        x, y = client_location
+        with self.lock:
+            data = self.space_data_in_area(x - client_range, y - client_range, x + client_range, y + client_range,
+                                           time_window)
+        data['x_localization'] += randint(MIN_NOISE_VAL, MAX_NOISE_VAL)
+        data['y_localization'] += randint(MIN_NOISE_VAL, MAX_NOISE_VAL)
+        return data
+
+    def get_space_data_in_area(self, area: Tuple[int, int, int, int], time_window: DateOffset) -> DataFrame:
+        with self.lock:
+            return self.space_data_in_area(*area, time_window)
+
+    def add_server_read_positions_info(self, client_receive_data_to_upload: List[Dict]) -> None:
+        with self.lock:
+            self.data_collector.append(pd.DataFrame(client_receive_data_to_upload, columns=list(READINGS_COLUMNS)))
+
+    def grouped_information_of_objects_localization(self, time_window: DateOffset) -> DataFrame:
+        now = datetime.now()
+        with self.lock:
+            readings = self.data_collector
+            receive_date = readings['receive_date']
+            rows = (receive_date >= np.datetime64(now - time_window, 'ns')) & (receive_date <= np.datetime64(now, 'ns'))
+            fused = fuse_samples(readings['object_id'][rows], readings['speed'][rows], readings['direction'][rows],
+                                 readings['x_localization'][rows].astype(np.float64),
+                                 readings['y_localization'][rows].astype(np.float64), receive_date[rows],
+                                 FUSION_GATE)
+            self.add_results(fused)
+        return fused
+
+    def add_filtered_results(self, fused_data_to_upload: List[Dict]) -> None:
+        with self.lock:
+            self.add_results(pd.DataFrame(fused_data_to_upload))
+
+    def add_results(self, fused: DataFrame) -> None:
+        """Add the fused rows to the results with increasing indexes, the lock held by the caller."""
+        if len(fused) == 0:
+            return
+        index = np.arange(self.last_index + 1, self.last_index + len(fused) + 1)
+        self.filtered_results.append(fused.assign(index=index))
+        self.last_index += len(fused)
+
+    def unexpired_results(self) -> np.ndarray:
+        """Mask of the results within the plot expiration time, the lock held by the caller."""
+        start = np.datetime64(datetime.now() - timedelta(minutes=PLOT_EXPIRATION_MINUTES), 'ns')
+        return self.filtered_results['receive_date'] >= start
+
+    def get_result(self) -> DataFrame:
+        with self.lock:
+            return self.filtered_results.take(self.unexpired_results(),
+                                              ['object_id', 'x_localization', 'y_localization'])
+
+    def get_result_since(self, watermark: int) -> DataFrame:
+        with self.lock:
+            rows = self.unexpired_results() & (self.filtered_results['index'] > watermark)
+            return self.filtered_results.take(rows, ['index', 'object_id', 'x_localization', 'y_localization',
+                                                     'receive_date'])
+
+    def detecting_anomaly(self) -> List[int]:
+        now = datetime.now()
+        with self.lock:
+            results = self.filtered_results
+            receive_date = results['receive_date']
+            recent = (receive_date >= np.datetime64(now - timedelta(seconds=ANOMALY_DETECTION_WINDOW_SECONDS), 'ns')) \
+                & (receive_date <= np.datetime64(now, 'ns'))
+            seen = np.unique(results['object_id'][recent])
+            pairs = np.unique(np.stack([results['object_id'], results['direction']]), axis=1)
+
+        objects, n_directions = np.unique(pairs[0].astype(np.int64), return_counts=True)
+        return [int(object_id) for object_id in np.intersect1d(objects[n_directions > 1], seen)]
+
+    def get_anomaly_detection_point(self, object_id: int, time_of_detection_anomaly: pd.DateOffset) -> DataFrame:
+        with self.lock:
+            results = self.filtered_results
+            rows = np.flatnonzero((results['object_id'] == object_id) &
+                                  (results['receive_date'] <= np.datetime64(time_of_detection_anomaly, 'ns')))[:1]
+            return results.take(rows, ['object_id', 'x_localization', 'y_localization'])
+
+    def maintain(self) -> None:
+        """Drop the sky samples older than the plot expiration time and the expired readings, and compact the
+        expired results into the trajectory summaries."""
+        now = datetime.now()
+        with self.lock:
+            sky = self.space_data_generator
+            sky.keep(sky['sample_date'] >= np.datetime64(now - timedelta(minutes=PLOT_EXPIRATION_MINUTES), 'ns'))
+
+            readings = self.data_collector
+            expired_readings = readings['receive_date'] < np.datetime64(
+                now - timedelta(seconds=READINGS_RETENTION_SECONDS), 'ns')
+            readings.keep(~expired_readings)
+
+            results = self.filtered_results
+            expired_results = results['receive_date'] < np.datetime64(
+                now - timedelta(seconds=RESULTS_RETENTION_SECONDS), 'ns')
+            expired = results.take(expired_results, SUMMARY_COLUMNS[:-1])
+            history = self.trajectory_summaries
+            previous = history.take(np.isin(history['object_id'], expired['object_id'].unique()),
+                                    ['object_id', 'direction', 'receive_date', 'point_type'])
+            summaries = summarize_trajectories(expired, previous=previous,
+                                               remaining=np.unique(results['object_id'][~expired_results]))
+            self.trajectory_summaries.append(summaries)
+            results.keep(~expired_results)
+
+        report_maintenance(int(expired_readings.sum()), int(expired_results.sum()), len(summaries))
+
+
+class RingBufferStorage(MemoryStorage):
+    def __init__(self, durable: StorageBackend, spill: bool = RING_BUFFER_SPILL,
+                 capacity: int = RING_BUFFER_CAPACITY):
+        """
+        Storage backend serving the readings and results from ring buffers in memory, in front of a durable backend.
+
+        The fusion and map queries of MemoryStorage run over the ring buffers, which keep only the rows the queries
+        can still read. Every write is also spilled to the durable backend by a background thread, so the history
+        is kept without the server waiting for the database. The sky is served by the durable backend.
+
+        :param durable: Backend keeping the sky and the history.
+        :param spill: Write the readings and results to the durable backend.
+        :param capacity: Initial number of rows of the ring buffers.
+        """
+        super().__init__()
+        self.durable = durable
+        self.data_collector = RingBuffer(READINGS_COLUMNS, 'receive_date', RING_BUFFER_READINGS_SECONDS, capacity)
+        self.filtered_results = RingBuffer(RESULTS_COLUMNS, 'receive_date', RING_BUFFER_RESULTS_SECONDS, capacity)
+        self.spiller = Spiller(SPILL_QUEUE_SIZE) if spill else None
+
+    def add_space_data(self, chunk: DataFrame) -> None:
+        self.durable.add_space_data(chunk)
+
+    def get_space_data_in_client_range(self, client_range: int, client_location: List[int],
+                                       time_window: DateOffset) -> DataFrame:
+        return self.durable.get_space_data_in_client_range(client_range, client_location, time_window)
+
+    def get_space_data_in_area(self, area: Tuple[int, int, int, int], time_window: DateOffset) -> DataFrame:
+        return self.durable.get_space_data_in_area(area, time_window)
+
+    def add_server_read_positions_info(self, client_receive_data_to_upload: List[Dict]) -> None:
+        super().add_server_read_positions_info(client_receive_data_to_upload)
+        if self.spiller is not None:
+            self.spiller.spill(self.durable.add_server_read_positions_info, client_receive_data_to_upload)
+
+    def grouped_information_of_objects_localization(self, time_window: DateOffset) -> DataFrame:
+        fused = super().grouped_information_of_objects_localization(time_window)
+        if self.spiller is not None and len(fused) > 0:
+            self.spiller.spill(self.durable.add_filtered_results, fused.to_dict(orient='records'))
+        return fused
+
+    def add_filtered_results(self, fused_data_to_upload: List[Dict]) -> None:
+        super().add_filtered_results(fused_data_to_upload)
+        if self.spiller is not None:
+            self.spiller.spill(self.durable.add_filtered_results, fused_data_to_upload)
+
+    def maintain(self) -> None:
+        """Evict the expired rows of the ring buffers, even without new writes, and maintain the durable backend."""
+        with self.lock:
+            self.data_collector.evict()
+            self.filtered_results.evict()
+        self.durable.maintain()
+
+
+def sqlite_engine(path: str = SQLITE_PATH) -> Engine:
+    """Create the engine of the embedded SQLite database in WAL mode, so readers never wait for the writer.
+
+    :param path: Database file.
+    :return: SQLAlchemy Engine object.
+    """
+    engine = create_engine('sqlite:///{0}'.format(path))
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, _):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.close()
+
+    return engine
+
+
+def create_storage(backend: str = STORAGE_BACKEND, migrate: bool = DB_MIGRATE, ring_buffer: bool = RING_BUFFER,
+                   db_string: str = DB_STRING, sqlite_path: str = SQLITE_PATH) -> StorageBackend:
+    """Create the storage backend selected at startup.
+
+    :param backend: postgresql for the db_string database, sqlite for the embedded sqlite_path database or memory.
+    :param migrate: Keep the existing tables of the SQL database with their data.
+    :param ring_buffer: Serve the readings and results of a SQL database from ring buffers in memory.
+    :param db_string: URL of the PostgreSQL database.
+    :param sqlite_path: File of the SQLite database.
+    :return: Storage backend.
+    """
+    if backend == 'memory':
+        return MemoryStorage()
+
+    if backend == 'sqlite':
+        engine = sqlite_engine(sqlite_path)
+    elif backend == 'postgresql':
+        engine = create_engine(db_string)
+    else:
+        raise ValueError('Unknown storage backend: {0}'.format(backend))
+
+    create_architecture(engine=engine, migrate=migrate)
+    storage = SQLStorage(engine)
+    return RingBufferStorage(storage) if ring_buffer else storage
@@ -1,58 +1,97 @@
+import io
+import time
 import pandas as pd
 import numpy as np
-import seaborn as sns
-import matplotlib.pyplot as plt
 from datetime import datetime
-from random import uniform, randint, choice
+from threading import Thread
+from sqlalchemy import Table, MetaData, insert
 from sqlalchemy.engine import Engine
 from src.config import SPACE_RANGE, GENERATED_OBJECTS_NUMBER, MIN_NUMBER_OF_SAMPLES, MAX_NUMBER_OF_SAMPLES, \
-    MAX_START_TRAJECTORY_OFFSET_SECONDS, GENERATED_ANOMALY_NUMBER
-from typing import List, Tuple
+    MAX_START_TRAJECTORY_OFFSET_SECONDS, GENERATED_ANOMALY_NUMBER, GENERATOR_SEED, GENERATOR_CHUNK_OBJECTS
+from typing import Tuple, Optional, Iterator, Callable
 
 
 class DatabaseUpload:
-    def __init__(self, engine: Engine):
+    def __init__(self, engine: Engine, n_objects: int = GENERATED_OBJECTS_NUMBER,
+                 n_anomalies: int = GENERATED_ANOMALY_NUMBER, seed: Optional[int] = GENERATOR_SEED):
         """A class for performing database sample data uploading.
 
         :param engine: SQLAlchemy Engine object representing the database connection.
+        :param n_objects: Number of objects moving along straight lines.
+        :param n_anomalies: Number of objects changing their trajectory.
+        :param seed: Seed of the generator, None for a different sky on every run.
         """
         self.engine = engine
-        self.data_to_upload = pd.DataFrame(
-            columns=['object_id', 'speed', 'direction', 'x_localization', 'y_localization', 'sample_date'])
+        self.n_objects = n_objects
+        self.n_anomalies = n_anomalies
+        self.seed = seed
+        self.space_data_generator = Table('space_data_generator', MetaData(), autoload_with=engine)
 
-    def upload_data(self):
-        """Upload the generated data to the database."""
-        self.generate_data_to_upload()
-        self.refactor_data_to_upload()
-        self.data_to_upload.to_sql('space_data_generator', con=self.engine, if_exists='append', index=True)
+    def upload_data(self) -> None:
+        """Stream the generated sky into the space_data_generator table, one chunk of objects at a time."""
+        stream_sky(self.load_chunk, self.n_objects, self.n_anomalies, self.seed)
 
-    def refactor_data_to_upload(self):
-        """Refactor the data to be uploaded.
+    def load_chunk(self, chunk: pd.DataFrame) -> None:
+        """Load the chunk into the space_data_generator table.
 
-        Round the 'speed' column to two decimal places and convert 'x_localization' and 'y_localization'
-        columns to integers.
+        PostgreSQL loads every chunk with COPY, other databases with a single executemany per chunk.
+
+        :param chunk: DataFrame containing the trajectory points.
         """
-        self.data_to_upload['speed'] = np.round(self.data_to_upload['speed'], 2)
-        self.data_to_upload['direction'] = np.round(self.data_to_upload['direction'], 2)
-        self.data_to_upload['x_localization'] = self.data_to_upload['x_localization'].astype('int')
-        self.data_to_upload['y_localization'] = self.data_to_upload['y_localization'].astype('int')
+        if self.engine.dialect.name == 'postgresql':
+            self.copy_chunk(chunk)
+        else:
+            self.insert_chunk(chunk)
 
-    def generate_data_to_upload(self) -> None:
-        """Generate dataframes with trajectory points for uploading.
+    def copy_chunk(self, chunk: pd.DataFrame) -> None:
+        """Load the chunk with the PostgreSQL COPY command.
 
-        :return: None
+        :param chunk: DataFrame containing the trajectory points.
         """
-        dataframes_line_trajectory = [generate_trajectory_points(_) for _ in range(GENERATED_OBJECTS_NUMBER)]
-        dataframes_anomaly_trajectory = [generate_trajectory_points_anomaly(_) for _ in range(GENERATED_OBJECTS_NUMBER, GENERATED_OBJECTS_NUMBER + GENERATED_ANOMALY_NUMBER)]
-        self.data_to_upload = pd.concat([*dataframes_line_trajectory, *dataframes_anomaly_trajectory], ignore_index=True)
-        print(self.data_to_upload)
+        buffer = io.StringIO()
+        chunk.to_csv(buffer, index=False, header=False, date_format='%Y-%m-%d %H:%M:%S.%f')
+        buffer.seek(0)
+
+        connection = self.engine.raw_connection()
+        try:
+            with connection.cursor() as cursor:
+                cursor.copy_expert('COPY space_data_generator ({0}) FROM STDIN WITH (FORMAT csv)'.format(
+                    ', '.join(chunk.columns)), buffer)
+            connection.commit()
+        finally:
+            connection.close()
+
+    def insert_chunk(self, chunk: pd.DataFrame) -> None:
+        """Load the chunk with a single executemany in one transaction.
+
+        The rows are bound straight to the driver, skipping the per-row processing of SQLAlchemy.
+
+        :param chunk: DataFrame containing the trajectory points.
+        """
+        stmt = insert(self.space_data_generator).compile(dialect=self.engine.dialect, column_keys=list(chunk.columns))
+        columns = stmt.positiontup if stmt.positional else list(chunk.columns)
+        chunk = chunk.assign(sample_date=chunk['sample_date'].dt.strftime('%Y-%m-%d %H:%M:%S.%f'))
+        rows = list(zip(*(chunk[column].tolist() for column in columns)))
+
+        if not stmt.positional:
+            rows = [dict(zip(columns, row)) for row in rows]
+
+        with self.engine.begin() as connection:
+            connection.exec_driver_sql(str(stmt), rows)
 
     def plot_uploaded_data(self, minutes_offset: int):
         """Generate a plot of uploaded data
+
+        The sky is generated again with the same seed, so it matches the uploaded one when the seed is set. The plotting
+        packages are imported here, so loading the data never pulls them in.
         """
+        import seaborn as sns
+        import matplotlib.pyplot as plt
+
+        data = pd.concat(generate_sky(self.n_objects, self.n_anomalies, self.seed), ignore_index=True)
         fig, ax = plt.subplots()
         sample_date = datetime.now() + pd.DateOffset(minutes=minutes_offset)
-        sns.scatterplot(data=self.data_to_upload[self.data_to_upload.sample_date <= sample_date], x='x_localization',
+        sns.scatterplot(data=data[data.sample_date <= sample_date], x='x_localization',
                         y='y_localization', hue='object_id', ax=ax)
         ax.legend(loc='center left', bbox_to_anchor=(1, 0.5))
         ax.grid(True)
@@ -62,119 +101,145 @@ class DatabaseUpload:
         plt.show()
 
 
-def generate_trajectory_points(object_id: int):
-    """Generate trajectory points for a specific object.
-
-    :param object_id: ID of the object.
-    :return: DataFrame containing the generated trajectory points.
-    """
-    number_of_sample = randint(MIN_NUMBER_OF_SAMPLES, MAX_NUMBER_OF_SAMPLES)
-    x_location, y_location, speed, direction = generate_line_trajectory_points(number_of_sample=number_of_sample - 1)
-    start_date = datetime.now() + pd.DateOffset(seconds=randint(0, MAX_START_TRAJECTORY_OFFSET_SECONDS))
-    datetime_array = pd.date_range(start=start_date,
-                                   end=start_date + pd.DateOffset(seconds=speed * number_of_sample / 10),
-                                   periods=number_of_sample)
-
-    generated_data = pd.DataFrame({'object_id': object_id,
-                                   'speed': speed,
-                                   'direction': direction,
-                                   'x_localization': x_location,
-                                   'y_localization': y_location,
-                                   'sample_date': datetime_array})
-    return generated_data
-
-
-def generate_line_trajectory_endpoints() -> Tuple[int, int, int, int]:
-    """Generate random line trajectory endpoints.
-
-    :return: tuple containing start_x, start_y, end_x, end_y coordinates of the points on the line.
-    """
-    directions = {
-        'left': lambda: (SPACE_RANGE[0], uniform(SPACE_RANGE[1], SPACE_RANGE[3]), SPACE_RANGE[2], uniform(SPACE_RANGE[1], SPACE_RANGE[3])),
-        'right': lambda: (SPACE_RANGE[2], uniform(SPACE_RANGE[1], SPACE_RANGE[3]), SPACE_RANGE[0], uniform(SPACE_RANGE[1], SPACE_RANGE[3])),
-        'top': lambda: (uniform(SPACE_RANGE[0], SPACE_RANGE[2]), SPACE_RANGE[3], uniform(SPACE_RANGE[0], SPACE_RANGE[2]), SPACE_RANGE[1]),
-        'bottom': lambda: (uniform(SPACE_RANGE[0], SPACE_RANGE[2]), SPACE_RANGE[1], uniform(SPACE_RANGE[0], SPACE_RANGE[2]), SPACE_RANGE[3])
-    }
-    return directions[choice(['left', 'right', 'top', 'bottom'])]()
+def generate_sky(n_objects: int = GENERATED_OBJECTS_NUMBER, n_anomalies: int = GENERATED_ANOMALY_NUMBER,
+                 seed: Optional[int] = GENERATOR_SEED,
+                 chunk_objects: int = GENERATOR_CHUNK_OBJECTS) -> Iterator[pd.DataFrame]:
+    """Generate the trajectory points of all objects, vectorized over chunks of objects.
 
+    The first n_objects objects move along straight lines, the next n_anomalies change their trajectory at a random
+    point. Only a single chunk is held in memory at a time, and the same seed and chunk size always produce the same
+    sky.
 
-def generate_lines(start_x:int, start_y:int, end_x:int, end_y:int, number_of_sample: int):
-    speed = np.hypot((end_x - start_x), (end_y - start_y)) / number_of_sample
-    direction = np.arctan2((end_x - start_x), (end_y - start_y))
-
-    x_shift = (end_x - start_x) / number_of_sample
-    y_shift = (end_y - start_y) / number_of_sample
-
-    x_values = [start_x + i * x_shift for i in range(number_of_sample + 1)]
-    y_values = [start_y + i * y_shift for i in range(number_of_sample + 1)]
-
-    return x_values, y_values, speed, direction
-
-
-def generate_line_trajectory_points(number_of_sample: int) -> Tuple[List, List, float, float]:
-    """Generate random line trajectory.
-
-    :param number_of_sample: Number of points to generate on the line.
-    :return: tuple: Two lists containing the x and y coordinates of the points on the line.
+    :param n_objects: Number of objects moving along straight lines.
+    :param n_anomalies: Number of objects changing their trajectory.
+    :param seed: Seed of the generator, None for a different sky on every run.
+    :param chunk_objects: Number of objects generated at once.
+    :return: Iterator over DataFrames containing the trajectory points of consecutive chunks of objects.
     """
-    return generate_lines(*generate_line_trajectory_endpoints(), number_of_sample=number_of_sample)
+    rng = np.random.default_rng(seed)
+    now = np.datetime64(datetime.now(), 'ns')
+    total = n_objects + n_anomalies
 
+    for first in range(0, total, chunk_objects):
+        object_id = np.arange(first, min(first + chunk_objects, total))
+        yield generate_chunk(rng, object_id, object_id >= n_objects, now)
 
-def generate_anomaly_trajectory_points(number_of_sample: int) -> Tuple[List, List, List, List]:
-    """Generate anomaly line trajectory.
 
-    :param number_of_sample: Number of points to generate on the line.
-    :return: tuple: Two lists containing the x and y coordinates of the points on the line.
-    """
+def stream_sky(load_chunk: Callable[[pd.DataFrame], None], n_objects: int = GENERATED_OBJECTS_NUMBER,
+               n_anomalies: int = GENERATED_ANOMALY_NUMBER, seed: Optional[int] = GENERATOR_SEED) -> None:
+    """Generate the sky chunk by chunk, pass every chunk to the loader and report the load rate.
 
-    anomaly_point_x, anomaly_point_y = (
-        uniform(SPACE_RANGE[0], SPACE_RANGE[2]), uniform(SPACE_RANGE[1], SPACE_RANGE[3]))
+    :param load_chunk: Function storing a single chunk.
+    :param n_objects: Number of objects moving along straight lines.
+    :param n_anomalies: Number of objects changing their trajectory.
+    :param seed: Seed of the generator, None for a different sky on every run.
+    :return: None
+    """
+    start = time.perf_counter()
+    rows = 0
 
-    start_x, start_y, end_x, end_y = generate_line_trajectory_endpoints()
+    for chunk in generate_sky(n_objects, n_anomalies, seed):
+        load_chunk(chunk)
+        rows += len(chunk)
 
-    line_before_anomaly = generate_lines(start_x=start_x,
-                                         end_x=int(anomaly_point_x),
-                                         start_y=start_y,
-                                         end_y=int(anomaly_point_y),
-                                         number_of_sample=number_of_sample // 2)
-    line_after_anomaly = generate_lines(start_x=int(anomaly_point_x),
-                                        end_x=end_x,
-                                        start_y=int(anomaly_point_y),
-                                        end_y=end_y,
-                                        number_of_sample=number_of_sample - (number_of_sample // 2))
-    return line_before_anomaly[0] + line_after_anomaly[0][1:], line_before_anomaly[1] + line_after_anomaly[1][1:], [line_before_anomaly[2], line_after_anomaly[2]], [line_before_anomaly[3], line_after_anomaly[3]]
+    elapsed = time.perf_counter() - start
+    print("[DATA UPLOADED] {0} rows in {1:.2f} s ({2:.0f} rows/s)".format(
+        rows, elapsed, rows / elapsed if elapsed > 0 else 0))
 
 
-def generate_trajectory_points_anomaly(object_id: int):
-    """Generate trajectory points for a specific object.
+def generate_endpoints(rng: np.random.Generator, n: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Generate random line trajectory endpoints on the opposite edges of the space.
 
-    :param object_id: ID of the object.
-    :return: DataFrame containing the generated trajectory points.
+    :param rng: Random generator.
+    :param n: Number of trajectories.
+    :return: tuple containing start_x, start_y, end_x, end_y coordinate arrays.
+    """
+    x1, y1, x2, y2 = SPACE_RANGE
+    side = rng.integers(0, 4, n)
+    along_x = rng.uniform(x1, x2, (2, n))
+    along_y = rng.uniform(y1, y2, (2, n))
+
+    # Sides: 0 - from left, 1 - from right, 2 - from top, 3 - from bottom
+    start_x = np.select([side == 0, side == 1], [x1, x2], along_x[0])
+    start_y = np.select([side == 2, side == 3], [y2, y1], along_y[0])
+    end_x = np.select([side == 0, side == 1], [x2, x1], along_x[1])
+    end_y = np.select([side == 2, side == 3], [y1, y2], along_y[1])
+    return start_x, start_y, end_x, end_y
+
+
+def generate_chunk(rng: np.random.Generator, object_id: np.ndarray, anomalous: np.ndarray,
+                   now: np.datetime64) -> pd.DataFrame:
+    """Generate the trajectory points of a chunk of objects as contiguous arrays.
+
+    Every trajectory consists of two segments joined at the middle sample. Straight trajectories keep the speed and
+    direction of the whole line, anomalous ones turn towards the end point at a random point of the space.
+
+    :param rng: Random generator.
+    :param object_id: IDs of the objects.
+    :param anomalous: Whether each object changes its trajectory.
+    :param now: Date the start offsets are counted from.
+    :return: DataFrame containing the trajectory points, rounded as uploaded.
+    """
+    n_chunk = len(object_id)
+    number_of_sample = rng.integers(MIN_NUMBER_OF_SAMPLES, MAX_NUMBER_OF_SAMPLES + 1, n_chunk)
+    start_x, start_y, end_x, end_y = generate_endpoints(rng, n_chunk)
+    turn_x = np.trunc(rng.uniform(SPACE_RANGE[0], SPACE_RANGE[2], n_chunk))
+    turn_y = np.trunc(rng.uniform(SPACE_RANGE[1], SPACE_RANGE[3], n_chunk))
+    start_offset = rng.integers(0, MAX_START_TRAJECTORY_OFFSET_SECONDS + 1, n_chunk)
+
+    steps = number_of_sample - 1
+    steps_before = steps // 2
+    steps_after = steps - steps_before
+
+    # Straight trajectories pass their middle sample on the line
+    middle_x = np.where(anomalous, turn_x, start_x + (end_x - start_x) * steps_before / steps)
+    middle_y = np.where(anomalous, turn_y, start_y + (end_y - start_y) * steps_before / steps)
+
+    speed_before = np.where(anomalous, np.hypot(middle_x - start_x, middle_y - start_y) / steps_before,
+                            np.hypot(end_x - start_x, end_y - start_y) / steps)
+    speed_after = np.where(anomalous, np.hypot(end_x - middle_x, end_y - middle_y) / steps_after, speed_before)
+    direction_before = np.where(anomalous, np.arctan2(middle_x - start_x, middle_y - start_y),
+                                np.arctan2(end_x - start_x, end_y - start_y))
+    direction_after = np.where(anomalous, np.arctan2(end_x - middle_x, end_y - middle_y), direction_before)
+
+    # Row arrays: the owning object and the sample number within its trajectory
+    owner = np.repeat(np.arange(n_chunk), number_of_sample)
+    sample = np.arange(len(owner)) - np.repeat(np.cumsum(number_of_sample) - number_of_sample, number_of_sample)
+    before = sample < steps_before[owner]
+    sample_after = sample - steps_before[owner]
+
+    x_localization = np.where(
+        before,
+        start_x[owner] + sample * (middle_x - start_x)[owner] / steps_before[owner],
+        middle_x[owner] + sample_after * (end_x - middle_x)[owner] / steps_after[owner])
+    y_localization = np.where(
+        before,
+        start_y[owner] + sample * (middle_y - start_y)[owner] / steps_before[owner],
+        middle_y[owner] + sample_after * (end_y - middle_y)[owner] / steps_after[owner])
+
+    duration = (speed_before + speed_after) / 2 * number_of_sample / 10
+    sample_date = now + ((start_offset[owner] + duration[owner] * sample / steps[owner]) * 1e9).astype('timedelta64[ns]')
+
+    return pd.DataFrame({'object_id': object_id[owner],
+                         'speed': np.round(np.where(before, speed_before[owner], speed_after[owner]), 2),
+                         'direction': np.round(np.where(before, direction_before[owner], direction_after[owner]), 2),
+                         'x_localization': x_localization.astype('int'),
+                         'y_localization': y_localization.astype('int'),
+                         'sample_date': sample_date})
+
+
+def upload_data(engine: Engine, background: bool = False) -> Optional[Thread]:
+    """Upload the generated sky to the database.
+
+    :param engine: SQLAlchemy Engine object representing the database connection.
+    :param background: Load in a daemon thread and return at once, so the server accepts stations meanwhile.
+    :return: Loading thread if loading in the background, None otherwise.
     """
-    number_of_sample = randint(MIN_NUMBER_OF_SAMPLES, MAX_NUMBER_OF_SAMPLES)
-    x_location, y_location, speed, direction = generate_anomaly_trajectory_points(number_of_sample=number_of_sample - 1)
-    start_date = datetime.now() + pd.DateOffset(seconds=randint(0, MAX_START_TRAJECTORY_OFFSET_SECONDS))
-    datetime_array = pd.date_range(start=start_date,
-                                   end=start_date + pd.DateOffset(seconds=np.mean(speed) * number_of_sample / 10),
-                                   periods=number_of_sample)
-
-    generated_data1 = pd.DataFrame({'object_id': object_id,
-                                    'speed': speed[0],
-                                    'direction': direction[0],
-                                    'x_localization': x_location[:(number_of_sample - 1) // 2],
-                                    'y_localization': y_location[:(number_of_sample - 1) // 2],
-                                    'sample_date': datetime_array[:(number_of_sample - 1) // 2]})
-
-    generated_data2 = pd.DataFrame({'object_id': object_id,
-                                    'speed': speed[1],
-                                    'direction': direction[1],
-                                    'x_localization': x_location[(number_of_sample - ((number_of_sample - 1) // 2)) - 1:],
-                                    'y_localization': y_location[(number_of_sample - ((number_of_sample - 1) // 2)) - 1:],
-                                    'sample_date': datetime_array[(number_of_sample - ((number_of_sample - 1) // 2)) - 1:]})
-    return pd.concat([generated_data1, generated_data2], ignore_index=True)
-
-
-def upload_data(engine: Engine):
     DU = DatabaseUpload(engine)
+
+    if background:
+        thread = Thread(target=DU.upload_data, name="upload", daemon=True)
+        thread.start()
+        return thread
+
     DU.upload_data()
-    DU.plot_uploaded_data(minutes_offset=10)
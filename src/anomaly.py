@@ -0,0 +1,361 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# BUILT-IN PACKAGES
+import math
+import numpy as np
+import pandas as pd
+
+from collections import OrderedDict, deque
+from typing import Optional, List, Dict, Tuple, Deque
+
+# PROJECT MODULES
+from config import *
+
+
+# CLASSES
+class AnomalyEvent:
+    """
+    Class to represent the detected change of the object trajectory
+    """
+
+    def __init__(self, object_id: int, reason: str, x: float, y: float, time: pd.Timestamp,
+                 detection_time: pd.Timestamp) -> None:
+        """
+        Constructor
+        :param object_id: Object ID
+        :param reason: Changed quantity, heading or speed
+        :param x: Estimated x coordinate of the change point
+        :param y: Estimated y coordinate of the change point
+        :param time: Estimated date of the change
+        :param detection_time: Date of the reading revealing the change
+        """
+
+        self.object_id = object_id
+        self.reason = reason
+        self.x = x
+        self.y = y
+        self.time = time
+        self.detection_time = detection_time
+
+    def __repr__(self) -> str:
+        """
+        Return a string representation of the AnomalyEvent object
+        """
+
+        return "<AnomalyEvent(object_id={0}, reason={1}, x={2}, y={3}, time={4}, detection_time={5})>".format(
+            self.object_id, self.reason, self.x, self.y, self.time, self.detection_time)
+
+
+class ObjectState:
+    """
+    Class to represent the last known motion of the object
+    """
+
+    def __init__(self, heading: float, x: float, y: float, time: np.datetime64,
+                 trajectory_length: int = ANOMALY_TRAJECTORY_LENGTH) -> None:
+        """
+        Constructor
+        :param heading: Direction of the object
+        :param x: x coordinate of the object
+        :param y: y coordinate of the object
+        :param time: Date of the reading
+        :param trajectory_length: Number of the latest readings kept to locate a change
+        """
+
+        self.heading = heading
+        self.speed: Optional[float] = None
+        self.x = x
+        self.y = y
+        self.time = time
+
+        # Reading the speed is measured from, far enough for the measurement noise to be negligible
+        self.anchor_x = x
+        self.anchor_y = y
+        self.anchor_time = time
+
+        # Readings since the last change, the newest ones only
+        self.trajectory: Deque[Tuple[float, float, np.datetime64]] = deque([(x, y, time)], maxlen=trajectory_length)
+
+
+class AnomalyDetector:
+    """
+    Class to represent the online detection of the trajectory changes, updated with every fused reading
+    """
+
+    def __init__(self, heading_threshold: float = ANOMALY_HEADING_THRESHOLD, speed_ratio: float = ANOMALY_SPEED_RATIO,
+                 speed_smoothing: float = ANOMALY_SPEED_SMOOTHING,
+                 min_displacement: float = ANOMALY_MIN_DISPLACEMENT, state_ttl: float = ANOMALY_STATE_TTL_SECONDS) -> None:
+        """
+        Constructor
+        :param heading_threshold: Change of the direction in radians revealing an anomaly
+        :param speed_ratio: Ratio between the current and the smoothed speed revealing an anomaly
+        :param speed_smoothing: Weight of the current speed in the exponentially smoothed speed
+        :param min_displacement: Distance the object must cover before its speed is measured
+        :param state_ttl: Number of seconds after which an object that is no longer seen is forgotten
+        """
+
+        self.heading_threshold = heading_threshold
+        self.speed_ratio = speed_ratio
+        self.speed_smoothing = speed_smoothing
+        self.min_displacement = min_displacement
+        self.state_ttl = np.timedelta64(int(state_ttl * 1e9), 'ns')
+
+        # Ordered from the least recently seen object, so forgetting the objects never scans the whole state
+        self.states: OrderedDict[int, ObjectState] = OrderedDict()
+        self.events: Dict[int, AnomalyEvent] = {}
+
+    @property
+    def anomalies(self) -> List[int]:
+        """
+        IDs of the objects whose anomaly is remembered
+        """
+
+        return list(self.events)
+
+    def update(self, rows: pd.DataFrame) -> List[AnomalyEvent]:
+        """
+        Method to update the object states with the fused rows
+        :param rows: Fused rows with the object_id, x_localization, y_localization, direction and receive_date columns
+        :return: Anomalies revealed by the rows
+        """
+
+        if len(rows) == 0:
+            return []
+
+        rows = rows.sort_values('receive_date', kind='stable')
+        events = []
+
+        for object_id, x, y, heading, time in zip(rows['object_id'].to_numpy(),
+                                                  rows['x_localization'].to_numpy(dtype=np.float64),
+                                                  rows['y_localization'].to_numpy(dtype=np.float64),
+                                                  rows['direction'].to_numpy(dtype=np.float64),
+                                                  rows['receive_date'].to_numpy(dtype='datetime64[ns]')):
+            event = self.observe(int(object_id), x, y, heading, time)
+
+            if event is not None:
+                events.append(event)
+
+        self.expire(rows['receive_date'].max().to_datetime64())
+
+        return events
+
+    def observe(self, object_id: int, x: float, y: float, heading: float, time: np.datetime64) -> Optional[AnomalyEvent]:
+        """
+        Method to update the state of the object with a single reading
+        :param object_id: Object ID
+        :param x: x coordinate of the object
+        :param y: y coordinate of the object
+        :param heading: Direction of the object
+        :param time: Date of the reading
+        :return: Anomaly revealed by the reading or None
+        """
+
+        state = self.states.get(object_id)
+
+        if state is None:
+            self.states[object_id] = ObjectState(heading, x, y, time)
+            return None
+
+        if time <= state.time:
+            return None
+
+        self.states.move_to_end(object_id)
+        reason = None
+
+        if heading_change(state.heading, heading) > self.heading_threshold:
+            reason = "heading"
+
+        else:
+            displacement = math.hypot(x - state.anchor_x, y - state.anchor_y)
+
+            if displacement >= self.min_displacement:
+                speed = displacement / ((time - state.anchor_time) / np.timedelta64(1, 's'))
+
+                if state.speed is not None and speed_change(state.speed, speed) > self.speed_ratio:
+                    reason = "speed"
+
+                else:
+                    state.speed = speed if state.speed is None else \
+                        state.speed + self.speed_smoothing * (speed - state.speed)
+
+                state.anchor_x, state.anchor_y, state.anchor_time = x, y, time
+
+        previous_heading = state.heading
+        state.heading, state.x, state.y, state.time = heading, x, y, time
+
+        if reason is None:
+            state.trajectory.append((x, y, time))
+            return None
+
+        if reason == "heading":
+            onset_x, onset_y, onset_time = turn_onset(state.trajectory, previous_heading, x, y, time, heading)
+            state.trajectory.clear()
+
+        else:
+            state.trajectory.append((x, y, time))
+            onset_x, onset_y, onset_time = speed_onset(state.trajectory, heading)
+
+            while state.trajectory[0][2] < onset_time:
+                state.trajectory.popleft()
+
+        if not state.trajectory or state.trajectory[-1][2] != time:
+            state.trajectory.append((x, y, time))
+
+        # The motion after the change becomes the new reference
+        state.speed = None
+        state.anchor_x, state.anchor_y, state.anchor_time = x, y, time
+
+        event = AnomalyEvent(object_id, reason, onset_x, onset_y, pd.Timestamp(onset_time), pd.Timestamp(time))
+        self.events[object_id] = event
+
+        return event
+
+    def expire(self, now: np.datetime64) -> None:
+        """
+        Method to forget the objects not seen within the state lifetime, together with their anomalies
+        :param now: Date of the newest reading
+        """
+
+        while self.states:
+            object_id, state = next(iter(self.states.items()))
+
+            if now - state.time <= self.state_ttl:
+                break
+
+            del self.states[object_id]
+            self.events.pop(object_id, None)
+
+
+# FUNCTIONS
+def heading_change(previous: float, current: float) -> float:
+    """
+    Method to compute the angle between the directions
+    :param previous: Previous direction in radians
+    :param current: Current direction in radians
+    :return: Angle between the directions in radians, from 0 to pi
+    """
+
+    return abs((current - previous + math.pi) % (2 * math.pi) - math.pi)
+
+
+def speed_change(previous: float, current: float) -> float:
+    """
+    Method to compute the ratio between the faster and the slower speed
+    :param previous: Previous speed
+    :param current: Current speed
+    :return: Ratio, at least 1
+    """
+
+    slower, faster = sorted((previous, current))
+
+    if slower == 0:
+        return 1.0 if faster == 0 else math.inf
+
+    return faster / slower
+
+
+def direction_vector(heading: float) -> np.ndarray:
+    """
+    Method to get the unit vector of the direction, measured as in the generated trajectories
+    :param heading: Direction in radians
+    :return: Unit vector
+    """
+
+    return np.array([math.sin(heading), math.cos(heading)])
+
+
+def interpolate_time(start: np.datetime64, end: np.datetime64, fraction: float) -> np.datetime64:
+    """
+    Method to get the date between the dates
+    :param start: Earlier date
+    :param end: Later date
+    :param fraction: Position between the dates, from 0 to 1
+    :return: Interpolated date
+    """
+
+    return start + np.timedelta64(int(min(max(fraction, 0.0), 1.0) * int(end - start)), 'ns')
+
+
+def turn_onset(trajectory: Deque[Tuple[float, float, np.datetime64]], heading: float, x: float, y: float,
+               time: np.datetime64, new_heading: float) -> Tuple[float, float, np.datetime64]:
+    """
+    Method to estimate where the object turned, as the intersection of the line fitted to the readings before the
+    turn with the line of the new heading through the reading after it
+    :param trajectory: Readings before the turn
+    :param heading: Direction before the turn
+    :param x: x coordinate of the reading after the turn
+    :param y: y coordinate of the reading after the turn
+    :param time: Date of the reading after the turn
+    :param new_heading: Direction after the turn
+    :return: x and y coordinates and the date of the turn
+    """
+
+    last_x, last_y, last_time = trajectory[-1]
+    before, after = direction_vector(heading), direction_vector(new_heading)
+    centre = np.array([(point_x, point_y) for point_x, point_y, _ in trajectory]).mean(axis=0)
+    onset = np.array([last_x, last_y])
+
+    try:
+        _, behind = np.linalg.solve(np.column_stack([before, -after]), np.array([x, y]) - centre)
+
+        # The turn lies behind the reading after it and ahead of the last reading before it
+        candidate = np.array([x, y]) + behind * after
+
+        if behind <= 0 and np.dot(candidate - onset, before) >= 0:
+            onset = candidate
+
+    except np.linalg.LinAlgError:
+        pass
+
+    covered = math.hypot(onset[0] - last_x, onset[1] - last_y)
+    remaining = math.hypot(x - onset[0], y - onset[1])
+    fraction = covered / (covered + remaining) if covered + remaining > 0 else 0.0
+
+    return float(onset[0]), float(onset[1]), interpolate_time(last_time, time, fraction)
+
+
+def speed_onset(trajectory: Deque[Tuple[float, float, np.datetime64]],
+                heading: float) -> Tuple[float, float, np.datetime64]:
+    """
+    Method to estimate where the object changed its speed, by splitting the readings into the two uniform motions
+    fitting them best
+    :param trajectory: Readings since the previous change, including the one revealing the speed change
+    :param heading: Direction of the object
+    :return: x and y coordinates and the date of the change
+    """
+
+    points = np.array([(point_x, point_y) for point_x, point_y, _ in trajectory])
+    times = np.array([point_time for _, _, point_time in trajectory], dtype='datetime64[ns]')
+    seconds = (times - times[0]) / np.timedelta64(1, 's')
+    distance = points @ direction_vector(heading)
+    best, best_error = len(points) - 1, math.inf
+
+    # Each motion is fitted to at least two readings
+    for split in range(2, len(points) - 1):
+        error = 0.0
+        fits = []
+
+        for part in (slice(0, split), slice(split, len(points))):
+            fit, residuals, *_ = np.polyfit(seconds[part], distance[part], 1, full=True)
+            error += float(residuals[0]) if len(residuals) > 0 else 0.0
+            fits.append(fit)
+
+        if error < best_error:
+            best, best_error = split, error
+            (speed_before, offset_before), (speed_after, offset_after) = fits
+
+    previous, current = best - 1, best
+
+    if math.isinf(best_error) or speed_before == speed_after:
+        fraction = 0.0
+
+    else:
+        crossing = (offset_after - offset_before) / (speed_before - speed_after)
+        span = seconds[current] - seconds[previous]
+        fraction = (crossing - seconds[previous]) / span if span > 0 else 0.0
+
+    fraction = min(max(fraction, 0.0), 1.0)
+    onset = points[previous] + fraction * (points[current] - points[previous])
+
+    return float(onset[0]), float(onset[1]), interpolate_time(times[previous], times[current], fraction)
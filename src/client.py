@@ -12,16 +12,16 @@ import time
 
 from socket import socket, AF_INET, SOCK_STREAM, SOL_SOCKET, SO_REUSEADDR
 from threading import Thread
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Tuple
 from sqlalchemy import create_engine
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 from matplotlib.patches import Rectangle
 
 # PROJECT PACKAGES
 from config import *
-from communication import send, receive, Data
+from communication import Data, MessageType, Connection, supported_codecs
 from database.database_queries import DatabaseQueries
-from utils import draw_map
+from utils import MapRenderer, RenderLoop
 
 
 # CLASSES
@@ -43,9 +43,7 @@ class ClientApp(tk.Tk):
         self.title(TITLE)
 
         # Client socket
-        self.client_sock = socket(AF_INET, SOCK_STREAM)
-        self.client_sock.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
-        self.client_sock.connect((HOST, PORT))
+        self.connect(HOST, PORT)
 
         # Main frame
         container = ttk.Frame(self)
@@ -58,6 +56,19 @@ class ClientApp(tk.Tk):
         frame.pack()
         frame.tkraise()
 
+    def connect(self, host: str, port: int) -> None:
+        """
+        Method to connect to the server and negotiate the codec
+        :param host: Server host
+        :param port: Server port
+        """
+
+        self.client_sock = socket(AF_INET, SOCK_STREAM)
+        self.client_sock.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
+        self.client_sock.connect((host, port))
+        self.connection = Connection(self.client_sock)
+        self.connection.send(Data(MessageType.HELLO, supported_codecs()))
+
 
 class Window(tk.Frame):
     """
@@ -111,6 +122,9 @@ class Window(tk.Frame):
         self.request_button = ttk.Button(self.global_map_tab, text="Get global map", command=self.get_global_map)
         self.request_button.grid(row=0, column=0)
 
+        self.global_map: Optional[pd.DataFrame] = None
+        self.global_watermark = 0
+
         self.global_map_frame = ttk.Frame(self.global_map_tab)
         self.global_map_frame.grid(row=1, column=0)
 
@@ -124,6 +138,7 @@ class Window(tk.Frame):
                           xlabel="x", ylabel="y")
         self.local_canvas = FigureCanvasTkAgg(fig, self.local_map_tab)
         self.local_canvas.get_tk_widget().pack(side=tk.TOP, fill=tk.BOTH, expand=True)
+        self.local_renderer = MapRenderer(self.local_ax, self.local_canvas)
 
         fig = plt.Figure(figsize=(10, 10), dpi=100)
         self.global_ax = fig.add_subplot(1, 1, 1)
@@ -132,9 +147,14 @@ class Window(tk.Frame):
                            xlabel="x", ylabel="y")
         self.global_canvas = FigureCanvasTkAgg(fig, self.global_map_frame)
         self.global_canvas.get_tk_widget().pack(side=tk.TOP, fill=tk.BOTH, expand=True)
+        self.global_renderer = MapRenderer(self.global_ax, self.global_canvas)
 
         self.tabs.hide(1), self.tabs.hide(2)
 
+        # The receiving thread only publishes the maps, drawn by the Tk main loop
+        self.render_loop = RenderLoop(self.root, {'local': self.local_renderer, 'global': self.global_renderer})
+        self.render_loop.start()
+
         Thread(target=self.receive_data).start()
 
     def join(self) -> None:
@@ -152,17 +172,18 @@ class Window(tk.Frame):
             self.location_label.set("")
             self.location = [int(self.location_entries[0].get()), int(self.location_entries[1].get())]
             self.range = int(self.range_entry.get())
-            send(self.root.client_sock, Data("LOCATION", (self.location, self.range)))
+            self.root.connection.send(Data(MessageType.LOCATION, (self.location, self.range)))
 
     def receive_data(self) -> None:
         """
         Method to receive data
         """
 
-        while True:
-            alert, content = receive(self.root.client_sock)
+        for alert, content in self.root.connection.messages():
+            if alert == MessageType.HELLO:
+                self.root.connection.codec = content[0]
 
-            if alert == "NOT CONNECTED":
+            elif alert == MessageType.NOT_CONNECTED:
                 self.join_button["state"] = "normal"
 
                 for entry in self.location_entries:
@@ -174,15 +195,33 @@ class Window(tk.Frame):
                 self.tabs.hide(1), self.tabs.hide(2)
                 self.location_label.set(content)
 
-            elif alert == "GLOBAL MAP":
+            elif alert == MessageType.GLOBAL_MAP:
                 map, locations = content
-                draw_map(self.global_ax, self.global_canvas, map, locations=locations)
+                self.render_loop.publish('global', map, locations=locations)
+
+            elif alert == MessageType.GLOBAL_DELTA:
+                self.update_global_map(*content)
 
-            elif alert == "CONNECTED":
+            elif alert == MessageType.CONNECTED:
                 self.tabs.select(2), self.tabs.select(1)
-                self.engine = create_engine(DB_STRING)
-                self.DQ = DatabaseQueries(engine=self.engine)
-                self.root.after(int(1000 * REFRESH_TIME), self.read_data)
+
+                if SKY_FEED:
+                    self.root.connection.send(Data(MessageType.SKY_FEED, ""))
+
+                else:
+                    self.engine = create_engine(DB_STRING)
+                    self.DQ = DatabaseQueries(engine=self.engine)
+                    self.root.after(int(1000 * REFRESH_TIME), self.read_data)
+
+            elif alert == MessageType.SKY_FEED:
+                self.upload_data(content)
+
+            elif alert == MessageType.REDIRECT:
+                # Another server of the cluster owns the location, the station registers there
+                self.root.client_sock.close()
+                self.root.connect(*content)
+                self.root.connection.send(Data(MessageType.LOCATION, (self.location, self.range)))
+                return self.receive_data()
 
     def read_data(self, i: int = 0):
         if i > 1000:
@@ -194,19 +233,54 @@ class Window(tk.Frame):
         if not data_to_upload.empty:
             print('\n', data_to_upload, '\n')  # TODO delete prints
 
-            draw_map(self.local_ax, self.local_canvas, data_to_upload, locations=[(self.location, self.range)])
-            send(self.root.client_sock, Data("LOCAL MAP", data_to_upload))
+            self.upload_data(data_to_upload)
         else:
             print(i, 'searching...') # TODO delete prints
             pass
         self.root.after(int(1000 * REFRESH_TIME), lambda: self.read_data(i=i + 1))
 
+    def upload_data(self, data_to_upload: pd.DataFrame) -> None:
+        """
+        Method to draw the data detected by the station and send it to the server
+        :param data_to_upload: Data within the station range
+        """
+
+        self.render_loop.publish('local', data_to_upload, locations=[(self.location, self.range)])
+        self.root.connection.send(Data(MessageType.LOCAL_MAP, data_to_upload))
+
     def get_global_map(self):
         """
         Method to get map with all received signals
         self.global_content ~ [locations of stations, ranges of stations]
         """
-        send(self.root.client_sock, Data("GLOBAL MAP", ""))
+        if GLOBAL_MAP_STREAMING:
+            self.request_button["state"] = "disabled"
+            self.root.connection.send(Data(MessageType.GLOBAL_SUBSCRIBE, self.global_watermark))
+
+        else:
+            self.root.connection.send(Data(MessageType.GLOBAL_MAP, ""))
+
+    def update_global_map(self, watermark: int, snapshot: bool, rows: pd.DataFrame,
+                          locations: List[Tuple[Location, int]]) -> None:
+        """
+        Method to merge the rows pushed by the server into the global map and acknowledge them
+        :param watermark: Highest index of the pushed rows
+        :param snapshot: Whether the rows replace the global map
+        :param rows: Global map rows added since the previous acknowledgement
+        :param locations: Locations and ranges of the stations
+        """
+
+        if snapshot or self.global_map is None:
+            self.global_map = rows
+
+        else:
+            expiration = pd.Timestamp.now() - pd.DateOffset(minutes=PLOT_EXPIRATION_MINUTES)
+            self.global_map = pd.concat([self.global_map[self.global_map['receive_date'] >= expiration], rows],
+                                        ignore_index=True)
+
+        self.global_watermark = watermark
+        self.root.connection.send(Data(MessageType.GLOBAL_ACK, watermark))
+        self.render_loop.publish('global', self.global_map, locations=locations)
 
 
 client_app = ClientApp()
@@ -0,0 +1,329 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Servers sharing the sky, each one owning a region: the stations are redirected to the owner of their location and
+the servers forward each other the fused tracks of the objects near the region borders.
+
+A cluster of three servers on one machine, the first one at PORT being the entry point of the stations:
+
+    PYTHONPATH=src python src/cluster.py --nodes 3 --node 0 --seed 1
+    PYTHONPATH=src python src/cluster.py --nodes 3 --node 1 --seed 1
+    PYTHONPATH=src python src/cluster.py --nodes 3 --node 2 --seed 1
+
+Every server keeps its own storage, in memory by default. With --backend sqlite every server gets its own file,
+the node index added to its name, and with --backend postgresql every server must be given its own database with
+--db, as a server recreates the tables of its database at startup.
+"""
+
+# BUILT-IN PACKAGES
+import argparse
+import asyncio
+import os
+import threading
+import numpy as np
+import pandas as pd
+
+from asyncio import AbstractEventLoop
+from socket import socket, AF_INET, SOCK_STREAM
+from typing import Optional, List, Dict, Tuple
+
+# PROJECT MODULES
+from config import *
+from communication import Data, MessageType, Connection
+
+# ALIASES
+ClusterNode = Tuple[str, int, Area]
+
+
+# CLASSES
+class Cluster:
+    """
+    Class to represent the servers of the cluster as seen by one of them
+    """
+
+    def __init__(self, nodes: List[ClusterNode], node: int, margin: float = CLUSTER_HANDOFF_MARGIN,
+                 max_pending: int = CLUSTER_QUEUE_SIZE, timeout: float = CLUSTER_TIMEOUT_SECONDS) -> None:
+        """
+        Constructor
+        :param nodes: Host, port and owned region of every server, the regions splitting the space range
+        :param node: Index of this server
+        :param margin: Distance from a region within which the tracks are forwarded to its owner
+        :param max_pending: Maximal number of batches of fused rows waiting to be forwarded, the newer ones dropped
+        :param timeout: Number of seconds to connect or send to a peer, and to wait before connecting to it again
+        """
+
+        self.nodes = nodes
+        self.node = node
+        self.margin = margin
+        self.timeout = timeout
+        self.peers: Dict[int, Connection] = {}
+        self.retry_at: Dict[int, float] = {}
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_pending)
+        self.dropped = 0
+
+    def owner(self, location: Location) -> int:
+        """
+        Method to find the server owning the location, the region borders belonging to the region after them
+        :param location: Location in the space range
+        :return: Index of the server
+        """
+
+        x, y = location
+        x_max, y_max = SPACE_RANGE[2], SPACE_RANGE[3]
+
+        for i, (_, _, (x1, y1, x2, y2)) in enumerate(self.nodes):
+            if x1 <= x and (x < x2 or x2 == x_max) and y1 <= y and (y < y2 or y2 == y_max):
+                return i
+
+        return self.node
+
+    def address(self, node: int) -> Tuple[str, int]:
+        """
+        Method to get the address of the server
+        :param node: Index of the server
+        :return: Host and port
+        """
+
+        host, port, _ = self.nodes[node]
+
+        return host, port
+
+    def handoffs(self, rows: pd.DataFrame) -> Dict[int, pd.DataFrame]:
+        """
+        Method to select the fused rows every other server needs: the rows within its region widened by the margin
+        :param rows: Fused rows of this server
+        :return: Rows by the index of the server
+        """
+
+        x, y = rows['x_localization'].to_numpy(), rows['y_localization'].to_numpy()
+        handoffs = {}
+
+        for i, (_, _, (x1, y1, x2, y2)) in enumerate(self.nodes):
+            near = (x >= x1 - self.margin) & (x <= x2 + self.margin) & (y >= y1 - self.margin) & \
+                (y <= y2 + self.margin)
+
+            if i != self.node and near.any():
+                handoffs[i] = rows[near]
+
+        return handoffs
+
+    def forward(self, rows: pd.DataFrame) -> None:
+        """
+        Method to queue the fused rows for the other servers without waiting for them, the rows dropped when the
+        queue is full
+        :param rows: Fused rows of this server
+        """
+
+        if len(rows) == 0:
+            return
+
+        try:
+            self.queue.put_nowait(rows)
+
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    async def run(self, loop: AbstractEventLoop) -> None:
+        """
+        Method to send the queued rows near the other regions to their owners until cancelled
+        :param loop: Event loop
+        """
+
+        while True:
+            rows = await self.queue.get()
+
+            for node, tracks in self.handoffs(rows).items():
+                await self.send(loop, node, tracks)
+
+    async def send(self, loop: AbstractEventLoop, node: int, tracks: pd.DataFrame) -> None:
+        """
+        Method to send the tracks to the server, connecting on the first tracks, so the servers may start in any
+        order, and dropping the tracks while the server is unreachable
+        :param loop: Event loop
+        :param node: Index of the server
+        :param tracks: Fused rows near the region of the server
+        """
+
+        if loop.time() < self.retry_at.get(node, 0.0):
+            return
+
+        try:
+            if node not in self.peers:
+                sock = socket(AF_INET, SOCK_STREAM)
+                sock.setblocking(False)
+
+                try:
+                    await asyncio.wait_for(loop.sock_connect(sock, self.address(node)), self.timeout)
+
+                except (OSError, asyncio.TimeoutError):
+                    sock.close()
+                    raise
+
+                self.peers[node] = Connection(sock)
+                await asyncio.wait_for(self.peers[node].async_send(loop, Data(MessageType.PEER, self.node)),
+                                       self.timeout)
+
+            await asyncio.wait_for(self.peers[node].async_send(loop, Data(MessageType.TRACKS, tracks)), self.timeout)
+
+        except (OSError, asyncio.TimeoutError) as e:
+            # A send cut by the timeout leaves a partial message, so the connection is dropped in any case
+            peer = self.peers.pop(node, None)
+
+            if peer is not None:
+                peer.sock.close()
+
+            self.retry_at[node] = loop.time() + self.timeout
+            print(f"[CLUSTER ERROR] node {node}: {e!r}")
+
+
+class TrackSources:
+    """
+    Class to represent the server the fused rows of every object come from: the rows fused by this server are kept,
+    while the rows forwarded by the other servers only fill in the objects this server does not fuse itself, so no
+    object has two rows of the same date or two interleaved tracks
+    """
+
+    def __init__(self, window: float = FUSION_WINDOW_SECONDS) -> None:
+        """
+        Constructor
+        :param window: Number of seconds after the last row fused by this server the object is left to the others
+        """
+
+        self.window = np.timedelta64(int(window * 1e9), 'ns')
+        self.lock = threading.Lock()
+        self.local: Dict[int, np.datetime64] = {}
+        self.merged: Dict[int, np.datetime64] = {}
+
+    def keep_local(self, rows: pd.DataFrame) -> pd.DataFrame:
+        """
+        Method to select the rows fused by this server, except the ones dated no later than a forwarded row
+        :param rows: Fused rows of this server
+        :return: Kept rows
+        """
+
+        with self.lock:
+            kept = rows[~(rows['receive_date'] <= self.latest(self.merged, rows))]
+            self.remember(self.local, kept)
+
+        return kept
+
+    def keep_forwarded(self, rows: pd.DataFrame) -> pd.DataFrame:
+        """
+        Method to select the rows forwarded by another server of the objects not recently fused by this server, except
+        the ones dated no later than a row already kept
+        :param rows: Fused rows of another server
+        :return: Kept rows
+        """
+
+        with self.lock:
+            kept = rows[~(rows['receive_date'] <= self.latest(self.local, rows) + self.window) &
+                        ~(rows['receive_date'] <= self.latest(self.merged, rows))]
+            self.remember(self.merged, kept)
+
+        return kept
+
+    @staticmethod
+    def latest(table: Dict[int, np.datetime64], rows: pd.DataFrame) -> pd.Series:
+        """
+        Method to look up the date of the latest kept row of the object of every row
+        :param table: Date of the latest row by object
+        :param rows: Fused rows
+        :return: Dates, NaT for the objects without a kept row
+        """
+
+        return pd.to_datetime(rows['object_id'].map(table))
+
+    def remember(self, latest: Dict[int, np.datetime64], rows: pd.DataFrame) -> None:
+        """
+        Method to record the date of the latest kept row of every object and forget the objects not seen for longer
+        than the window, the lock held by the caller
+        :param latest: Date of the latest row by object
+        :param rows: Kept rows
+        """
+
+        if len(rows) == 0:
+            return
+
+        latest.update(rows.groupby('object_id')['receive_date'].max().to_dict())
+        cutoff = rows['receive_date'].max() - self.window
+
+        for table in (self.local, self.merged):
+            for object_id in [object_id for object_id, date in table.items() if date < cutoff]:
+                del table[object_id]
+
+
+# FUNCTIONS
+def cluster_nodes(n_nodes: int, host: str = HOST, base_port: int = PORT) -> List[ClusterNode]:
+    """
+    Method to lay the servers out on consecutive ports, each one owning a vertical strip of the space range
+    :param n_nodes: Number of servers
+    :param host: Host of the servers
+    :param base_port: Port of the first server, the entry point of the stations
+    :return: Host, port and owned region of every server
+    """
+
+    x1, y1, x2, y2 = SPACE_RANGE
+    edges = np.linspace(x1, x2, n_nodes + 1).round().astype(int)
+
+    return [(host, base_port + i, (int(edges[i]), y1, int(edges[i + 1]), y2)) for i in range(n_nodes)]
+
+
+def run_node(cluster: Cluster, backend: str = CLUSTER_STORAGE_BACKEND, seed: Optional[int] = GENERATOR_SEED,
+             db: Optional[str] = None) -> None:
+    """
+    Method to run the server of the cluster without the interface until interrupted
+    :param cluster: Cluster with this server
+    :param backend: Storage backend
+    :param seed: Seed of the generated sky, the same for all the servers of the cluster
+    :param db: Database of this server, the URL of a PostgreSQL database or the file of a SQLite database, by default
+        SQLITE_PATH with the node index added to its name, required for PostgreSQL with more than one server
+    """
+
+    # Imported here, as the server core imports this module
+    from database.database_storage import create_storage
+    from server_core import ServerCore
+
+    if backend == "sqlite":
+        root, extension = os.path.splitext(SQLITE_PATH)
+        storage = create_storage(backend, sqlite_path=db or f"{root}_{cluster.node}{extension}")
+
+    elif backend == "postgresql":
+        if db is None and len(cluster.nodes) > 1:
+            raise ValueError("Every server of the cluster needs its own PostgreSQL database, pass it with --db")
+
+        storage = create_storage(backend, db_string=db or DB_STRING)
+
+    else:
+        storage = create_storage(backend)
+
+    storage.upload_data(background=True, seed=seed)
+
+    _, port = cluster.address(cluster.node)
+    core = ServerCore(storage, port=port, cluster=cluster)
+    print("[CLUSTER NODE] {0} of {1} at port {2}, region {3}".format(cluster.node, len(cluster.nodes), port,
+                                                                    cluster.nodes[cluster.node][2]))
+
+    try:
+        asyncio.run(core.accept_clients())
+
+    except KeyboardInterrupt:
+        print("[SERVER STOPPED]")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a server of the cluster sharing the sky by regions")
+    parser.add_argument('--nodes', type=int, default=CLUSTER_SIZE, help='number of servers')
+    parser.add_argument('--node', type=int, default=0, help='index of this server')
+    parser.add_argument('--host', default=HOST, help='host of the servers')
+    parser.add_argument('--base-port', type=int, default=PORT, help='port of the first server')
+    parser.add_argument('--backend', default=CLUSTER_STORAGE_BACKEND,
+                        help='storage backend of this server: memory, sqlite or postgresql')
+    parser.add_argument('--db', help='database of this server: PostgreSQL URL or SQLite file')
+    parser.add_argument('--seed', type=int, default=GENERATOR_SEED, help='seed of the generated sky')
+    args = parser.parse_args()
+
+    if args.backend == "postgresql" and args.db is None and args.nodes > 1:
+        parser.error("every server of the cluster needs its own PostgreSQL database, pass it with --db")
+
+    run_node(Cluster(cluster_nodes(args.nodes, args.host, args.base_port), args.node), args.backend, args.seed, args.db)
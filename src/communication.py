@@ -2,21 +2,176 @@
 # -*- coding: utf-8 -*-
 
 # BUILT-IN PACKAGES
+import asyncio
+import lzma
 import struct
+import threading
+import zlib
+import numpy as np
+import pandas as pd
 
+from asyncio import AbstractEventLoop
+from enum import IntEnum
 from socket import socket
-from pickle import dumps, loads
-from typing import Union, Tuple, List, Optional, Any
+from typing import Union, Tuple, List, Optional, Any, Iterator, AsyncIterator
 
 # PROJECT PACKAGES
+from config import *
+
+# GLOBAL CONSTANTS
+MAGIC: bytes = b"ET"
+PROTOCOL_VERSION: int = 1
+SIZE = struct.Struct('>I')
+HEADER = struct.Struct('<2sBBB')
+COMPRESSED: int = 0x01
+COUNT = struct.Struct('<I')
+LOCATION = struct.Struct('<iii')
+WATERMARK = struct.Struct('<q')
+DELTA = struct.Struct('<q?')
+ADDRESS = struct.Struct('<H')
+NODE = struct.Struct('<i')
+
+# Column name and little-endian dtype of every column of the tables sent through the protocol
+Schema = Tuple[Tuple[str, str], ...]
+READINGS_SCHEMA: Schema = (('object_id', '<i4'), ('speed', '<f8'), ('direction', '<f8'), ('x_localization', '<i4'),
+                           ('y_localization', '<i4'), ('receive_date', '<M8[ns]'))
+RESULTS_SCHEMA: Schema = (('object_id', '<i4'), ('x_localization', '<i4'), ('y_localization', '<i4'))
+DELTA_SCHEMA: Schema = (('index', '<i8'), *RESULTS_SCHEMA, ('receive_date', '<M8[ns]'))
+TRACKS_SCHEMA: Schema = (('object_id', '<i4'), ('x_localization', '<f8'), ('y_localization', '<f8'),
+                         ('direction', '<f8'), ('receive_date', '<M8[ns]'))
+
 
 # CLASSES
+class MessageType(IntEnum):
+    """
+    Class to represent the type of the message
+    """
+
+    LOCATION = 1
+    CONNECTED = 2
+    NOT_CONNECTED = 3
+    LOCAL_MAP = 4
+    GLOBAL_MAP = 5
+    HELLO = 6
+    GLOBAL_SUBSCRIBE = 7
+    GLOBAL_DELTA = 8
+    GLOBAL_ACK = 9
+    SKY_FEED = 10
+    REDIRECT = 11
+    PEER = 12
+    TRACKS = 13
+
+
+class Codec(IntEnum):
+    """
+    Class to represent the payload compression codec
+    """
+
+    NONE = 0
+    ZLIB = 1
+    LZMA = 2
+
+
+class ProtocolError(Exception):
+    """
+    Class to represent the error raised for a malformed message
+    """
+
+
+class FrameReader:
+    """
+    Class to represent the reusable receive buffer of the connection splitting the byte stream into frames
+    """
+
+    def __init__(self, sock: socket, max_frame_size: int = MAX_FRAME_SIZE,
+                 buffer_size: int = RECEIVE_BUFFER_SIZE) -> None:
+        """
+        Constructor
+        :param sock: Connection socket
+        :param max_frame_size: Maximal accepted size of a single frame
+        :param buffer_size: Initial size of the buffer, it only grows for frames that do not fit in it
+        """
+
+        self.sock = sock
+        self.max_frame_size = max_frame_size
+        self.buffer = bytearray(buffer_size)
+        self.view = memoryview(self.buffer)
+        self.start = 0
+        self.end = 0
+
+    def read(self) -> None:
+        """
+        Method to receive the available bytes from the blocking socket straight into the buffer
+        """
+
+        self.filled(self.sock.recv_into(self.view[self.end:]))
+
+    async def async_read(self, loop: AbstractEventLoop) -> None:
+        """
+        Method to receive the available bytes from the non-blocking socket straight into the buffer
+        :param loop: Event loop
+        """
+
+        self.filled(await loop.sock_recv_into(self.sock, self.view[self.end:]))
+
+    def filled(self, n_bytes: int) -> None:
+        """
+        Method to account for the bytes received into the buffer
+        :param n_bytes: Number of received bytes
+        """
+
+        if n_bytes == 0:
+            raise ConnectionError("Connection closed by peer")
+
+        self.end += n_bytes
+
+    def frames(self) -> Iterator[memoryview]:
+        """
+        Method to yield all the complete frames in the buffer, each one is valid until the next read
+        :return: Frames
+        """
+
+        while self.end - self.start >= SIZE.size:
+            size = SIZE.unpack_from(self.buffer, self.start)[0]
+
+            if size > self.max_frame_size:
+                raise ProtocolError(f"Frame of {size} bytes exceeds the limit of {self.max_frame_size} bytes")
+
+            frame_end = self.start + SIZE.size + size
+
+            if frame_end > self.end:
+                self.reserve(SIZE.size + size)
+                return
+
+            yield self.view[self.start + SIZE.size:frame_end]
+            self.start = frame_end
+
+        self.reserve(SIZE.size)
+
+    def reserve(self, size: int) -> None:
+        """
+        Method to make room for the frame of the given size after the unconsumed bytes
+        :param size: Size of the frame including its size prefix
+        """
+
+        pending = self.end - self.start
+
+        if self.start > 0:
+            self.view[:pending] = self.view[self.start:self.end]
+            self.start, self.end = 0, pending
+
+        if size > len(self.buffer):
+            buffer = bytearray(max(size, 2 * len(self.buffer)))
+            buffer[:pending] = self.view[:pending]
+            self.buffer, self.view = buffer, memoryview(buffer)
+
+
 class Data:
     """
     Class to represent the data sent during the communication
     """
 
-    def __init__(self, alert: str, content: Any) -> None:
+    def __init__(self, alert: MessageType, content: Any) -> None:
         """
         Constructor
         :param alert: Data alert
@@ -27,34 +182,398 @@ class Data:
         self.content = content
 
 
+class ConnectionStats:
+    """
+    Class to represent the traffic statistics of the connection
+    """
+
+    def __init__(self) -> None:
+        """
+        Constructor
+        """
+
+        self.frames_sent = 0
+        self.frames_compressed = 0
+        self.bytes_sent = 0
+        self.raw_bytes_sent = 0
+        self.frames_received = 0
+        self.bytes_received = 0
+        self.raw_bytes_received = 0
+
+    @property
+    def bytes_saved(self) -> int:
+        """
+        Number of bytes the compression kept off the link in both directions
+        """
+
+        return self.raw_bytes_sent - self.bytes_sent + self.raw_bytes_received - self.bytes_received
+
+    def __repr__(self) -> str:
+        """
+        Return a string representation of the ConnectionStats object.
+        """
+
+        return "<ConnectionStats(frames_sent={0}, frames_compressed={1}, bytes_sent={2}, frames_received={3}, " \
+               "bytes_received={4}, bytes_saved={5})>".format(self.frames_sent, self.frames_compressed,
+                                                              self.bytes_sent, self.frames_received,
+                                                              self.bytes_received, self.bytes_saved)
+
+
+class Connection:
+    """
+    Class to represent the connection with its receive buffer, negotiated compression codec and statistics
+    """
+
+    def __init__(self, sock: socket, max_frame_size: int = MAX_FRAME_SIZE,
+                 compression_threshold: int = COMPRESSION_THRESHOLD) -> None:
+        """
+        Constructor
+        :param sock: Connection socket
+        :param max_frame_size: Maximal accepted size of a single frame, also after decompression
+        :param compression_threshold: Payload size below which the frames are sent uncompressed
+        """
+
+        self.sock = sock
+        self.reader = FrameReader(sock, max_frame_size=max_frame_size)
+        self.max_frame_size = max_frame_size
+        self.compression_threshold = compression_threshold
+        self.codec = Codec.NONE
+        self.stats = ConnectionStats()
+        self.send_lock = asyncio.Lock()
+        self.blocking_send_lock = threading.Lock()
+
+    def send(self, data: Data) -> None:
+        """
+        Method to send the data through the blocking socket
+        :param data: Data
+        """
+
+        # Messages sent by different threads, such as the receive thread and the interface of the client, must not
+        # interleave on the socket
+        with self.blocking_send_lock:
+            self.sock.sendall(self.frame(data))
+
+    async def async_send(self, loop: AbstractEventLoop, data: Data) -> None:
+        """
+        Method to send the data through the non-blocking socket served by the event loop
+        :param loop: Event loop
+        :param data: Data
+        """
+
+        # Messages pushed by different tasks must not interleave on the socket
+        async with self.send_lock:
+            await loop.sock_sendall(self.sock, self.frame(data))
+
+    def messages(self) -> Iterator[Tuple[MessageType, Any]]:
+        """
+        Method to receive the messages through the blocking socket until the connection is closed
+        :return: Message types and contents
+        """
+
+        while True:
+            self.reader.read()
+
+            for message in self.reader.frames():
+                yield self.decode(message)
+
+    async def async_messages(self, loop: AbstractEventLoop) -> AsyncIterator[Tuple[MessageType, Any]]:
+        """
+        Method to receive the messages through the non-blocking socket until the connection is closed
+        :param loop: Event loop
+        :return: Message types and contents
+        """
+
+        while True:
+            await self.reader.async_read(loop)
+
+            for message in self.reader.frames():
+                yield self.decode(message)
+
+    def frame(self, data: Data) -> bytes:
+        """
+        Method to encode the data, compress its payload with the negotiated codec and prefix it with its size
+        :param data: Data
+        :return: Size-prefixed message
+        """
+
+        message = encode(data)
+        raw_size = len(message)
+
+        if self.codec != Codec.NONE and raw_size - HEADER.size >= self.compression_threshold:
+            payload = compress(self.codec, memoryview(message)[HEADER.size:])
+
+            if HEADER.size + len(payload) < raw_size:
+                message = HEADER.pack(MAGIC, PROTOCOL_VERSION, data.alert, COMPRESSED) + payload
+                self.stats.frames_compressed += 1
+
+        self.stats.frames_sent += 1
+        self.stats.raw_bytes_sent += raw_size
+        self.stats.bytes_sent += len(message)
+
+        return SIZE.pack(len(message)) + message
+
+    def decode(self, message: memoryview) -> Tuple[MessageType, Any]:
+        """
+        Method to decompress and decode the message
+        :param message: Message
+        :return: Message type and content
+        """
+
+        self.stats.frames_received += 1
+        self.stats.bytes_received += len(message)
+
+        if len(message) >= HEADER.size and HEADER.unpack_from(message)[3] & COMPRESSED:
+            magic, version, alert, _ = HEADER.unpack_from(message)
+            payload = decompress(self.codec, message[HEADER.size:], self.max_frame_size)
+            message = HEADER.pack(magic, version, alert, 0) + payload
+
+        self.stats.raw_bytes_received += len(message)
+
+        return decode(message)
+
+
 # FUNCTIONS
-def send(sock: socket, data: Data) -> None:
+def encode(data: Data) -> bytes:
     """
-    Method to send the data through the client socket
-    :param sock: Client socket
+    Method to encode the data as the header followed by the payload of its message type
     :param data: Data
+    :return: Message
+    """
+
+    alert, content = data.alert, data.content
+    header = HEADER.pack(MAGIC, PROTOCOL_VERSION, alert, 0)
+
+    if alert == MessageType.LOCATION:
+        (x, y), rng = content
+        return header + LOCATION.pack(x, y, rng)
+
+    if alert == MessageType.NOT_CONNECTED:
+        return header + content.encode()
+
+    if alert == MessageType.LOCAL_MAP:
+        return header + encode_table(content, READINGS_SCHEMA)
+
+    if alert == MessageType.SKY_FEED and isinstance(content, pd.DataFrame):
+        return header + encode_table(content, READINGS_SCHEMA)
+
+    if alert == MessageType.HELLO:
+        return header + bytes(content)
+
+    if alert in (MessageType.GLOBAL_SUBSCRIBE, MessageType.GLOBAL_ACK):
+        return header + WATERMARK.pack(content)
+
+    if alert == MessageType.GLOBAL_DELTA:
+        watermark, snapshot, rows, locations = content
+        return header + DELTA.pack(watermark, snapshot) + encode_table(rows, DELTA_SCHEMA) + encode_locations(locations)
+
+    if alert == MessageType.GLOBAL_MAP and content:
+        global_map, locations = content
+        return header + encode_table(global_map, RESULTS_SCHEMA) + encode_locations(locations)
+
+    if alert == MessageType.REDIRECT:
+        host, port = content
+        return header + ADDRESS.pack(port) + host.encode()
+
+    if alert == MessageType.PEER:
+        return header + NODE.pack(content)
+
+    if alert == MessageType.TRACKS:
+        return header + encode_table(content, TRACKS_SCHEMA)
+
+    return header
+
+
+def decode(message: Union[bytes, memoryview]) -> Tuple[MessageType, Any]:
+    """
+    Method to decode the message
+    :param message: Message
+    :return: Message type and content
+    """
+
+    if len(message) < HEADER.size:
+        raise ProtocolError("Truncated header")
+
+    magic, version, alert, flags = HEADER.unpack_from(message)
+
+    if magic != MAGIC or version != PROTOCOL_VERSION:
+        raise ProtocolError(f"Unsupported protocol {magic!r} v{version}")
+
+    if flags & COMPRESSED:
+        raise ProtocolError("Compressed message must be decompressed by its connection")
+
+    try:
+        alert = MessageType(alert)
+
+    except ValueError:
+        raise ProtocolError(f"Unknown message type {alert}") from None
+
+    payload = memoryview(message)[HEADER.size:]
+
+    if alert == MessageType.LOCATION:
+        x, y, rng = LOCATION.unpack_from(payload)
+        return alert, ([x, y], rng)
+
+    if alert == MessageType.NOT_CONNECTED:
+        return alert, str(payload, 'utf-8')
+
+    if alert == MessageType.LOCAL_MAP:
+        return alert, decode_table(payload, READINGS_SCHEMA)[0]
+
+    if alert == MessageType.SKY_FEED and len(payload) > 0:
+        return alert, decode_table(payload, READINGS_SCHEMA)[0]
+
+    if alert == MessageType.HELLO:
+        return alert, tuple(Codec(codec) for codec in payload if codec in list(Codec))
+
+    if alert in (MessageType.GLOBAL_SUBSCRIBE, MessageType.GLOBAL_ACK):
+        return alert, WATERMARK.unpack_from(payload)[0]
+
+    if alert == MessageType.GLOBAL_DELTA:
+        watermark, snapshot = DELTA.unpack_from(payload)
+        rows, offset = decode_table(payload[DELTA.size:], DELTA_SCHEMA)
+        return alert, (watermark, snapshot, rows, decode_locations(payload[DELTA.size + offset:]))
+
+    if alert == MessageType.GLOBAL_MAP and len(payload) > 0:
+        global_map, offset = decode_table(payload, RESULTS_SCHEMA)
+        return alert, [global_map, decode_locations(payload[offset:])]
+
+    if alert == MessageType.REDIRECT:
+        return alert, (str(payload[ADDRESS.size:], 'utf-8'), ADDRESS.unpack_from(payload)[0])
+
+    if alert == MessageType.PEER:
+        return alert, NODE.unpack_from(payload)[0]
+
+    if alert == MessageType.TRACKS:
+        return alert, decode_table(payload, TRACKS_SCHEMA)[0]
+
+    return alert, ""
+
+
+def encode_table(table: pd.DataFrame, schema: Schema) -> bytes:
+    """
+    Method to encode the table as the number of rows followed by the packed columns
+    :param table: Table
+    :param schema: Table schema
+    :return: Encoded table
+    """
+
+    n_rows = len(table) if len(table.columns) > 0 else 0
+    columns = [column_array(table, name, dtype).tobytes() for name, dtype in schema] if n_rows > 0 else []
+
+    return COUNT.pack(n_rows) + b"".join(columns)
+
+
+def decode_table(payload: memoryview, schema: Schema) -> Tuple[pd.DataFrame, int]:
+    """
+    Method to decode the table directly from the packed columns
+    :param payload: Payload
+    :param schema: Table schema
+    :return: Table and the number of consumed bytes
+    """
+
+    n_rows = COUNT.unpack_from(payload)[0]
+    offset = COUNT.size
+    columns = {}
+
+    for name, dtype in schema:
+        dtype = np.dtype(dtype)
+
+        if offset + n_rows * dtype.itemsize > len(payload):
+            raise ProtocolError(f"Truncated column {name}")
+
+        # The payload may live in the reusable receive buffer, so the columns get their own copy
+        columns[name] = np.frombuffer(payload, dtype=dtype, count=n_rows, offset=offset).copy()
+        offset += n_rows * dtype.itemsize
+
+    return pd.DataFrame(columns, copy=False), offset
+
+
+def column_array(table: pd.DataFrame, name: str, dtype: str) -> np.ndarray:
+    """
+    Method to convert the table column to a contiguous array of the given dtype
+    :param table: Table
+    :param name: Column name
+    :param dtype: Column dtype
+    :return: Column array
+    """
+
+    values = table[name].to_numpy()
+
+    if np.dtype(dtype).kind == 'i' and values.dtype.kind == 'f':
+        values = np.rint(values)
+
+    return np.ascontiguousarray(values.astype(dtype, copy=False))
+
+
+def encode_locations(locations: List[Tuple[List[int], int]]) -> bytes:
+    """
+    Method to encode the locations and ranges of the stations
+    :param locations: Locations and ranges of the stations
+    :return: Encoded locations
+    """
+
+    return COUNT.pack(len(locations)) + b"".join(LOCATION.pack(x, y, rng) for (x, y), rng in locations)
+
+
+def decode_locations(payload: memoryview) -> List[Tuple[List[int], int]]:
+    """
+    Method to decode the locations and ranges of the stations
+    :param payload: Payload
+    :return: Locations and ranges of the stations
+    """
+
+    n_locations = COUNT.unpack_from(payload)[0]
+    values = np.frombuffer(payload, dtype='<i4', count=3 * n_locations, offset=COUNT.size).reshape(-1, 3)
+
+    return [([int(x), int(y)], int(rng)) for x, y, rng in values]
+
+
+def supported_codecs() -> Tuple[Codec, ...]:
+    """
+    Method to get the compression codecs enabled in the configuration, in the order of preference
+    :return: Codecs
+    """
+
+    return tuple(Codec[name.upper()] for name in COMPRESSION_CODECS)
+
+
+def negotiate_codec(offered: Tuple[Codec, ...]) -> Codec:
+    """
+    Method to choose the first codec offered by the peer that is enabled locally
+    :param offered: Codecs offered by the peer, in its order of preference
+    :return: Chosen codec
+    """
+
+    return next((codec for codec in offered if codec in supported_codecs()), Codec.NONE)
+
+
+def compress(codec: Codec, payload: memoryview) -> bytes:
+    """
+    Method to compress the payload
+    :param codec: Codec
+    :param payload: Payload
+    :return: Compressed payload
     """
 
-    serialized_data = dumps(data)
-    sock.sendall(struct.pack('>I', len(serialized_data)))
-    sock.sendall(serialized_data)
+    return zlib.compress(payload) if codec == Codec.ZLIB else lzma.compress(payload)
 
 
-def receive(sock: socket):
+def decompress(codec: Codec, payload: memoryview, max_size: int) -> bytes:
     """
-    Method to receive the data through the client socket
-    :param sock: Client socket
-    :return: Data
+    Method to decompress the payload, refusing payloads that expand beyond the given size
+    :param codec: Codec
+    :param payload: Compressed payload
+    :param max_size: Maximal size of the decompressed payload
+    :return: Payload
     """
 
-    size = struct.unpack('>I', sock.recv(4))[0]
-    data = b""
-    remaining_size = size
+    if codec == Codec.NONE:
+        raise ProtocolError("Compressed frame received before a codec was negotiated")
 
-    while remaining_size != 0:
-        data += sock.recv(remaining_size)
-        remaining_size = size - len(data)
+    decompressor = zlib.decompressobj() if codec == Codec.ZLIB else lzma.LZMADecompressor()
+    data = decompressor.decompress(payload, max_size)
 
-    data = loads(data)
+    if not decompressor.eof:
+        raise ProtocolError("Truncated or oversized compressed payload")
 
-    return data.alert, data.content
\ No newline at end of file
+    return data
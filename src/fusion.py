@@ -0,0 +1,108 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# BUILT-IN PACKAGES
+import numpy as np
+import pandas as pd
+
+from typing import Optional, Tuple
+
+# PROJECT MODULES
+from config import *
+from database.database_fusion import FUSED_COLUMNS, fuse_samples
+
+
+# CLASSES
+class FusionEngine:
+    """
+    Class to represent the in-memory fusion of the readings sent by all the stations
+    """
+
+    def __init__(self, time_window: float = FUSION_WINDOW_SECONDS, settle_time: float = FUSION_SETTLE_SECONDS,
+                 gate: float = FUSION_GATE) -> None:
+        """
+        Constructor
+        :param time_window: Number of seconds after which a reading is too old to be fused
+        :param settle_time: Number of seconds to wait for the readings of the other stations before fusing a sample
+        :param gate: Multiple of the object speed within which a reading must lie from the sample median to be fused
+        """
+
+        self.time_window = np.timedelta64(int(time_window * 1e9), 'ns')
+        self.settle_time = np.timedelta64(int(settle_time * 1e9), 'ns')
+        self.gate = gate
+
+        self.object_id = np.empty(0, dtype=np.int64)
+        self.speed = np.empty(0, dtype=np.float64)
+        self.direction = np.empty(0, dtype=np.float64)
+        self.x = np.empty(0, dtype=np.float64)
+        self.y = np.empty(0, dtype=np.float64)
+        self.receive_date = np.empty(0, dtype='datetime64[ns]')
+
+        self.fused_until = np.datetime64(0, 'ns')
+        self.late_readings = 0
+
+    def __len__(self) -> int:
+        """
+        Number of readings waiting for the fusion
+        """
+
+        return len(self.object_id)
+
+    def fuse(self, readings: pd.DataFrame, now: Optional[np.datetime64] = None) -> pd.DataFrame:
+        """
+        Method to add the readings and fuse every sample older than the settle time
+        :param readings: Readings of the stations
+        :param now: Current time, defaults to the wall clock
+        :return: Fused rows with the columns of the filtered_results table
+        """
+
+        now = np.datetime64(pd.Timestamp.now() if now is None else now, 'ns')
+        self.add(readings, now)
+
+        return self.flush(now - self.settle_time)
+
+    def add(self, readings: pd.DataFrame, now: np.datetime64) -> None:
+        """
+        Method to buffer the readings, dropping the ones belonging to samples that are already fused or too old
+        :param readings: Readings of the stations
+        :param now: Current time
+        """
+
+        receive_date = readings['receive_date'].to_numpy(dtype='datetime64[ns]')
+        fresh = (receive_date > self.fused_until) & (receive_date >= now - self.time_window)
+        self.late_readings += int(len(fresh) - fresh.sum())
+
+        self.object_id = np.concatenate([self.object_id, readings['object_id'].to_numpy(dtype=np.int64)[fresh]])
+        self.speed = np.concatenate([self.speed, readings['speed'].to_numpy(dtype=np.float64)[fresh]])
+        self.direction = np.concatenate([self.direction, readings['direction'].to_numpy(dtype=np.float64)[fresh]])
+        self.x = np.concatenate([self.x, readings['x_localization'].to_numpy(dtype=np.float64)[fresh]])
+        self.y = np.concatenate([self.y, readings['y_localization'].to_numpy(dtype=np.float64)[fresh]])
+        self.receive_date = np.concatenate([self.receive_date, receive_date[fresh]])
+
+    def flush(self, cutoff: np.datetime64) -> pd.DataFrame:
+        """
+        Method to fuse and drop the buffered readings of the samples taken up to the cutoff
+        :param cutoff: Newest sample date to fuse
+        :return: Fused rows with the columns of the filtered_results table
+        """
+
+        return fuse_samples(*self.take(cutoff), self.gate)
+
+    def take(self, cutoff: np.datetime64) -> Tuple[np.ndarray, ...]:
+        """
+        Method to drop the buffered readings of the samples taken up to the cutoff
+        :param cutoff: Newest sample date to fuse
+        :return: Object IDs, speeds, directions, x and y coordinates and sample dates of the readings
+        """
+
+        ready = self.receive_date <= cutoff
+        self.fused_until = max(self.fused_until, cutoff)
+
+        readings = (self.object_id[ready], self.speed[ready], self.direction[ready], self.x[ready], self.y[ready],
+                    self.receive_date[ready])
+
+        pending = ~ready
+        self.object_id, self.speed, self.direction = self.object_id[pending], self.speed[pending], self.direction[pending]
+        self.x, self.y, self.receive_date = self.x[pending], self.y[pending], self.receive_date[pending]
+
+        return readings
@@ -0,0 +1,88 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# BUILT-IN PACKAGES
+import asyncio
+import pandas as pd
+
+from typing import Callable, Awaitable, List
+
+# PROJECT MODULES
+from config import *
+
+
+# CLASSES
+class IngestionQueue:
+    """
+    Class to represent the bounded queue coalescing the local maps of all stations into batches
+    """
+
+    def __init__(self, process_batch: Callable[[pd.DataFrame], Awaitable[None]], max_size: int = INGESTION_QUEUE_SIZE,
+                 batch_rows: int = INGESTION_BATCH_ROWS,
+                 batch_window: float = INGESTION_BATCH_WINDOW_SECONDS) -> None:
+        """
+        Constructor
+        :param process_batch: Coroutine function processing a single batch
+        :param max_size: Maximal number of queued local maps, stations wait for a free slot when it is reached
+        :param batch_rows: Number of rows closing the batch
+        :param batch_window: Number of seconds closing the batch, counted from its first local map
+        """
+
+        self.process_batch = process_batch
+        self.batch_rows = batch_rows
+        self.batch_window = batch_window
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_size)
+
+    async def put(self, local_map: pd.DataFrame) -> None:
+        """
+        Method to enqueue the local map, waiting while the queue is full
+        :param local_map: Local map
+        """
+
+        await self.queue.put(local_map)
+
+    async def run(self) -> None:
+        """
+        Method to collect and process the batches until cancelled, a failing batch dropped rather than stopping the
+        task, which would leave the stations waiting on the full queue
+        """
+
+        loop = asyncio.get_running_loop()
+
+        while True:
+            frames = [await self.queue.get()]
+            n_rows = len(frames[0])
+            deadline = loop.time() + self.batch_window
+
+            while n_rows < self.batch_rows:
+                timeout = deadline - loop.time()
+
+                if timeout <= 0:
+                    break
+
+                try:
+                    frames.append(await asyncio.wait_for(self.queue.get(), timeout))
+
+                except asyncio.TimeoutError:
+                    break
+
+                n_rows += len(frames[-1])
+
+            batch = concat_frames(frames)
+
+            try:
+                await self.process_batch(batch)
+
+            except Exception as e:
+                print(f"[INGESTION ERROR] batch of {len(batch)} rows dropped: {e}")
+
+
+# FUNCTIONS
+def concat_frames(frames: List[pd.DataFrame]) -> pd.DataFrame:
+    """
+    Method to merge the local maps into a single batch
+    :param frames: Local maps
+    :return: Batch
+    """
+
+    return frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
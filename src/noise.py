@@ -0,0 +1,25 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# BUILT-IN PACKAGES
+import pandas as pd
+
+from random import randint
+
+# PROJECT MODULES
+from config import *
+
+
+# FUNCTIONS
+def add_noise(local_map: pd.DataFrame) -> pd.DataFrame:
+    """
+    Method to add the station measurement noise to the local map
+    :param local_map: Part of the sky within the station range
+    :return: Local map of the station
+    """
+
+    local_map = local_map.copy()
+    local_map['x_localization'] += randint(MIN_NOISE_VAL, MAX_NOISE_VAL)
+    local_map['y_localization'] += randint(MIN_NOISE_VAL, MAX_NOISE_VAL)
+
+    return local_map
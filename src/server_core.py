@@ -0,0 +1,520 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# BUILT-IN PACKAGES
+import asyncio
+import threading
+import pandas as pd
+
+from concurrent.futures import ThreadPoolExecutor, Future
+from socket import socket, AF_INET, SOCK_STREAM, SOL_SOCKET, SO_REUSEADDR
+from threading import Thread
+from typing import Optional, List, Dict, Tuple, Set, Callable
+
+# PROJECT MODULES
+from config import *
+from anomaly import AnomalyDetector, AnomalyEvent
+from cluster import Cluster, TrackSources
+from communication import Data, MessageType, Connection, negotiate_codec
+from fusion import FusionEngine
+from ingestion import IngestionQueue
+from noise import add_noise
+from sharding import ShardWorkers, ShardedFusion, ShardedDetector
+from spatial_index import SpatialGrid, station_area, covering_area
+from database.database_storage import StorageBackend
+
+
+# CLASSES
+class Subscription:
+    """
+    Class to represent the global map subscription of the station
+    """
+
+    def __init__(self, watermark: int) -> None:
+        """
+        Constructor
+        :param watermark: Highest index of the global map rows acknowledged by the station
+        """
+
+        self.watermark = watermark
+        self.in_flight = False
+
+
+class Outbox:
+    """
+    Class to represent the latest message waiting to be sent to the station, sent by a task of the station, a newer
+    message replacing the stale one while the station is slow to read
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, connection: Connection) -> None:
+        """
+        Constructor
+        :param loop: Event loop
+        :param connection: Station connection
+        """
+
+        self.loop = loop
+        self.connection = connection
+        self.pending: Optional[Data] = None
+        self.ready = asyncio.Event()
+        self.dropped = 0
+        self.task = loop.create_task(self.drain())
+
+    def put(self, data: Data) -> None:
+        """
+        Method to queue the message without waiting for the station
+        :param data: Message
+        """
+
+        if self.pending is not None:
+            self.dropped += 1
+
+        self.pending = data
+        self.ready.set()
+
+    async def drain(self) -> None:
+        """
+        Method to send the latest message whenever the previous one is written, until the connection is closed
+        """
+
+        while True:
+            await self.ready.wait()
+            self.ready.clear()
+            data, self.pending = self.pending, None
+
+            try:
+                await self.connection.async_send(self.loop, data)
+
+            except OSError:
+                # The station handler notices the closed connection and closes the outbox
+                return
+
+            except Exception as e:
+                print(f"[SERVER ERROR] {e}")
+
+    def close(self) -> None:
+        """
+        Method to stop sending the messages
+        """
+
+        self.task.cancel()
+
+
+class ServerCore:
+    """
+    Class to represent the server core multiplexing all station sockets on a single event loop
+    """
+
+    def __init__(self, storage: StorageBackend, on_local_map: Optional[Callable] = None,
+                 on_global_map: Optional[Callable] = None, port: int = PORT, max_clients: int = MAX_CLIENTS,
+                 cluster: Optional[Cluster] = None) -> None:
+        """
+        Constructor
+        :param storage: Storage backend
+        :param on_local_map: Callback drawing the local map, called with the map and the station locations
+        :param on_global_map: Callback drawing the global map, called with the map, the locations, the anomalies
+            and the areas observed by more than one station
+        :param port: Server port
+        :param max_clients: Maximal number of simultaneously connected stations
+        :param cluster: Cluster this server owns a region of, None for a single server owning the whole space
+        """
+
+        self.storage = storage
+        self.cluster = cluster
+        self.on_local_map = on_local_map
+        self.on_global_map = on_global_map
+        self.max_clients = max_clients
+
+        # Server socket
+        self.server_sock = socket(AF_INET, SOCK_STREAM)
+        self.server_sock.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
+        self.server_sock.bind(('', port))
+        self.server_sock.listen(max_clients)
+        self.server_sock.setblocking(False)
+
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.stations: Dict[Connection, Optional[Tuple[Location, int]]] = {}
+        self.subscriptions: Dict[Connection, Subscription] = {}
+        self.push_tasks: Set[asyncio.Task] = set()
+        self.feed_outboxes: Dict[Connection, Outbox] = {}
+        self.coverage = SpatialGrid()
+        self.overlap_areas: List[Area] = []
+        self.anomalies: List[int] = []
+        self.ingestion = IngestionQueue(self.process_batch)
+
+        # With more than one shard, the fusion and anomaly detection are shared by the worker processes
+        self.workers = ShardWorkers(FUSION_SHARDS) if FUSION_SHARDS > 1 else None
+        self.detector = AnomalyDetector() if self.workers is None else ShardedDetector(self.workers)
+
+        # The tracks forwarded by the other servers of the cluster update the detector besides the batches, and only
+        # for the objects this server does not fuse itself
+        self.detector_lock = threading.Lock()
+        self.track_sources = TrackSources() if cluster is not None else None
+
+        # The fused rows are written to filtered_results one transaction at a time, so the rows are committed in the
+        # order of their index and a subscriber never skips a row committed after a higher one
+        self.results_lock = threading.Lock()
+
+        if FUSION_ENGINE != "memory":
+            self.fusion = None
+
+        else:
+            self.fusion = FusionEngine() if self.workers is None else ShardedFusion(self.workers)
+
+        # Blocking storage work and drawing are kept off the event loop
+        self.db_executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix="db")
+        self.plot_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="plot")
+
+    @property
+    def locations(self) -> List[Tuple[Location, int]]:
+        """
+        Locations and ranges of the registered stations
+        """
+
+        return [location for location in self.stations.values() if location is not None]
+
+    def start(self) -> None:
+        """
+        Method to start the event loop in a background thread
+        """
+
+        Thread(target=asyncio.run, args=(self.accept_clients(),), daemon=True).start()
+
+    async def accept_clients(self) -> None:
+        """
+        Method to accept the stations until the server is closed
+        """
+
+        self.loop = asyncio.get_running_loop()
+        self.loop.create_task(self.ingestion.run())
+        self.loop.create_task(self.feed_sky())
+        self.loop.create_task(self.maintain_storage())
+
+        if self.cluster is not None:
+            self.loop.create_task(self.cluster.run(self.loop))
+        print("[SERVER STARTED]")
+
+        while True:
+            client_sock, _ = await self.loop.sock_accept(self.server_sock)
+            client_sock.setblocking(False)
+            connection = Connection(client_sock)
+
+            if len(self.stations) >= self.max_clients:
+                await connection.async_send(self.loop, Data(MessageType.NOT_CONNECTED, "Server full"))
+                client_sock.close()
+                continue
+
+            self.stations[connection] = None
+            self.loop.create_task(self.handle_client(connection))
+
+    async def handle_client(self, connection: Connection) -> None:
+        """
+        Method to handle the station
+        :param connection: Station connection
+        """
+
+        try:
+            async for alert, content in connection.async_messages(self.loop):
+                if alert == MessageType.HELLO:
+                    codec = negotiate_codec(content)
+                    await connection.async_send(self.loop, Data(MessageType.HELLO, (codec,)))
+                    connection.codec = codec
+
+                elif alert == MessageType.LOCATION:
+                    await self.register(connection, content)
+
+                elif alert == MessageType.LOCAL_MAP:
+                    if len(content) > 0:
+                        await self.ingestion.put(content)
+
+                elif alert == MessageType.GLOBAL_MAP:
+                    global_map = await self.loop.run_in_executor(self.db_executor, self.storage.get_result)
+                    await connection.async_send(self.loop, Data(MessageType.GLOBAL_MAP, [global_map, self.locations]))
+
+                elif alert == MessageType.GLOBAL_SUBSCRIBE:
+                    self.subscriptions[connection] = Subscription(content)
+                    rows = await self.loop.run_in_executor(self.db_executor, self.storage.get_result_since, content)
+                    self.push_global_map(connection, rows, snapshot=content == 0)
+
+                elif alert == MessageType.SKY_FEED:
+                    if connection not in self.feed_outboxes:
+                        self.feed_outboxes[connection] = Outbox(self.loop, connection)
+
+                elif alert == MessageType.GLOBAL_ACK:
+                    if connection in self.subscriptions:
+                        self.subscriptions[connection].watermark = content
+                        self.subscriptions[connection].in_flight = False
+
+                elif alert == MessageType.PEER:
+                    print(f"[PEER CONNECTED] node {content}")
+
+                elif alert == MessageType.TRACKS:
+                    events = await self.loop.run_in_executor(self.db_executor, self.merge_tracks, content)
+                    self.anomalies = self.detector.anomalies
+                    report_anomalies(events)
+
+        except ConnectionError:
+            print(f"[CLIENT DISCONNECTED] {connection.stats}")
+
+        except Exception as e:
+            print(f"[SERVER ERROR] {e}")
+
+        finally:
+            del self.stations[connection]
+
+            if connection in self.coverage:
+                self.coverage.remove(connection)
+                self.overlap_areas = [area for area, _ in self.coverage.overlaps()]
+
+            self.subscriptions.pop(connection, None)
+            outbox = self.feed_outboxes.pop(connection, None)
+
+            if outbox is not None:
+                outbox.close()
+
+            connection.sock.close()
+
+    async def register(self, connection: Connection, content: Tuple[Location, int]) -> None:
+        """
+        Method to register the station location
+        :param connection: Station connection
+        :param content: Location and range of the station
+        """
+
+        (x, y), rng = content
+        x1, y1, x2, y2 = SPACE_RANGE
+
+        if x < x1 or x > x2 or y < y1 or y > y2:
+            await connection.async_send(self.loop, Data(MessageType.NOT_CONNECTED, "Out of range"))
+
+        elif self.cluster is not None and self.cluster.owner([x, y]) != self.cluster.node:
+            await connection.async_send(self.loop, Data(MessageType.REDIRECT,
+                                                        self.cluster.address(self.cluster.owner([x, y]))))
+
+        elif self.coverage.find(station_area(content)) is not None:
+            await connection.async_send(self.loop, Data(MessageType.NOT_CONNECTED, "Duplicated"))
+
+        else:
+            self.stations[connection] = content
+            self.coverage.insert(connection, station_area(content))
+            self.overlap_areas = [area for area, _ in self.coverage.overlaps()]
+            await connection.async_send(self.loop, Data(MessageType.CONNECTED, ""))
+
+    async def process_batch(self, batch: pd.DataFrame) -> None:
+        """
+        Method to store the batch of local maps, merge it with the stored data and detect the anomalies
+        :param batch: Local maps of the stations collected by the ingestion queue
+        """
+
+        global_map, fused, events = await self.loop.run_in_executor(self.db_executor, self.update_database, batch)
+        self.anomalies = self.detector.anomalies
+        report_anomalies(events)
+
+        if self.cluster is not None:
+            self.cluster.forward(fused)
+
+        self.draw(self.on_local_map, batch, self.locations)
+
+        if len(global_map) > 0:
+            self.draw(self.on_global_map, global_map, self.locations, self.anomalies, self.overlap_areas)
+
+        await self.push_global_maps()
+
+    async def push_global_maps(self) -> None:
+        """
+        Method to push the new global map rows to every subscribed station that acknowledged its previous push
+        """
+
+        ready = [connection for connection, subscription in self.subscriptions.items() if not subscription.in_flight]
+
+        if not ready:
+            return
+
+        # A single query serves all the stations, each one receives the rows after its own watermark
+        watermark = min(self.subscriptions[connection].watermark for connection in ready)
+        rows = await self.loop.run_in_executor(self.db_executor, self.storage.get_result_since, watermark)
+
+        for connection in ready:
+            self.push_global_map(connection, rows)
+
+    def push_global_map(self, connection: Connection, rows: pd.DataFrame, snapshot: bool = False) -> None:
+        """
+        Method to push the global map rows after the station watermark, sent by a task of its own, so a slow station
+        delays neither the other stations nor the next batch
+        :param connection: Station connection
+        :param rows: Global map rows ordered by index
+        :param snapshot: Whether the rows replace the global map kept by the station
+        """
+
+        subscription = self.subscriptions.get(connection)
+
+        if subscription is None:
+            return
+
+        delta = rows[rows['index'] > subscription.watermark]
+
+        if len(delta) == 0 and not snapshot:
+            return
+
+        watermark = int(delta['index'].iloc[-1]) if len(delta) > 0 else subscription.watermark
+
+        # Marked before the task runs, so the next batch does not push the same rows again
+        subscription.in_flight = True
+        task = self.loop.create_task(self.send_delta(connection, Data(MessageType.GLOBAL_DELTA,
+                                                                      (watermark, snapshot, delta, self.locations))))
+        self.push_tasks.add(task)
+        task.add_done_callback(self.push_tasks.discard)
+
+    async def send_delta(self, connection: Connection, data: Data) -> None:
+        """
+        Method to send the global map delta to the station
+        :param connection: Station connection
+        :param data: Global map delta
+        """
+
+        try:
+            await connection.async_send(self.loop, data)
+
+        except OSError:
+            # The station handler notices the closed connection and drops the subscription
+            pass
+
+    async def feed_sky(self) -> None:
+        """
+        Method to push every subscribed station the part of the sky within its range, once per refresh
+        """
+
+        next_tick = self.loop.time()
+
+        while True:
+            next_tick += REFRESH_TIME
+            await asyncio.sleep(max(0.0, next_tick - self.loop.time()))
+
+            subscribers = [connection for connection in self.feed_outboxes if connection in self.coverage]
+
+            if not subscribers:
+                continue
+
+            try:
+                # One scan of the area covered by all the stations replaces a query per station
+                rows = await self.loop.run_in_executor(self.db_executor, self.storage.get_space_data_in_area,
+                                                       covering_area(self.coverage.areas[connection]
+                                                                     for connection in subscribers),
+                                                       pd.DateOffset(seconds=REFRESH_TIME))
+                routes = self.coverage.route(rows['x_localization'].to_numpy(), rows['y_localization'].to_numpy())
+
+            except Exception as e:
+                print(f"[SERVER ERROR] {e}")
+                continue
+
+            # The slices are only queued, a station that stops reading loses its stale slices and delays nobody
+            for connection in subscribers:
+                outbox = self.feed_outboxes.get(connection)
+
+                if outbox is None or connection not in routes:
+                    continue
+
+                try:
+                    outbox.put(Data(MessageType.SKY_FEED, add_noise(rows.iloc[routes[connection]])))
+
+                except Exception as e:
+                    print(f"[SERVER ERROR] {e}")
+
+    async def maintain_storage(self) -> None:
+        """
+        Method to run the periodic housekeeping of the storage
+        """
+
+        while True:
+            await asyncio.sleep(MAINTENANCE_INTERVAL_SECONDS)
+
+            try:
+                await self.loop.run_in_executor(self.db_executor, self.storage.maintain)
+
+            except Exception as e:
+                print(f"[SERVER ERROR] {e}")
+
+    def update_database(self, batch: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame, List[AnomalyEvent]]:
+        """
+        Method to run the blocking database work for the batch, executed in the database executor
+        :param batch: Local maps of the stations
+        :return: Global map, fused rows and the anomalies revealed by them
+        """
+
+        self.storage.add_server_read_positions_info(batch.to_dict(orient='records'))
+
+        if self.fusion is not None:
+            fused = self.fusion.fuse(batch)
+
+            if self.track_sources is not None:
+                fused = self.track_sources.keep_local(fused)
+
+            if len(fused) > 0:
+                with self.results_lock:
+                    self.storage.add_filtered_results(fused.to_dict(orient='records'))
+
+        else:
+            # The fusion window also covers the time the readings spent waiting in the ingestion queue
+            time_window = pd.DateOffset(seconds=REFRESH_TIME + INGESTION_BATCH_WINDOW_SECONDS)
+
+            with self.results_lock:
+                fused = self.storage.grouped_information_of_objects_localization(time_window=time_window)
+
+        # The global map is only read when there is a callback drawing it
+        global_map = self.storage.get_result() if self.on_global_map is not None else pd.DataFrame()
+
+        with self.detector_lock:
+            events = self.detector.update(fused)
+
+        return global_map, fused, events
+
+    def merge_tracks(self, tracks: pd.DataFrame) -> List[AnomalyEvent]:
+        """
+        Method to store the fused rows forwarded by another server of the cluster, executed in the database executor
+        :param tracks: Fused rows of the objects near the region of this server
+        :return: Anomalies revealed by the rows
+        """
+
+        if self.track_sources is not None:
+            tracks = self.track_sources.keep_forwarded(tracks)
+
+        if len(tracks) == 0:
+            return []
+
+        with self.results_lock:
+            self.storage.add_filtered_results(tracks.to_dict(orient='records'))
+
+        with self.detector_lock:
+            return self.detector.update(tracks)
+
+    def draw(self, callback: Optional[Callable], *args) -> None:
+        """
+        Method to hand the drawing off to the plot executor
+        :param callback: Drawing callback
+        :param args: Callback arguments
+        """
+
+        if callback is not None:
+            self.plot_executor.submit(callback, *args).add_done_callback(report_failure)
+
+
+# FUNCTIONS
+def report_anomalies(events: List[AnomalyEvent]) -> None:
+    """
+    Method to print the detected anomalies
+    :param events: Detected anomalies
+    """
+
+    for event in events:
+        print("\n Detect anomaly: {0} at {1}".format(event.object_id, event.detection_time))
+        print(event)
+
+
+def report_failure(future: Future) -> None:
+    """
+    Method to report the exception raised by the executor task
+    :param future: Finished task
+    """
+
+    if future.exception() is not None:
+        print(f"[SERVER ERROR] {future.exception()}")
@@ -0,0 +1,145 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Server without the interface, for the nodes nobody watches: ingestion, fusion and anomaly detection only, with the
+plotting packages imported only when the map snapshots are exported as images.
+
+    PYTHONPATH=src python src/server_headless.py --backend sqlite --snapshots snapshots --images
+"""
+
+# BUILT-IN PACKAGES
+import argparse
+import asyncio
+import os
+import time
+import numpy as np
+import pandas as pd
+
+from typing import Optional, List, Tuple
+
+# PROJECT MODULES
+from config import *
+from database.database_storage import create_storage
+from server_core import ServerCore
+
+
+# CLASSES
+class SnapshotExporter:
+    """
+    Class to represent the export of the global map snapshots to files, replacing the previous snapshot
+    """
+
+    def __init__(self, directory: str, interval: float = SNAPSHOT_INTERVAL_SECONDS, images: bool = False) -> None:
+        """
+        Constructor
+        :param directory: Directory of the snapshot files
+        :param interval: Minimal number of seconds between the snapshots
+        :param images: Draw the snapshots into PNG images besides the CSV data
+        """
+
+        self.directory = directory
+        self.interval = interval
+        self.images = images
+        self.last_snapshot = 0.0
+        self.renderer = None
+
+        os.makedirs(directory, exist_ok=True)
+
+    def __call__(self, global_map: pd.DataFrame, locations: List[Tuple[Location, int]], anomalies: List[int],
+                 overlaps: List[Area]) -> None:
+        """
+        Method to export the global map, unless the previous snapshot is too recent
+        :param global_map: Global map
+        :param locations: Locations and ranges of the stations
+        :param anomalies: Objects with detected anomalies
+        :param overlaps: Areas observed by more than one station
+        """
+
+        if time.monotonic() - self.last_snapshot < self.interval:
+            return
+
+        self.last_snapshot = time.monotonic()
+
+        data = global_map.assign(anomaly=np.isin(global_map['object_id'].to_numpy(), anomalies))
+        self.replace("global_map.csv", lambda path: data.to_csv(path, index=False))
+
+        if self.images:
+            self.replace("global_map.png", lambda path: self.draw(path, global_map, locations, anomalies, overlaps))
+
+    def replace(self, name: str, write) -> None:
+        """
+        Method to write the file next to the snapshot and put it in place at once, so a reader never sees it partial
+        :param name: Name of the snapshot file
+        :param write: Callback writing the file at the given path
+        """
+
+        path = os.path.join(self.directory, name)
+        partial = os.path.join(self.directory, f".{name}")
+        write(partial)
+        os.replace(partial, path)
+
+    def draw(self, path: str, global_map: pd.DataFrame, locations: List[Tuple[Location, int]], anomalies: List[int],
+             overlaps: List[Area]) -> None:
+        """
+        Method to draw the global map into the PNG image, the plotting packages imported on the first image
+        :param path: Image file
+        :param global_map: Global map
+        :param locations: Locations and ranges of the stations
+        :param anomalies: Objects with detected anomalies
+        :param overlaps: Areas observed by more than one station
+        """
+
+        from matplotlib.image import imsave
+
+        if self.renderer is None:
+            from matplotlib.figure import Figure
+            from matplotlib.backends.backend_agg import FigureCanvasAgg
+            from utils import MapRenderer
+
+            fig = Figure(figsize=(10, 10), dpi=100)
+            ax = fig.add_subplot(1, 1, 1)
+            ax.set(xlabel="x", ylabel="y")
+            fig.subplots_adjust(right=0.85)
+            self.renderer = MapRenderer(ax, FigureCanvasAgg(fig), fps=float("inf"))
+
+        # The points are animated artists, left out of a saved figure, so the image is the buffer they are blitted to
+        self.renderer.draw(global_map, locations=locations, anomalies=anomalies, overlaps=overlaps)
+        imsave(path, np.asarray(self.renderer.canvas.buffer_rgba()), format="png")
+
+
+# FUNCTIONS
+def run_headless(backend: str = STORAGE_BACKEND, port: int = PORT, snapshots: Optional[str] = None,
+                 interval: float = SNAPSHOT_INTERVAL_SECONDS, images: bool = False) -> None:
+    """
+    Method to run the server without the interface until interrupted
+    :param backend: Storage backend
+    :param port: Server port
+    :param snapshots: Directory of the global map snapshots, None to skip them
+    :param interval: Minimal number of seconds between the snapshots
+    :param images: Draw the snapshots into PNG images besides the CSV data
+    """
+
+    storage = create_storage(backend)
+    storage.upload_data(background=True)
+
+    exporter = SnapshotExporter(snapshots, interval, images) if snapshots is not None else None
+    core = ServerCore(storage, on_global_map=exporter, port=port)
+
+    try:
+        asyncio.run(core.accept_clients())
+
+    except KeyboardInterrupt:
+        print("[SERVER STOPPED]")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the server without the interface")
+    parser.add_argument('--backend', default=STORAGE_BACKEND, help='storage backend: postgresql, sqlite or memory')
+    parser.add_argument('--port', type=int, default=PORT, help='server port')
+    parser.add_argument('--snapshots', help='directory the global map snapshots are exported to')
+    parser.add_argument('--interval', type=float, default=SNAPSHOT_INTERVAL_SECONDS, help='seconds between snapshots')
+    parser.add_argument('--images', action='store_true', help='draw the snapshots into PNG images')
+    args = parser.parse_args()
+
+    run_headless(args.backend, args.port, args.snapshots, args.interval, args.images)
@@ -0,0 +1,295 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# BUILT-IN PACKAGES
+import math
+import threading
+import multiprocessing as mp
+import numpy as np
+import pandas as pd
+
+from multiprocessing.connection import Connection as Pipe
+from typing import List, Dict, Tuple
+
+# PROJECT MODULES
+from config import *
+from anomaly import AnomalyDetector, AnomalyEvent
+from fusion import FusionEngine, FUSED_COLUMNS, fuse_samples
+
+
+# CLASSES
+class SkyTiles:
+    """
+    Class to represent the sky split into a grid of tiles, the outer tiles reaching beyond the space range
+    """
+
+    def __init__(self, n_tiles: int, space_range: Area = SPACE_RANGE) -> None:
+        """
+        Constructor
+        :param n_tiles: Minimal number of tiles
+        :param space_range: Area covered by the tiles
+        """
+
+        x1, y1, x2, y2 = space_range
+        self.columns = math.ceil(math.sqrt(n_tiles))
+        self.rows = math.ceil(n_tiles / self.columns)
+
+        # Inner edges only, so the readings pushed out of the space by the noise fall into the outer tiles
+        self.x_edges = np.linspace(x1, x2, self.columns + 1)[1:-1]
+        self.y_edges = np.linspace(y1, y2, self.rows + 1)[1:-1]
+
+    def __len__(self) -> int:
+        """
+        Number of tiles
+        """
+
+        return self.columns * self.rows
+
+    def tile(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        """
+        Method to find the tiles of the points
+        :param x: x coordinates of the points
+        :param y: y coordinates of the points
+        :return: Tile of every point
+        """
+
+        return np.digitize(y, self.y_edges) * self.columns + np.digitize(x, self.x_edges)
+
+    def halo(self, x: np.ndarray, y: np.ndarray, margin: float) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Method to find the tiles whose area widened by the margin contains the points, the margin being narrower
+        than the tiles, so a point lies in at most four of them
+        :param x: x coordinates of the points
+        :param y: y coordinates of the points
+        :param margin: Width of the halo around every tile
+        :return: Indices of the points and their tiles, a point repeated for every tile
+        """
+
+        points = np.arange(len(x))
+        pairs = np.unique(np.concatenate([self.tile(x + dx, y + dy) * len(x) + points
+                                          for dx in (-margin, margin) for dy in (-margin, margin)]))
+
+        return pairs % max(len(x), 1), pairs // max(len(x), 1)
+
+
+class ShardWorkers:
+    """
+    Class to represent the worker processes sharing the fusion and anomaly detection: every worker fuses the
+    readings of its tiles and tracks the objects whose ID it owns
+    """
+
+    def __init__(self, n_workers: int = FUSION_SHARDS, halo: float = FUSION_SHARD_HALO) -> None:
+        """
+        Constructor
+        :param n_workers: Number of worker processes
+        :param halo: Distance from a tile within which the readings are sent to its worker, wider than the spread
+            of the readings of a sample, so a sample crossing the tile border is whole in both tiles
+        """
+
+        self.tiles = SkyTiles(n_workers)
+        width = min(np.diff(np.concatenate([[SPACE_RANGE[0]], self.tiles.x_edges, [SPACE_RANGE[2]]])).min(),
+                    np.diff(np.concatenate([[SPACE_RANGE[1]], self.tiles.y_edges, [SPACE_RANGE[3]]])).min())
+
+        if halo >= width:
+            raise ValueError(f"Shard halo {halo} must be narrower than the tiles of {width:.0f}, use fewer shards")
+
+        self.halo = halo
+        self.lock = threading.Lock()
+        self.pipes: List[Pipe] = []
+        self.anomalies: Dict[int, List[int]] = {}
+
+        # The workers are spawned rather than forked, as the server already runs threads
+        context = mp.get_context("spawn")
+
+        for worker in range(n_workers):
+            pipe, worker_pipe = context.Pipe()
+            context.Process(target=shard_worker, args=(worker_pipe, self.tiles), name=f"shard-{worker}",
+                            daemon=True).start()
+            self.pipes.append(pipe)
+            self.anomalies[worker] = []
+
+    def __len__(self) -> int:
+        """
+        Number of worker processes
+        """
+
+        return len(self.pipes)
+
+    def call(self, tasks: Dict[int, tuple]) -> Dict[int, object]:
+        """
+        Method to run the tasks on their workers in parallel
+        :param tasks: Task of every worker, its name followed by its arguments
+        :return: Result of every task
+        """
+
+        with self.lock:
+            for worker, task in tasks.items():
+                self.pipes[worker].send(task)
+
+            return {worker: self.pipes[worker].recv() for worker in tasks}
+
+    def fuse(self, readings: Tuple[np.ndarray, ...], gate: float = FUSION_GATE) -> pd.DataFrame:
+        """
+        Method to fuse the readings of the whole samples, the tiles fused by their workers
+        :param readings: Object IDs, speeds, directions, x and y coordinates and sample dates of the readings
+        :param gate: Multiple of the object speed within which a reading must lie from the sample median to be fused
+        :return: Fused rows with the columns of the filtered_results table
+        """
+
+        x, y = readings[3], readings[4]
+        points, tiles = self.tiles.halo(x, y, self.halo)
+        tasks: Dict[int, tuple] = {}
+
+        for tile in np.unique(tiles):
+            rows = points[tiles == tile]
+            worker = int(tile) % len(self)
+            tasks.setdefault(worker, ("fuse", (gate, [])))[1][1].append((int(tile),
+                                                                         tuple(array[rows] for array in readings)))
+
+        fused = [rows for rows in self.call(tasks).values() if len(rows) > 0]
+
+        return pd.concat(fused, ignore_index=True) if fused else pd.DataFrame(columns=FUSED_COLUMNS)
+
+    def detect(self, rows: pd.DataFrame) -> List[AnomalyEvent]:
+        """
+        Method to update the object states with the fused rows, every object tracked by the worker owning its ID
+        :param rows: Fused rows
+        :return: Anomalies revealed by the rows
+        """
+
+        # Every worker forgets the objects not seen by the newest row, even the workers without rows
+        owner = rows['object_id'].to_numpy(dtype=np.int64) % len(self)
+        now = rows['receive_date'].max().to_datetime64()
+        tasks = {worker: ("detect", (rows[owner == worker], now)) for worker in range(len(self))}
+        events = []
+
+        for worker, (worker_events, anomalies) in self.call(tasks).items():
+            events.extend(worker_events)
+            self.anomalies[worker] = anomalies
+
+        return events
+
+    def close(self) -> None:
+        """
+        Method to stop the worker processes
+        """
+
+        with self.lock:
+            for pipe in self.pipes:
+                pipe.send(None)
+
+
+class ShardedFusion(FusionEngine):
+    """
+    Class to represent the fusion buffering the readings in the server and fusing them in the worker processes
+    """
+
+    def __init__(self, workers: ShardWorkers, time_window: float = FUSION_WINDOW_SECONDS,
+                 settle_time: float = FUSION_SETTLE_SECONDS, gate: float = FUSION_GATE) -> None:
+        """
+        Constructor
+        :param workers: Worker processes
+        :param time_window: Number of seconds after which a reading is too old to be fused
+        :param settle_time: Number of seconds to wait for the readings of the other stations before fusing a sample
+        :param gate: Multiple of the object speed within which a reading must lie from the sample median to be fused
+        """
+
+        # A reading as far as the gate from the sample median is still fused, so a tile must receive it too
+        spread = gate * GENERATED_MAX_SPEED + MAX_NOISE_VAL
+
+        if workers.halo < spread:
+            raise ValueError(f"Shard halo {workers.halo} is narrower than the spread of the fused readings of "
+                             f"{spread:.0f}, raise FUSION_SHARD_HALO")
+
+        FusionEngine.__init__(self, time_window, settle_time, gate)
+        self.workers = workers
+
+    def flush(self, cutoff: np.datetime64) -> pd.DataFrame:
+        """
+        Method to fuse and drop the buffered readings of the samples taken up to the cutoff
+        :param cutoff: Newest sample date to fuse
+        :return: Fused rows with the columns of the filtered_results table
+        """
+
+        readings = self.take(cutoff)
+
+        if len(readings[0]) == 0:
+            return pd.DataFrame(columns=FUSED_COLUMNS)
+
+        return self.workers.fuse(readings, self.gate)
+
+
+class ShardedDetector:
+    """
+    Class to represent the anomaly detection run by the worker processes, with the interface of AnomalyDetector
+    """
+
+    def __init__(self, workers: ShardWorkers) -> None:
+        """
+        Constructor
+        :param workers: Worker processes
+        """
+
+        self.workers = workers
+
+    @property
+    def anomalies(self) -> List[int]:
+        """
+        IDs of the objects whose anomaly is remembered
+        """
+
+        return [object_id for anomalies in self.workers.anomalies.values() for object_id in anomalies]
+
+    def update(self, rows: pd.DataFrame) -> List[AnomalyEvent]:
+        """
+        Method to update the object states with the fused rows
+        :param rows: Fused rows with the object_id, x_localization, y_localization, direction and receive_date columns
+        :return: Anomalies revealed by the rows
+        """
+
+        if len(rows) == 0:
+            return []
+
+        return self.workers.detect(rows)
+
+
+# FUNCTIONS
+def shard_worker(pipe: Pipe, tiles: SkyTiles) -> None:
+    """
+    Method to run the tasks of the worker process until stopped
+    :param pipe: Pipe to the server
+    :param tiles: Tiles of the sky
+    """
+
+    detector = AnomalyDetector()
+
+    while True:
+        task = pipe.recv()
+
+        if task is None:
+            return
+
+        name, argument = task
+
+        try:
+            if name == "fuse":
+                gate, tile_readings = argument
+                fused = []
+
+                # The samples crossing the tile border are fused in both tiles and kept by the one holding the result
+                for tile, readings in tile_readings:
+                    rows = fuse_samples(*readings, gate)
+                    x, y = rows['x_localization'].to_numpy(), rows['y_localization'].to_numpy()
+                    fused.append(rows[tiles.tile(x, y) == tile])
+
+                pipe.send(pd.concat(fused, ignore_index=True))
+
+            elif name == "detect":
+                rows, now = argument
+                events = detector.update(rows)
+                detector.expire(now)
+                pipe.send((events, detector.anomalies))
+
+        except Exception as e:
+            print(f"[SHARD ERROR] {e}")
+            pipe.send(pd.DataFrame(columns=FUSED_COLUMNS) if name == "fuse" else ([], detector.anomalies))
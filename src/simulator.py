@@ -0,0 +1,256 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# BUILT-IN PACKAGES
+import argparse
+import math
+import time
+import numpy as np
+import pandas as pd
+
+from socket import socket, AF_INET, SOCK_STREAM
+from typing import Optional, List, Tuple
+from sqlalchemy import create_engine, Table, MetaData, select
+
+# PROJECT MODULES
+from config import *
+from communication import Data, MessageType, Connection, supported_codecs
+from noise import add_noise
+from spatial_index import SpatialGrid, station_area
+from database.database_upload import generate_sky
+
+
+# CLASSES
+class SimulatedStation:
+    """
+    Class to represent the station connected by the simulator
+    """
+
+    def __init__(self, location: Location, rng: int, host: str = HOST, port: int = PORT) -> None:
+        """
+        Constructor
+        :param location: Station location
+        :param rng: Station range
+        :param host: Server host
+        :param port: Server port
+        """
+
+        self.location = location
+        self.range = rng
+        self.connect(host, port)
+
+    def connect(self, host: str, port: int) -> None:
+        """
+        Method to connect the station to the server
+        :param host: Server host
+        :param port: Server port
+        """
+
+        sock = socket(AF_INET, SOCK_STREAM)
+        sock.connect((host, port))
+        self.connection = Connection(sock)
+
+    def join(self) -> None:
+        """
+        Method to negotiate the codec and register the station location, following the redirection to the server
+        owning the location
+        """
+
+        while True:
+            self.connection.send(Data(MessageType.HELLO, supported_codecs()))
+            self.connection.send(Data(MessageType.LOCATION, (self.location, self.range)))
+
+            for alert, content in self.connection.messages():
+                if alert == MessageType.HELLO:
+                    self.connection.codec = content[0]
+
+                elif alert == MessageType.NOT_CONNECTED:
+                    raise ConnectionError(f"Station {self.location} rejected: {content}")
+
+                elif alert == MessageType.CONNECTED:
+                    return
+
+                elif alert == MessageType.REDIRECT:
+                    self.close()
+                    self.connect(*content)
+                    break
+
+    def close(self) -> None:
+        """
+        Method to close the station connection
+        """
+
+        self.connection.sock.close()
+
+
+class Simulator:
+    """
+    Class to represent the simulator streaming the trajectories to the server as the local maps of the stations
+    """
+
+    def __init__(self, sky: pd.DataFrame, rate: float = SIMULATION_RATE, tick: float = SIMULATION_TICK_SECONDS,
+                 n_stations: int = SIMULATION_STATIONS, host: str = HOST, port: int = PORT) -> None:
+        """
+        Constructor
+        :param sky: Trajectory points with the columns of the space_data_generator table
+        :param rate: Number of simulated seconds passing in a second, above 1 for faster than real time
+        :param tick: Number of seconds between the local maps sent by each station
+        :param n_stations: Number of stations, laid out on a square grid covering the space
+        :param host: Server host
+        :param port: Server port
+        """
+
+        self.rate = rate
+        self.tick = tick
+        self.host = host
+        self.port = port
+
+        sky = sky.sort_values('sample_date', kind='stable')
+        self.sample_date = sky['sample_date'].to_numpy(dtype='datetime64[ns]')
+        self.object_id = sky['object_id'].to_numpy(dtype=np.int32)
+        self.speed = sky['speed'].to_numpy(dtype=np.float64)
+        self.direction = sky['direction'].to_numpy(dtype=np.float64)
+        self.x = sky['x_localization'].to_numpy(dtype=np.int32)
+        self.y = sky['y_localization'].to_numpy(dtype=np.int32)
+
+        self.stations = [SimulatedStation(location, rng, host, port) for location, rng in station_locations(n_stations)]
+        self.coverage = SpatialGrid()
+
+        for i, station in enumerate(self.stations):
+            self.coverage.insert(i, station_area((station.location, station.range)))
+
+        self.samples_sent = 0
+
+    def run(self, duration: Optional[float] = None, report_every: float = 5.0) -> None:
+        """
+        Method to stream the samples, each one sent when its simulated date is reached
+        :param duration: Number of seconds after which the simulation stops, None to replay the whole sky
+        :param report_every: Number of seconds between the reports of the sample rate
+        """
+
+        for station in self.stations:
+            station.join()
+
+        print(f"[SIMULATION STARTED] {len(self.sample_date)} samples, {len(self.stations)} stations, rate {self.rate}")
+
+        start_date = self.sample_date[0] if len(self.sample_date) > 0 else np.datetime64('now', 'ns')
+        start_time = time.monotonic()
+        start_wall = np.datetime64(pd.Timestamp.now(), 'ns')
+        next_tick, next_report = start_time, start_time + report_every
+        cursor, reported = 0, 0
+
+        try:
+            while cursor < len(self.sample_date):
+                next_tick += self.tick
+                time.sleep(max(0.0, next_tick - time.monotonic()))
+                now = time.monotonic()
+
+                if duration is not None and now - start_time >= duration:
+                    break
+
+                # Samples are stamped with the wall clock date their simulated date maps to
+                simulated = start_date + np.timedelta64(int((now - start_time) * self.rate * 1e9), 'ns')
+                end = int(np.searchsorted(self.sample_date, simulated, side='right'))
+                receive_date = start_wall + ((self.sample_date[cursor:end] - start_date) / self.rate).astype(
+                    'timedelta64[ns]')
+                self.emit(slice(cursor, end), receive_date)
+                cursor = end
+
+                if now >= next_report:
+                    lag = max(0.0, now - next_tick)
+                    print("[SIMULATION] {0:.0f} samples/s, lag {1:.2f} s".format(
+                        (self.samples_sent - reported) / (now - next_report + report_every), lag))
+                    next_report, reported = now + report_every, self.samples_sent
+
+        finally:
+            for station in self.stations:
+                station.close()
+
+        print(f"[SIMULATION FINISHED] {self.samples_sent} samples sent")
+
+    def emit(self, rows: slice, receive_date: np.ndarray) -> None:
+        """
+        Method to send every station the samples within its range as its local map
+        :param rows: Samples reached since the previous tick
+        :param receive_date: Wall clock dates of the samples
+        """
+
+        x, y = self.x[rows], self.y[rows]
+        routes = self.coverage.route(x, y)
+
+        for i, indices in routes.items():
+            local_map = add_noise(pd.DataFrame({'object_id': self.object_id[rows][indices],
+                                                'speed': self.speed[rows][indices],
+                                                'direction': self.direction[rows][indices],
+                                                'x_localization': x[indices],
+                                                'y_localization': y[indices],
+                                                'receive_date': receive_date[indices]}))
+            self.stations[i].connection.send(Data(MessageType.LOCAL_MAP, local_map))
+            self.samples_sent += len(local_map)
+
+
+# FUNCTIONS
+def station_locations(n_stations: int) -> List[Tuple[Location, int]]:
+    """
+    Method to lay the stations out on a square grid, their ranges together covering the whole space
+    :param n_stations: Number of stations
+    :return: Locations and ranges of the stations
+    """
+
+    x1, y1, x2, y2 = SPACE_RANGE
+    side = math.ceil(math.sqrt(n_stations))
+    width, height = (x2 - x1) / side, (y2 - y1) / side
+    rng = math.ceil(max(width, height) / 2)
+
+    return [([int(x1 + (i % side + 0.5) * width), int(y1 + (i // side + 0.5) * height)], rng)
+            for i in range(n_stations)]
+
+
+def load_sky(replay: Optional[str] = None, db: Optional[str] = None, n_objects: int = GENERATED_OBJECTS_NUMBER,
+             n_anomalies: int = GENERATED_ANOMALY_NUMBER, seed: Optional[int] = GENERATOR_SEED) -> pd.DataFrame:
+    """
+    Method to load the recorded trajectories or to generate new ones
+    :param replay: CSV file with the recorded trajectories, sample_date or receive_date holding the sample dates
+    :param db: Database URL whose space_data_generator table is replayed
+    :param n_objects: Number of generated objects moving along straight lines
+    :param n_anomalies: Number of generated objects changing their trajectory
+    :param seed: Seed of the generator
+    :return: Trajectory points with the columns of the space_data_generator table
+    """
+
+    if replay is not None:
+        sky = pd.read_csv(replay).rename(columns={'receive_date': 'sample_date'})
+        sky['sample_date'] = pd.to_datetime(sky['sample_date'])
+        return sky
+
+    if db is not None:
+        engine = create_engine(db)
+        table = Table('space_data_generator', MetaData(), autoload_with=engine)
+        columns = ['object_id', 'speed', 'direction', 'x_localization', 'y_localization', 'sample_date']
+        return pd.DataFrame(engine.execute(select([table.c[column] for column in columns])).fetchall(), columns=columns)
+
+    return pd.concat(generate_sky(n_objects, n_anomalies, seed), ignore_index=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stream the trajectories to the server as the local maps of stations")
+    parser.add_argument('--rate', type=float, default=SIMULATION_RATE, help='simulated seconds per second')
+    parser.add_argument('--tick', type=float, default=SIMULATION_TICK_SECONDS, help='seconds between local maps')
+    parser.add_argument('--stations', type=int, default=SIMULATION_STATIONS, help='number of stations')
+    parser.add_argument('--objects', type=int, default=GENERATED_OBJECTS_NUMBER, help='number of generated objects')
+    parser.add_argument('--anomalies', type=int, default=GENERATED_ANOMALY_NUMBER, help='number of generated anomalies')
+    parser.add_argument('--seed', type=int, default=GENERATOR_SEED, help='seed of the generator')
+    parser.add_argument('--replay', help='CSV file with the recorded trajectories to replay')
+    parser.add_argument('--db', help='database URL whose space_data_generator table is replayed')
+    parser.add_argument('--record', help='CSV file the simulated trajectories are saved to')
+    parser.add_argument('--duration', type=float, help='seconds after which the simulation stops')
+    parser.add_argument('--host', default=HOST, help='server host')
+    parser.add_argument('--port', type=int, default=PORT, help='server port')
+    args = parser.parse_args()
+
+    sky = load_sky(args.replay, args.db, args.objects, args.anomalies, args.seed)
+
+    if args.record is not None:
+        sky.to_csv(args.record, index=False)
+
+    Simulator(sky, args.rate, args.tick, args.stations, args.host, args.port).run(args.duration)
@@ -0,0 +1,258 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# BUILT-IN PACKAGES
+import numpy as np
+
+from collections import defaultdict
+from itertools import combinations
+from typing import Optional, List, Dict, Set, Tuple, Hashable, Iterable
+
+# PROJECT MODULES
+from config import *
+
+
+# CLASSES
+class SpatialGrid:
+    """
+    Class to represent the uniform grid over the space indexing the areas observed by the stations
+    """
+
+    def __init__(self, space_range: Area = SPACE_RANGE, cell_size: int = GRID_CELL_SIZE) -> None:
+        """
+        Constructor
+        :param space_range: Tuple of x1, y1, x2, y2 coordinates of the indexed space
+        :param cell_size: Side of a single grid cell
+        """
+
+        self.x1, self.y1, self.x2, self.y2 = space_range
+        self.cell_size = cell_size
+        self.n_columns = max(1, -(-(self.x2 - self.x1) // cell_size))
+        self.n_rows = max(1, -(-(self.y2 - self.y1) // cell_size))
+
+        self.cells: Dict[int, Set[Hashable]] = defaultdict(set)
+        self.areas: Dict[Hashable, Area] = {}
+
+    def __len__(self) -> int:
+        """
+        Number of indexed stations
+        """
+
+        return len(self.areas)
+
+    def __contains__(self, key: Hashable) -> bool:
+        """
+        Whether the station is indexed
+        """
+
+        return key in self.areas
+
+    def insert(self, key: Hashable, area: Area) -> None:
+        """
+        Method to index the area observed by the station
+        :param key: Station key
+        :param area: Tuple of x1, y1, x2, y2 coordinates of the observed area
+        """
+
+        self.remove(key)
+        self.areas[key] = area
+
+        for cell in self.cells_of(area):
+            self.cells[cell].add(key)
+
+    def remove(self, key: Hashable) -> None:
+        """
+        Method to remove the station from the index, if present
+        :param key: Station key
+        """
+
+        area = self.areas.pop(key, None)
+
+        if area is None:
+            return
+
+        for cell in self.cells_of(area):
+            self.cells[cell].discard(key)
+
+            if not self.cells[cell]:
+                del self.cells[cell]
+
+    def find(self, area: Area) -> Optional[Hashable]:
+        """
+        Method to find the station observing exactly the given area
+        :param area: Tuple of x1, y1, x2, y2 coordinates of the area
+        :return: Station key or None
+        """
+
+        x1, y1, x2, y2 = area
+        candidates = self.cells.get(self.cell((x1 + x2) / 2, (y1 + y2) / 2), ())
+
+        return next((key for key in candidates if self.areas[key] == tuple(area)), None)
+
+    def stations_at(self, x: float, y: float) -> List[Hashable]:
+        """
+        Method to find all the stations observing the point
+        :param x: x coordinate of the point
+        :param y: y coordinate of the point
+        :return: Station keys
+        """
+
+        return [key for key in self.cells.get(self.cell(x, y), ()) if contains(self.areas[key], x, y)]
+
+    def stations_in(self, area: Area) -> Set[Hashable]:
+        """
+        Method to find all the stations whose areas overlap the given area
+        :param area: Tuple of x1, y1, x2, y2 coordinates of the area
+        :return: Station keys
+        """
+
+        candidates = set().union(*(self.cells.get(cell, ()) for cell in self.cells_of(area)))
+
+        return {key for key in candidates if intersection(self.areas[key], area) is not None}
+
+    def overlaps(self) -> List[Tuple[Area, frozenset]]:
+        """
+        Method to find the areas observed by more than one station
+        :return: Overlapping areas and the pairs of stations observing them
+        """
+
+        pairs = set()
+
+        for keys in self.cells.values():
+            if len(keys) > 1:
+                pairs.update(frozenset(pair) for pair in combinations(keys, 2))
+
+        overlaps = []
+
+        for pair in pairs:
+            a, b = pair
+            area = intersection(self.areas[a], self.areas[b])
+
+            if area is not None:
+                overlaps.append((area, pair))
+
+        return overlaps
+
+    def route(self, x: np.ndarray, y: np.ndarray) -> Dict[Hashable, np.ndarray]:
+        """
+        Method to assign the points to the stations observing them
+        :param x: x coordinates of the points
+        :param y: y coordinates of the points
+        :return: Sorted indices of the points observed by each station, stations observing no point are omitted
+        """
+
+        cells = self.cell_indices(x, y)
+        order = np.argsort(cells, kind='stable')
+        occupied, starts = np.unique(cells[order], return_index=True)
+        ends = np.append(starts[1:], len(order))
+        routes = defaultdict(list)
+
+        for cell, start, end in zip(occupied, starts, ends):
+            keys = self.cells.get(int(cell))
+
+            if not keys:
+                continue
+
+            indices = order[start:end]
+            cell_x, cell_y = x[indices], y[indices]
+
+            for key in keys:
+                x1, y1, x2, y2 = self.areas[key]
+                inside = indices[(cell_x >= x1) & (cell_x <= x2) & (cell_y >= y1) & (cell_y <= y2)]
+
+                if len(inside) > 0:
+                    routes[key].append(inside)
+
+        return {key: np.sort(np.concatenate(parts)) for key, parts in routes.items()}
+
+    def cell(self, x: float, y: float) -> int:
+        """
+        Method to get the cell containing the point, points outside the space fall into the border cells
+        :param x: x coordinate of the point
+        :param y: y coordinate of the point
+        :return: Cell number
+        """
+
+        column = min(max(int((x - self.x1) // self.cell_size), 0), self.n_columns - 1)
+        row = min(max(int((y - self.y1) // self.cell_size), 0), self.n_rows - 1)
+
+        return row * self.n_columns + column
+
+    def cell_indices(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        """
+        Method to get the cells containing the points
+        :param x: x coordinates of the points
+        :param y: y coordinates of the points
+        :return: Cell numbers
+        """
+
+        columns = np.clip((np.asarray(x) - self.x1) // self.cell_size, 0, self.n_columns - 1).astype(np.int64)
+        rows = np.clip((np.asarray(y) - self.y1) // self.cell_size, 0, self.n_rows - 1).astype(np.int64)
+
+        return rows * self.n_columns + columns
+
+    def cells_of(self, area: Area) -> Iterable[int]:
+        """
+        Method to get the cells overlapped by the area
+        :param area: Tuple of x1, y1, x2, y2 coordinates of the area
+        :return: Cell numbers
+        """
+
+        x1, y1, x2, y2 = area
+        first, last = self.cell(x1, y1), self.cell(x2, y2)
+        first_row, first_column = divmod(first, self.n_columns)
+        last_row, last_column = divmod(last, self.n_columns)
+
+        for row in range(first_row, last_row + 1):
+            for column in range(first_column, last_column + 1):
+                yield row * self.n_columns + column
+
+
+# FUNCTIONS
+def station_area(location: Tuple[Location, int]) -> Area:
+    """
+    Method to get the rectangle observed by the station
+    :param location: Location and range of the station
+    :return: Tuple of x1, y1, x2, y2 coordinates of the rectangle
+    """
+
+    (x, y), rng = location
+
+    return x - rng, y - rng, x + rng, y + rng
+
+
+def covering_area(areas: Iterable[Area]) -> Area:
+    """
+    Method to get the smallest rectangle covering all the areas
+    :param areas: Areas
+    :return: Tuple of x1, y1, x2, y2 coordinates of the rectangle
+    """
+
+    x1, y1, x2, y2 = np.array(list(areas)).T
+
+    return int(x1.min()), int(y1.min()), int(x2.max()), int(y2.max())
+
+
+def intersection(a: Area, b: Area) -> Optional[Area]:
+    """
+    Method to get the common part of the areas
+    :param a: First area
+    :param b: Second area
+    :return: Tuple of x1, y1, x2, y2 coordinates of the common part or None if the areas do not overlap
+    """
+
+    x1, y1, x2, y2 = max(a[0], b[0]), max(a[1], b[1]), min(a[2], b[2]), min(a[3], b[3])
+
+    return (x1, y1, x2, y2) if x1 < x2 and y1 < y2 else None
+
+
+def contains(area: Area, x: float, y: float) -> bool:
+    """
+    Method to check whether the point lies within the area, borders included
+    :param area: Tuple of x1, y1, x2, y2 coordinates of the area
+    :param x: x coordinate of the point
+    :param y: y coordinate of the point
+    :return: Whether the area contains the point
+    """
+
+    return area[0] <= x <= area[2] and area[1] <= y <= area[3]
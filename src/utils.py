@@ -2,39 +2,279 @@
 # -*- coding: utf-8 -*-
 
 # BUILT-IN PACKAGES
-import seaborn as sns
+import time
+import threading
+import numpy as np
+import pandas as pd
+import matplotlib
 
-from matplotlib.patches import Rectangle, Circle
+from typing import Optional, List, Dict, Tuple
+from matplotlib.lines import Line2D
+from matplotlib.patches import Rectangle
 
 # PROJECT MODULES
 from config import *
 
 
-# FUNCTIONS
-def draw_map(ax, canvas, map, locations = None, anomalies = None) -> None:
-    ax.clear()
-    sns.scatterplot(data=map, x='x_localization', y='y_localization', hue='object_id', ax=ax)
-
-    if locations is not None:
-        x1, y1, x2, y2 = SPACE_RANGE
-
-        for loc in locations:
-            (x, y), rng = loc
-            ax.scatter([x], [y], marker="*")
-            a = max(x - rng, x1)
-            b = max(y - rng, y1)
-            w = 2 * rng - max(0, a + 2 * rng - x2)
-            h = 2 * rng - max(0, b + 2 * rng - y2)
-            rect = Rectangle((a, b), w, h, fill=False)
-            ax.add_patch(rect)
-
-    if anomalies is not None:
-        for object_id in anomalies:
-            map_ = map[map['object_id'] == object_id]
-            x = map_['x_localization'].to_numpy()
-            y = map_['y_localization'].to_numpy()
-            ax.scatter(x, y, color="red", marker='o')
-
-    ax.legend(loc='center left', bbox_to_anchor=(1, 0.5))
-    ax.grid()
-    canvas.draw()
+# CLASSES
+class MapRenderer:
+    """
+    Class to represent the map drawn incrementally: the stations are drawn once into the background, while the
+    points are moved in place and blitted over it
+    """
+
+    def __init__(self, ax, canvas, fps: float = PLOT_FPS) -> None:
+        """
+        Constructor
+        :param ax: Axes of the map
+        :param canvas: Canvas of the figure
+        :param fps: Maximal number of frames drawn per second
+        """
+
+        self.ax = ax
+        self.canvas = canvas
+        self.frame_time = 1 / fps
+        self.last_frame = 0.0
+        self.pending: Optional[tuple] = None
+
+        # Every object keeps its color between the frames, the objects of a color drawn as the markers of one line,
+        # which stamps a single rendered marker instead of drawing every point as a path
+        colors = matplotlib.colormaps['tab20']
+        self.points = [ax.plot([], [], color=colors(i), marker='o', linestyle='', animated=True)[0]
+                       for i in range(colors.N)]
+        self.anomaly_points = ax.plot([], [], color="red", marker='o', linestyle='', animated=True)[0]
+        self.static_artists = []
+        self.locations: Optional[List[Tuple[Location, int]]] = None
+        self.overlaps: Optional[List[Area]] = None
+
+        ax.set(xlim=(SPACE_RANGE[0], SPACE_RANGE[2]), ylim=(SPACE_RANGE[1], SPACE_RANGE[3]))
+        ax.legend(handles=[Line2D([], [], color="gray", marker='o', linestyle='', label="objects"),
+                           Line2D([], [], color="red", marker='o', linestyle='', label="anomalies"),
+                           Line2D([], [], color="black", marker='*', linestyle='', label="stations")],
+                  loc='center left', bbox_to_anchor=(1, 0.5))
+        ax.grid()
+
+        self.background = None
+        canvas.mpl_connect('draw_event', self.on_draw)
+
+        # The skipped frame is drawn by a single shot timer of the canvas once the frame time passes
+        self.timer = canvas.new_timer()
+        self.timer.single_shot = True
+        self.timer.add_callback(self.on_timer)
+
+    def draw(self, map: pd.DataFrame, locations: Optional[List[Tuple[Location, int]]] = None,
+             anomalies: Optional[List[int]] = None, overlaps: Optional[List[Area]] = None) -> bool:
+        """
+        Method to draw the map, skipped when the previous frame is too recent and kept until the next frame
+        :param map: Points with the object_id, x_localization and y_localization columns
+        :param locations: Locations and ranges of the stations
+        :param anomalies: Objects with detected anomalies
+        :param overlaps: Areas observed by more than one station
+        :return: Whether the frame was drawn
+        """
+
+        self.pending = (map, locations, anomalies, overlaps)
+        wait = self.frame_time - (time.monotonic() - self.last_frame)
+
+        if wait > 0:
+            self.timer.interval = max(1, int(wait * 1000))
+            self.timer.start()
+            return False
+
+        return self.flush()
+
+    def flush(self) -> bool:
+        """
+        Method to draw the latest skipped frame
+        :return: Whether a frame was drawn
+        """
+
+        if self.pending is None:
+            return False
+
+        map, locations, anomalies, overlaps = self.pending
+        self.pending = None
+        self.last_frame = time.monotonic()
+
+        object_id = map['object_id'].to_numpy(dtype=np.int64)
+        x = map['x_localization'].to_numpy(dtype=np.float64)
+        y = map['y_localization'].to_numpy(dtype=np.float64)
+
+        color = object_id % len(self.points)
+        order = np.argsort(color, kind='stable')
+        bounds = np.searchsorted(color[order], np.arange(len(self.points) + 1))
+
+        for i, line in enumerate(self.points):
+            rows = order[bounds[i]:bounds[i + 1]]
+            line.set_data(x[rows], y[rows])
+
+        anomalous = np.isin(object_id, anomalies) if anomalies else np.zeros(len(object_id), dtype=bool)
+        self.anomaly_points.set_data(x[anomalous], y[anomalous])
+
+        if locations != self.locations or overlaps != self.overlaps:
+            # The background changes, so the whole figure is drawn and the points are drawn over it on the draw event
+            self.draw_static(locations, overlaps)
+            self.canvas.draw_idle()
+
+        elif self.background is None:
+            self.canvas.draw_idle()
+
+        else:
+            self.canvas.restore_region(self.background)
+            self.draw_dynamic()
+            self.canvas.blit(self.canvas.figure.bbox)
+
+        return True
+
+    def on_timer(self) -> None:
+        """
+        Method to draw the frame skipped by the draw method, unless a later frame was drawn meanwhile
+        """
+
+        self.flush()
+
+    def draw_static(self, locations: Optional[List[Tuple[Location, int]]], overlaps: Optional[List[Area]]) -> None:
+        """
+        Method to replace the stations and the overlapping areas drawn into the background
+        :param locations: Locations and ranges of the stations
+        :param overlaps: Areas observed by more than one station
+        """
+
+        for artist in self.static_artists:
+            artist.remove()
+
+        self.static_artists = []
+        self.locations, self.overlaps = locations, overlaps
+
+        if locations is not None:
+            x1, y1, x2, y2 = SPACE_RANGE
+
+            for loc in locations:
+                (x, y), rng = loc
+                self.static_artists.append(self.ax.scatter([x], [y], color="black", marker="*"))
+                a = max(x - rng, x1)
+                b = max(y - rng, y1)
+                w = 2 * rng - max(0, a + 2 * rng - x2)
+                h = 2 * rng - max(0, b + 2 * rng - y2)
+                self.static_artists.append(self.ax.add_patch(Rectangle((a, b), w, h, fill=False)))
+
+        if overlaps is not None:
+            for x1, y1, x2, y2 in overlaps:
+                self.static_artists.append(self.ax.add_patch(Rectangle((x1, y1), x2 - x1, y2 - y1, alpha=0.2)))
+
+    def draw_dynamic(self) -> None:
+        """
+        Method to draw the points over the background
+        """
+
+        for line in self.points:
+            self.ax.draw_artist(line)
+
+        self.ax.draw_artist(self.anomaly_points)
+
+    def on_draw(self, event) -> None:
+        """
+        Method to save the background after the whole figure is drawn and to draw the points over it
+        :param event: Draw event
+        """
+
+        self.background = self.canvas.copy_from_bbox(self.canvas.figure.bbox)
+        self.draw_dynamic()
+
+
+class FrameQueue:
+    """
+    Class to represent the frames waiting to be drawn, a single one per map: a new frame replaces the stale one
+    """
+
+    def __init__(self) -> None:
+        """
+        Constructor
+        """
+
+        self.lock = threading.Lock()
+        self.frames: Dict[str, Tuple[tuple, dict]] = {}
+        self.dropped = 0
+
+    def publish(self, name: str, *args, **kwargs) -> None:
+        """
+        Method to queue the frame of the map, safe to call from any thread
+        :param name: Name of the map
+        :param args: Arguments of the renderer draw method
+        :param kwargs: Keyword arguments of the renderer draw method
+        """
+
+        with self.lock:
+            if name in self.frames:
+                self.dropped += 1
+
+            self.frames[name] = (args, kwargs)
+
+    def take(self) -> Dict[str, Tuple[tuple, dict]]:
+        """
+        Method to take the queued frames
+        :return: Latest frame of every map by the name of the map
+        """
+
+        with self.lock:
+            frames, self.frames = self.frames, {}
+
+        return frames
+
+
+class RenderLoop:
+    """
+    Class to represent the drawing of the maps in the Tk main loop: the network and database threads only publish
+    the frames, which are drawn at a fixed cadence
+    """
+
+    def __init__(self, root, renderers: Dict[str, MapRenderer], fps: float = PLOT_FPS) -> None:
+        """
+        Constructor
+        :param root: Tk root scheduling the drawing
+        :param renderers: Renderers by the name of the map
+        :param fps: Number of frames drawn per second
+        """
+
+        self.root = root
+        self.renderers = renderers
+        self.frames = FrameQueue()
+        self.interval = max(1, int(1000 / fps))
+
+    def publish(self, name: str, *args, **kwargs) -> None:
+        """
+        Method to queue the frame of the map, safe to call from any thread
+        :param name: Name of the map
+        :param args: Arguments of the renderer draw method
+        :param kwargs: Keyword arguments of the renderer draw method
+        """
+
+        self.frames.publish(name, *args, **kwargs)
+
+    def start(self) -> None:
+        """
+        Method to schedule the first frame
+        """
+
+        self.root.after(self.interval, self.tick)
+
+    def tick(self) -> None:
+        """
+        Method to draw the latest frame of every map, or the frame its renderer skipped, and schedule the next tick
+        """
+
+        frames = self.frames.take()
+
+        for name, renderer in self.renderers.items():
+            try:
+                if name in frames:
+                    args, kwargs = frames[name]
+                    renderer.draw(*args, **kwargs)
+
+                else:
+                    renderer.flush()
+
+            except Exception as e:
+                print(f"[RENDER ERROR] {e}")
+
+        self.root.after(self.interval, self.tick)
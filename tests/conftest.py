@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The src modules import each other by their bare names, the database modules through the src package
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, 'src'), ROOT]
@@ -0,0 +1,80 @@
+import math
+import numpy as np
+import pandas as pd
+import pytest
+
+from anomaly import AnomalyDetector
+
+START = np.datetime64('2024-01-01T12:00:00', 'ns')
+EAST = math.pi / 2
+NORTH = 0.0
+
+
+def track(points: list, object_id: int = 1) -> pd.DataFrame:
+    """Fused rows of a single object given as (x, y, direction, seconds after START) tuples."""
+    x, y, direction, seconds = zip(*points)
+    return pd.DataFrame({'object_id': object_id, 'x_localization': x, 'y_localization': y, 'direction': direction,
+                         'receive_date': START + (np.array(seconds) * 1e9).astype('timedelta64[ns]')})
+
+
+def seconds(time: pd.Timestamp) -> float:
+    return (time.to_datetime64() - START) / np.timedelta64(1, 's')
+
+
+def test_straight_motion_is_not_an_anomaly():
+    detector = AnomalyDetector(min_displacement=5)
+
+    assert detector.update(track([(10.0 * t, 0.0, EAST, t) for t in range(20)])) == []
+    assert detector.anomalies == []
+
+
+def test_turn_onset_lies_between_the_readings():
+    # Eastwards at 10 per second, turning north at x = 105 half way between the readings
+    points = [(10.0 * t, 0.0, EAST, t) for t in range(11)] + [(105.0, 5.0, NORTH, 11), (105.0, 15.0, NORTH, 12)]
+    detector = AnomalyDetector(min_displacement=5)
+
+    events = detector.update(track(points))
+
+    assert len(events) == 1
+    event = events[0]
+    assert (event.object_id, event.reason) == (1, "heading")
+    assert (event.x, event.y) == pytest.approx((105.0, 0.0))
+    assert seconds(event.time) == pytest.approx(10.5)
+    assert seconds(event.detection_time) == 11
+    assert detector.anomalies == [1]
+
+
+def test_turn_onset_is_found_across_updates():
+    points = [(10.0 * t, 0.0, EAST, t) for t in range(11)] + [(105.0, 5.0, NORTH, 11)]
+    detector = AnomalyDetector(min_displacement=5)
+
+    events = [event for point in points for event in detector.update(track([point]))]
+
+    assert [event.reason for event in events] == ["heading"]
+    assert (events[0].x, events[0].y) == pytest.approx((105.0, 0.0))
+    assert seconds(events[0].time) == pytest.approx(10.5)
+
+
+def test_speed_onset_is_located_on_the_trajectory():
+    # Eastwards at 10 per second, then at 40 per second from x = 100
+    points = [(10.0 * t, 0.0, EAST, t) for t in range(11)] + [(100.0 + 40.0 * t, 0.0, EAST, 10 + t) for t in (1, 2)]
+    detector = AnomalyDetector(min_displacement=5)
+
+    events = detector.update(track(points))
+
+    assert len(events) == 1
+    event = events[0]
+    assert event.reason == "speed"
+    assert (event.x, event.y) == pytest.approx((100.0, 0.0), abs=1.0)
+    assert seconds(event.time) == pytest.approx(10.0, abs=0.1)
+    assert seconds(event.detection_time) == 11
+
+
+def test_anomalies_of_objects_no_longer_seen_are_forgotten():
+    points = [(10.0 * t, 0.0, EAST, t) for t in range(11)] + [(105.0, 5.0, NORTH, 11)]
+    detector = AnomalyDetector(min_displacement=5, state_ttl=30)
+    detector.update(track(points))
+
+    detector.update(track([(0.0, 0.0, EAST, 100)], object_id=2))
+
+    assert detector.anomalies == []
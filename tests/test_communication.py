@@ -0,0 +1,221 @@
+import numpy as np
+import pandas as pd
+import pytest
+import socket
+
+from communication import Data, MessageType, Codec, ProtocolError, FrameReader, Connection, encode, decode, HEADER, \
+    MAGIC, PROTOCOL_VERSION, SIZE, negotiate_codec
+
+
+def readings(n_rows: int = 5) -> pd.DataFrame:
+    return pd.DataFrame({'object_id': np.arange(n_rows, dtype=np.int32),
+                         'speed': np.linspace(1.5, 9.5, n_rows),
+                         'direction': np.linspace(-3.1, 3.1, n_rows),
+                         'x_localization': np.arange(-n_rows, 0, dtype=np.int32) * 100,
+                         'y_localization': np.arange(n_rows, dtype=np.int32) * 100,
+                         'receive_date': pd.date_range('2024-01-01', periods=n_rows, freq='500ms').to_numpy()})
+
+
+def framed(data: Data) -> bytes:
+    message = encode(data)
+    return SIZE.pack(len(message)) + message
+
+
+@pytest.fixture
+def sockets():
+    sender, receiver = socket.socketpair()
+    yield sender, receiver
+    sender.close()
+    receiver.close()
+
+
+def receive(reader: FrameReader, sender: socket.socket, chunks: list) -> list:
+    """Send the chunks one at a time and decode the frames completed by every one of them."""
+    received = []
+    for chunk in chunks:
+        sender.sendall(chunk)
+        reader.read()
+        # A frame is only valid until the next read, so it is decoded at once
+        received.append([decode(frame) for frame in reader.frames()])
+    return received
+
+
+def round_trip(alert: MessageType, content) -> tuple:
+    return decode(encode(Data(alert, content)))
+
+
+def test_location_round_trip():
+    assert round_trip(MessageType.LOCATION, ([-120, 340], 250)) == (MessageType.LOCATION, ([-120, 340], 250))
+
+
+def test_local_map_round_trip():
+    alert, table = round_trip(MessageType.LOCAL_MAP, readings())
+
+    assert alert == MessageType.LOCAL_MAP
+    pd.testing.assert_frame_equal(table, readings(), check_dtype=False)
+
+
+def test_empty_local_map_round_trip():
+    alert, table = round_trip(MessageType.LOCAL_MAP, readings(0))
+
+    assert alert == MessageType.LOCAL_MAP
+    assert len(table) == 0
+    assert list(table.columns) == list(readings().columns)
+
+
+def test_global_map_round_trip():
+    global_map = readings()[['object_id', 'x_localization', 'y_localization']]
+    locations = [([0, 0], 100), ([-500, 500], 250)]
+    alert, (table, decoded_locations) = round_trip(MessageType.GLOBAL_MAP, [global_map, locations])
+
+    assert alert == MessageType.GLOBAL_MAP
+    pd.testing.assert_frame_equal(table, global_map, check_dtype=False)
+    assert decoded_locations == locations
+
+
+def test_global_delta_round_trip():
+    rows = readings()[['object_id', 'x_localization', 'y_localization', 'receive_date']]
+    rows.insert(0, 'index', np.arange(10, 15, dtype=np.int64))
+    alert, (watermark, snapshot, table, locations) = round_trip(MessageType.GLOBAL_DELTA, (14, True, rows, []))
+
+    assert (alert, watermark, snapshot, locations) == (MessageType.GLOBAL_DELTA, 14, True, [])
+    pd.testing.assert_frame_equal(table, rows, check_dtype=False)
+
+
+@pytest.mark.parametrize('alert, content', [
+    (MessageType.NOT_CONNECTED, 'Location already taken'),
+    (MessageType.HELLO, (Codec.ZLIB, Codec.LZMA)),
+    (MessageType.GLOBAL_SUBSCRIBE, 42),
+    (MessageType.GLOBAL_ACK, 7),
+    (MessageType.REDIRECT, ('localhost', 2122)),
+    (MessageType.PEER, 2),
+])
+def test_scalar_messages_round_trip(alert, content):
+    assert round_trip(alert, content) == (alert, content)
+
+
+def test_float_coordinates_are_rounded():
+    table = readings().astype({'x_localization': np.float64})
+    table['x_localization'] += 0.6
+
+    _, decoded = round_trip(MessageType.LOCAL_MAP, table)
+
+    assert decoded['x_localization'].tolist() == (readings()['x_localization'] + 1).tolist()
+
+
+def test_malformed_messages_are_rejected():
+    message = encode(Data(MessageType.LOCAL_MAP, readings()))
+
+    with pytest.raises(ProtocolError):
+        decode(message[:HEADER.size - 1])
+    with pytest.raises(ProtocolError):
+        decode(b'XX' + message[2:])
+    with pytest.raises(ProtocolError):
+        decode(message[:-1])
+    with pytest.raises(ProtocolError):
+        decode(HEADER.pack(MAGIC, PROTOCOL_VERSION, 99, 0))
+
+
+def test_frame_split_across_reads(sockets):
+    sender, receiver = sockets
+    stream = framed(Data(MessageType.LOCAL_MAP, readings()))
+    # Split inside the size prefix and inside the payload
+    chunks = [stream[:2], stream[2:SIZE.size + 10], stream[SIZE.size + 10:]]
+
+    received = receive(FrameReader(receiver), sender, chunks)
+
+    assert [len(frames) for frames in received] == [0, 0, 1]
+    pd.testing.assert_frame_equal(received[2][0][1], readings(), check_dtype=False)
+
+
+def test_several_frames_in_a_single_read(sockets):
+    sender, receiver = sockets
+    stream = b''.join(framed(Data(MessageType.GLOBAL_ACK, watermark)) for watermark in range(3))
+    partial = framed(Data(MessageType.PEER, 5))
+
+    received = receive(FrameReader(receiver), sender, [stream + partial[:3], partial[3:]])
+
+    assert received == [[(MessageType.GLOBAL_ACK, 0), (MessageType.GLOBAL_ACK, 1), (MessageType.GLOBAL_ACK, 2)],
+                        [(MessageType.PEER, 5)]]
+
+
+def test_buffer_grows_for_a_frame_larger_than_the_buffer(sockets):
+    sender, receiver = sockets
+    reader = FrameReader(receiver, buffer_size=64)
+    stream = framed(Data(MessageType.LOCAL_MAP, readings(100)))
+    chunks = [stream[i:i + 50] for i in range(0, len(stream), 50)]
+
+    received = [frame for frames in receive(reader, sender, chunks) for frame in frames]
+
+    assert len(received) == 1
+    assert len(reader.buffer) >= len(stream)
+    pd.testing.assert_frame_equal(received[0][1], readings(100), check_dtype=False)
+
+
+def test_oversized_frame_is_rejected(sockets):
+    sender, receiver = sockets
+    reader = FrameReader(receiver, max_frame_size=16)
+
+    with pytest.raises(ProtocolError):
+        receive(reader, sender, [framed(Data(MessageType.LOCAL_MAP, readings()))])
+
+
+def test_closed_connection_is_reported(sockets):
+    sender, receiver = sockets
+    sender.close()
+
+    with pytest.raises(ConnectionError):
+        FrameReader(receiver).read()
+
+
+def connections(sockets, codec: Codec, **kwargs) -> tuple:
+    sender, receiver = (Connection(sock, **kwargs) for sock in sockets)
+    sender.codec = receiver.codec = codec
+    return sender, receiver
+
+
+@pytest.mark.parametrize('codec', [Codec.NONE, Codec.ZLIB, Codec.LZMA])
+def test_compressed_round_trip(sockets, codec):
+    sender, receiver = connections(sockets, codec)
+    local_map = readings(1000)
+    local_map['speed'] = 10.0
+
+    sender.send(Data(MessageType.LOCAL_MAP, local_map))
+    sender.send(Data(MessageType.GLOBAL_ACK, 3))
+    messages = receiver.messages()
+    alert, table = next(messages)
+
+    assert alert == MessageType.LOCAL_MAP
+    pd.testing.assert_frame_equal(table, local_map, check_dtype=False)
+    assert next(messages) == (MessageType.GLOBAL_ACK, 3)
+    # Only the large frame is compressed, the acknowledgement stays below the threshold
+    assert sender.stats.frames_compressed == (0 if codec == Codec.NONE else 1)
+    assert (sender.stats.bytes_saved > 0) == (codec != Codec.NONE)
+    assert receiver.stats.raw_bytes_received == sender.stats.raw_bytes_sent
+
+
+def test_compressed_frame_without_negotiated_codec_is_rejected(sockets):
+    sender, receiver = connections(sockets, Codec.ZLIB)
+    receiver.codec = Codec.NONE
+    sender.send(Data(MessageType.LOCAL_MAP, readings(1000)))
+
+    with pytest.raises(ProtocolError):
+        next(receiver.messages())
+
+
+@pytest.mark.parametrize('codec', [Codec.ZLIB, Codec.LZMA])
+def test_payload_expanding_beyond_the_frame_limit_is_rejected(sockets, codec):
+    sender, receiver = connections(sockets, codec)
+    receiver.max_frame_size = 4096
+    local_map = readings(1000).assign(speed=0.0, direction=0.0, x_localization=0, y_localization=0, object_id=0)
+
+    sender.send(Data(MessageType.LOCAL_MAP, local_map))
+
+    with pytest.raises(ProtocolError):
+        next(receiver.messages())
+
+
+def test_codec_negotiation():
+    assert negotiate_codec((Codec.LZMA, Codec.ZLIB)) == Codec.LZMA
+    assert negotiate_codec((Codec.ZLIB,)) == Codec.ZLIB
+    assert negotiate_codec(()) == Codec.NONE
@@ -0,0 +1,83 @@
+import numpy as np
+import pandas as pd
+
+from fusion import FusionEngine, fuse_samples
+
+NOW = np.datetime64('2024-01-01T12:00:00', 'ns')
+
+
+def readings(rows: list) -> pd.DataFrame:
+    """Readings given as (object_id, speed, x, y, seconds before NOW) tuples, all with the same direction."""
+    object_id, speed, x, y, age = zip(*rows)
+    return pd.DataFrame({'object_id': object_id, 'speed': speed, 'direction': 0.5, 'x_localization': x,
+                         'y_localization': y,
+                         'receive_date': NOW - (np.array(age) * 1e9).astype('timedelta64[ns]')})
+
+
+def fuse(engine: FusionEngine, rows: list, seconds_later: float = 0) -> pd.DataFrame:
+    return engine.fuse(readings(rows), NOW + np.timedelta64(int(seconds_later * 1e9), 'ns'))
+
+
+def test_readings_of_a_sample_are_averaged():
+    fused = fuse(FusionEngine(settle_time=1.0),
+                 [(1, 10.0, 100, 200, 2), (1, 10.0, 104, 206, 2), (1, 10.0, 102, 204, 2)])
+
+    assert fused[['object_id', 'x_localization', 'y_localization']].values.tolist() == [[1, 102, 203]]
+
+
+def test_reading_outside_the_gate_is_dropped():
+    # The median is at x = 102, the last reading lies 4 speeds away from it
+    fused = fuse(FusionEngine(settle_time=1.0, gate=1.5),
+                 [(1, 10.0, 100, 0, 2), (1, 10.0, 104, 0, 2), (1, 10.0, 102, 0, 2), (1, 10.0, 142, 0, 2)])
+
+    assert fused['x_localization'].tolist() == [102]
+
+
+def test_reading_inside_the_gate_is_kept():
+    fused = fuse(FusionEngine(settle_time=1.0, gate=1.5),
+                 [(1, 10.0, 100, 0, 2), (1, 10.0, 104, 0, 2), (1, 10.0, 102, 0, 2), (1, 10.0, 114, 0, 2)])
+
+    assert fused['x_localization'].tolist() == [105]
+
+
+def test_sample_with_all_readings_outside_the_gate_is_still_fused():
+    fused = fuse(FusionEngine(settle_time=1.0, gate=1.5), [(1, 1.0, 0, 0, 2), (1, 1.0, 100, 0, 2)])
+
+    assert fused['x_localization'].tolist() == [50]
+
+
+def test_samples_are_fused_once_settled():
+    engine = FusionEngine(settle_time=1.0)
+
+    # The sample taken half a second ago waits for the readings of the other stations
+    assert len(fuse(engine, [(1, 10.0, 100, 0, 0.5)])) == 0
+    assert len(engine) == 1
+
+    fused = fuse(engine, [(1, 10.0, 110, 0, 0.5)], seconds_later=0.6)
+
+    assert fused['x_localization'].tolist() == [105]
+    assert len(engine) == 0
+
+
+def test_late_and_old_readings_are_dropped():
+    engine = FusionEngine(time_window=10.0, settle_time=1.0)
+    fuse(engine, [(1, 10.0, 100, 0, 2)])
+
+    # A reading of the sample already fused and a reading older than the window are not buffered
+    fused = fuse(engine, [(1, 10.0, 120, 0, 2), (2, 10.0, 0, 0, 11)])
+
+    assert len(fused) == 0
+    assert len(engine) == 0
+    assert engine.late_readings == 2
+
+
+def test_samples_are_told_apart_by_object_date_and_direction():
+    rows = readings([(1, 10.0, 0, 0, 2), (1, 10.0, 10, 0, 2), (2, 10.0, 50, 0, 2), (1, 10.0, 80, 0, 3)])
+    rows.loc[1, 'direction'] = 0.7
+
+    fused = fuse_samples(rows['object_id'].to_numpy(), rows['speed'].to_numpy(), rows['direction'].to_numpy(),
+                         rows['x_localization'].to_numpy(dtype=float), rows['y_localization'].to_numpy(dtype=float),
+                         rows['receive_date'].to_numpy())
+
+    assert len(fused) == 4
+    assert sorted(fused['x_localization'].tolist()) == [0, 10, 50, 80]
@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from config import SPACE_RANGE, MAX_NOISE_VAL
+from database.database_upload import generate_sky
+from fusion import fuse_samples
+from sharding import SkyTiles, ShardWorkers, ShardedFusion
+
+
+def station_readings(n_stations: int = 3, seed: int = 0) -> tuple:
+    """Readings of the generated sky seen by every station with its own noise and an outlier per station.
+
+    :param n_stations: Number of stations.
+    :param seed: Random seed.
+    :return: Object IDs, speeds, directions, x and y coordinates and sample dates of the readings.
+    """
+    rng = np.random.default_rng(seed)
+    sky = pd.concat(generate_sky(200, 20, seed), ignore_index=True)
+    readings = []
+
+    for _ in range(n_stations):
+        station = sky.copy()
+        station['x_localization'] += rng.integers(0, MAX_NOISE_VAL + 1)
+        station['y_localization'] += rng.integers(0, MAX_NOISE_VAL + 1)
+        # Readings off by up to the gate, fused or not depending on the sample
+        off = rng.random(len(station)) < 0.05
+        station.loc[off, 'x_localization'] += (station['speed'][off] * rng.uniform(-2, 2, off.sum())).astype(int)
+        readings.append(station)
+
+    readings = pd.concat(readings, ignore_index=True)
+    return (readings['object_id'].to_numpy(), readings['speed'].to_numpy(), readings['direction'].to_numpy(),
+            readings['x_localization'].to_numpy(dtype=np.float64),
+            readings['y_localization'].to_numpy(dtype=np.float64), readings['sample_date'].to_numpy())
+
+
+def sorted_rows(rows: pd.DataFrame) -> pd.DataFrame:
+    return rows.sort_values(['object_id', 'receive_date', 'direction']).reset_index(drop=True)
+
+
+@pytest.fixture(scope='module')
+def workers():
+    workers = ShardWorkers(4)
+    yield workers
+    workers.close()
+
+
+def test_sharded_fusion_matches_in_process_fusion(workers):
+    readings = station_readings()
+    expected = sorted_rows(fuse_samples(*readings))
+    actual = sorted_rows(workers.fuse(readings))
+
+    pd.testing.assert_frame_equal(actual, expected, check_dtype=False)
+
+
+def test_every_point_lies_in_a_single_tile():
+    tiles = SkyTiles(4)
+    x = np.array([SPACE_RANGE[0] - 50, 0, -1, SPACE_RANGE[2] + 50])
+    y = np.array([SPACE_RANGE[1] - 50, 0, -1, SPACE_RANGE[3] + 50])
+
+    assert tiles.tile(x, y).tolist() == [0, 3, 0, 3]
+
+
+def test_halo_narrower_than_the_gate_is_rejected(workers):
+    workers.halo, halo = 4 * MAX_NOISE_VAL, workers.halo
+    try:
+        with pytest.raises(ValueError):
+            ShardedFusion(workers)
+    finally:
+        workers.halo = halo
+
+
+def test_halo_wider_than_the_tiles_is_rejected():
+    with pytest.raises(ValueError):
+        ShardWorkers(4, halo=SPACE_RANGE[2] - SPACE_RANGE[0])